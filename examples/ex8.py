@@ -6,6 +6,7 @@ sys.path.append(dir_path + '/../src')
 
 import load_data
 import gdf_utils
+import pipeline
 import plot_utils
 import browser
 from gen_util import lambert, geodetic, Can_LCC_wkt, BBox, Timer, Period, ON_bbox
@@ -34,41 +35,26 @@ def main():
     hydat = gdf_utils.point_gdf_from_df(hydat)
     pwqmn = gdf_utils.point_gdf_from_df(pwqmn)
 
-    # load the Ontario Hydro Network River dataset
+    # the Ontario Hydro Network River dataset
     path = os.path.join(load_data.data_path,
                         os.path.join("OHN", "Ontario_Hydro_Network_(OHN)_-_Watercourse.shp"))
 
-    print('ohn networking')
-    ohn_lines = load_data.load_rivers(path=path)
-    # assign stations
-    ohn_lines = gdf_utils.assign_stations(ohn_lines, hydat, prefix='hydat')
-    ohn_lines = gdf_utils.assign_stations(ohn_lines, pwqmn, prefix='pwqmn')
-    # convert to network
-    ohn_network = gdf_utils.hyriv_gdf_to_network(ohn_lines)
-
-    # load the Ontario Hydro Network River dataset
-    print('hydrorivers networking')
-    hydroRIVERS_lines = load_data.load_rivers()
-    # assign stations
-    hydroRIVERS_lines = gdf_utils.assign_stations(hydroRIVERS_lines, hydat, prefix='hydat')
-    hydroRIVERS_lines = gdf_utils.assign_stations(hydroRIVERS_lines, pwqmn, prefix='pwqmn')
-    # convert to network 
-    hydroRIVERS_network = gdf_utils.hyriv_gdf_to_network(hydroRIVERS_lines)
-
-    # perform the matching for each river network
-    ohn_edge_df = gdf_utils.dfs_search(ohn_network, prefix1='hydat', prefix2='pwqmn', max_depth=100, max_distance=10000)
-    hydro_edge_df = gdf_utils.dfs_search(hydroRIVERS_network, prefix1='hydat', prefix2='pwqmn', max_distance=10000)
-    
+    # load, assign stations to, build, and search each river network in
+    # its own process, then merge the matches of both networks. Adds an
+    # 'error' column holding the % difference between the OHN and
+    # hydroRIVERS distance. Both networks are built with momepy so that
+    # they are connected the same way
+    table, timings = pipeline.compare_networks(
+        {'hyRivers': {'path': load_data.hydroRIVERS_path, 'method': 'momepy'},
+         'OHN': {'path': path, 'method': 'momepy', 'max_depth': 100}},
+        {'hydat': hydat, 'pwqmn': pwqmn}, prefix1='hydat', prefix2='pwqmn',
+        reference='OHN', max_distance=10000)
+
     # format the output table
-    ohn_edge_df.drop(columns=['path', 'seg_apart'], inplace=True)
-    hydro_edge_df.drop(columns=['path', 'seg_apart'], inplace=True)
-    
-    # merge the results
-    table = hydro_edge_df.merge(ohn_edge_df, how='outer', on=['hydat_id', 'pwqmn_id'],
-                                suffixes=('_hyRivers', '_OHN'))
-    # calculate the % difference between the OHN and hydroRIVERS distance
-    table = table.assign(error=(table['dist_hyRivers'] - table['dist_OHN']) / table['dist_OHN'])
+    table = table.drop(columns=['seg_apart_hyRivers', 'seg_apart_OHN'])
+    table = table.rename(columns={'error_hyRivers': 'error'})
 
+    print(timings)
     print(table)
     print("saving to table.csv")
     # save the results to 'table.csv'
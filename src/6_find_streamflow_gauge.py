@@ -188,10 +188,8 @@ for dd in data['value'][start:end]:
 # perform matching
 # -------------------------------
 if dataset is None:
-    lines = load_data.load_rivers()
-else:
-    lines = load_data.load_rivers(path=dataset)
-    
+    dataset = load_data.hydroRIVERS_path
+
 
 hydat = load_data.get_hydat_stations()
 hydat = gdf_utils.point_gdf_from_df(hydat)
@@ -210,17 +208,31 @@ observations.drop(columns=['ResultSampleFraction', 'ResultValue', 'ResultUnit',
 # If you wish to snap stations to rivers that are farther than
 # 750 m away, add "max_distance=X" where X is the desired maximum distance
 # to snap stations to rivers.
-lines = gdf_utils.assign_stations(lines, hydat, prefix="hydat", max_distance=1500)
-lines = gdf_utils.assign_stations(lines, origin, prefix="origin", max_distance=1500)
-
-network = gdf_utils.hyriv_gdf_to_network(lines)
+# Loading rivers, snapping hydat stations and building the river topology
+# is identical between runs, so the result is saved to a snapshot in
+# load_data.cache_path and reloaded on subsequent runs. Only the origin
+# stations are snapped on every run.
+lines, tables, topology = gdf_utils.network_snapshot({"hydat": hydat}, rivers_path=dataset,
+                                                     max_distance=1500)
+tables["origin"] = gdf_utils.assign_stations(lines, origin, prefix="origin",
+                                             max_distance=1500, as_table=True)
+
+# unbranched river reaches without stations are merged into single
+# edges to speed up the search
+network = gdf_utils.hyriv_gdf_to_network(lines, topology=topology, contract=True,
+                                         assignments=tables)
+
+# only search the parts of the network within reach of origin stations
+network = gdf_utils.prune_network(network, "origin", "hydat", max_distance=12000,
+                                  assignments=tables)
 
 # prefix1 and prefix2 must be featured/used when assigning stations
 match_df = gdf_utils.dfs_search(    network,
                                     max_distance=12000, # in [m]
                                     prefix1="origin",   # list of stations to find a match for
                                     prefix2="hydat",    # all stations to find a match from
-                                    max_depth=1200      # I recommend a max_depth around 1/10th of the max_distance
+                                    max_depth=1200,     # I recommend a max_depth around 1/10th of the max_distance
+                                    assignments=tables
                             )
 # In this iteration of the project, data overlap must be calculated
 # as a separate operation
@@ -266,6 +278,8 @@ print(match_df.shape)
 
 ## delineate_matches requires the prefixes as well as the station data to function
 ## adds 3 fields to the ouput table (see gdf_utils.delineate_matches())
+## it delineates in worker processes, so this script must run under an
+## 'if __name__ == "__main__":' guard before it is enabled
 # delineated = gdf_utils.delineate_matches(match_df, "origin", origin, "hydat", hydat)
 
 # -------------------------------
@@ -0,0 +1,163 @@
+import json
+import socket
+import http.client
+from urllib.parse import urlparse
+
+import numpy as np
+import pandas as pd
+
+from gen_util import find_xy_fields
+
+
+"""
+Overview:
+
+Client for the matching service started by server.py. Results are
+returned as DataFrames.
+
+i.e.
+>>> client = MatchingClient("http://127.0.0.1:8765")
+>>> nearest = client.nearest("hydat", [-79.4, -80.1], [43.7, 43.5], k=3)
+>>> client = MatchingClient(socket_path="/tmp/mapping-stations.sock")
+>>> matches = client.match("hydat", origin_stations)
+"""
+
+
+# ========================================================================= ##
+# License ================================================================= ##
+# ========================================================================= ##
+
+# Copyright (c) 2023 James Wang - jcw4698(at)gmail.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# ========================================================================= ##
+# Client ================================================================== ##
+# ========================================================================= ##
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTPConnection over a Unix socket.
+    """
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class MatchingClient:
+    """
+    Class that sends requests to a running matching service. See
+    server.py for a description of each request.
+
+    :param url: string (default="http://127.0.0.1:8765")
+        Address of the service. Ignored if socket_path is passed.
+
+    :param socket_path: string or None (default)
+        Path of the Unix socket the service listens on.
+
+    :param timeout: float or None (default)
+        Maximum time in seconds to wait for a response.
+    """
+    def __init__(self, url="http://127.0.0.1:8765", socket_path=None, timeout=None):
+        self.url = urlparse(url)
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def status(self) -> dict:
+        return self._request('GET', '/status')
+
+    def snap(self, lon, lat) -> pd.DataFrame:
+        return pd.DataFrame(self._request('POST', '/snap', {'lon': lon, 'lat': lat}))
+
+    def nearest(self, station_set, lon, lat, direction='either', k=1,
+                max_distance=None) -> pd.DataFrame:
+        return pd.DataFrame(self._request('POST', '/nearest', {
+            'station_set': station_set, 'lon': lon, 'lat': lat, 'direction': direction,
+            'k': k, 'max_distance': max_distance}))
+
+    def match(self, station_set, stations, max_distance=5000, max_depth=100,
+              max_matches=10) -> pd.DataFrame:
+        """
+        :param stations: DataFrame or list of dict
+            Stations to match. DataFrames must contain a 'Station_ID'
+            field and longitude/latitude fields (see
+            gen_util.find_xy_fields()).
+        """
+        if isinstance(stations, pd.DataFrame):
+            x, y = find_xy_fields(stations)
+            stations = pd.DataFrame({'Station_ID': stations['Station_ID'],
+                                     'lon': stations[x], 'lat': stations[y]})
+            stations = stations.to_dict('records')
+        return pd.DataFrame(self._request('POST', '/match', {
+            'station_set': station_set, 'stations': stations, 'max_distance': max_distance,
+            'max_depth': max_depth, 'max_matches': max_matches}))
+
+    def overlap(self, set1, ids1, set2, ids2) -> pd.DataFrame:
+        return pd.DataFrame(self._request('POST', '/overlap', {
+            'set1': set1, 'ids1': ids1, 'set2': set2, 'ids2': ids2}))
+
+    def _request(self, method, path, body=None):
+        """
+        Sends a request and decodes the result.
+
+        :raises ValueError:
+            If the service rejected the request.
+
+        :raises RuntimeError:
+            If the service failed to answer the request.
+        """
+        if self.socket_path is not None:
+            conn = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(self.url.hostname, self.url.port,
+                                              timeout=self.timeout)
+        try:
+            headers = {}
+            if body is not None:
+                body = json.dumps(body, default=_to_builtin).encode('utf-8')
+                headers['Content-Type'] = 'application/json'
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            content = json.loads(response.read() or b'{}')
+        finally:
+            conn.close()
+
+        if response.status >= 500:
+            raise RuntimeError(content.get('error', f"Request failed ({response.status})"))
+        if response.status >= 400:
+            raise ValueError(content.get('error', f"Request rejected ({response.status})"))
+        return content['result']
+
+
+def _to_builtin(obj):
+    """
+    Converts numpy and pandas values to types json can encode.
+    """
+    if isinstance(obj, (np.ndarray, pd.Series, pd.Index)):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
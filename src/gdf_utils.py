@@ -1,14 +1,28 @@
-from gen_util import find_xy_fields, Can_LCC_wkt, check_geom, BBox, period_overlap
+from gen_util import find_xy_fields, Can_LCC_wkt, Can_LCC_crs, check_geom, BBox, period_overlap, \
+    period_overlap_pairs, lcc_transformer, to_lcc
 from load_data import get_hydat_data_range, get_pwqmn_data_range
 import load_data
 import sys
 import os
+import glob
+import json
+import shutil
+import hashlib
+import sqlite3
+import tempfile
+import time
+import heapq
+import multiprocessing
+import multiprocessing.connection
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
 from scipy.stats import percentileofscore
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
-from shapely import LineString, Point
+from shapely import LineString
 import shapely
 import momepy
 import networkx as nx
@@ -90,9 +104,9 @@ def point_gdf_from_df(df: pd.DataFrame, x_field=None, y_field=None, crs=4326,
         - authority string ("EPSG:4326")
 
     :return: Geopandas GeoDataFrame or -1
-        The resulting GeoDataFrame, or -1 if the conversion failed. If
-        a crs is passed, the GDF will be in that crs. If lat/lon fields
-        are found by find_xy_fields(), crs will be set to EPSG:4326.
+        The resulting GeoDataFrame in Can_LCC_wkt, or -1 if the
+        conversion failed. Points are projected directly from the x
+        and y fields with a cached transformer; see projected_xy().
 
     :raises TypeError:
         If x and y fields are provided, but a CRS is not.
@@ -111,10 +125,9 @@ def point_gdf_from_df(df: pd.DataFrame, x_field=None, y_field=None, crs=4326,
 
     print(f"Attempting conversion with the following CRS parameter: {crs}")
     try:
-        gdf = gpd.GeoDataFrame(
-            df, geometry=gpd.points_from_xy(df[x_field], df[y_field]), crs=crs)
-        gdf.drop_duplicates(subset=[x_field, y_field], inplace=True)
-        gdf.to_crs(Can_LCC_wkt, inplace=True)
+        df = df.drop_duplicates(subset=[x_field, y_field])
+        x, y = projected_xy(df, x_field, y_field, crs=crs)
+        gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(x, y), crs=Can_LCC_crs)
         print("Dataframe successfully converted to geopandas point geodataframe")
     except KeyError:
         gdf = -1
@@ -123,12 +136,272 @@ def point_gdf_from_df(df: pd.DataFrame, x_field=None, y_field=None, crs=4326,
     return gdf
 
 
+# Projected coordinates of previously converted stations, keyed by
+# source crs. Each value is a DataFrame indexed by Station_ID with the
+# source coordinates (for validation) and the projected coordinates.
+_xy_cache = {}
+
+
+def projected_xy(df: pd.DataFrame, x_field, y_field, crs=4326):
+    """
+    Projects the x and y fields of a DataFrame from crs to
+    Can_LCC_wkt.
+
+    If df has a 'Station_ID' field, projected coordinates are cached
+    by station ID, so repeated conversions of the same station tables
+    only project stations that have not been seen before or whose
+    coordinates have changed.
+
+    :param df: pandas DataFrame
+        DataFrame with the x and y fields.
+
+    :param x_field: str
+        Field to use as longitude/x value.
+
+    :param y_field: str
+        Field to use as latitude/y value.
+
+    :param crs: value (default=4326)
+        Coordinate reference system of the x and y fields. Can be
+        anything hashable accepted by pyproj.CRS.from_user_input().
+
+    :return: tuple of np.ndarray
+        Projected x and y coordinates, in the same order as df.
+    """
+    transformer = lcc_transformer(crs)
+    src_x = df[x_field].to_numpy(dtype=float)
+    src_y = df[y_field].to_numpy(dtype=float)
+
+    if 'Station_ID' not in df.columns:
+        return transformer.transform(src_x, src_y)
+
+    ids = df['Station_ID'].to_numpy()
+    x, y = np.empty(len(df)), np.empty(len(df))
+
+    # reuse cached coordinates whose source coordinates still match
+    cache = _xy_cache.get(crs)
+    if cache is None:
+        hit = np.zeros(len(df), dtype=bool)
+    else:
+        cached = cache.reindex(ids)
+        hit = (cached['src_x'].to_numpy() == src_x) & (cached['src_y'].to_numpy() == src_y)
+        x[hit] = cached['x'].to_numpy()[hit]
+        y[hit] = cached['y'].to_numpy()[hit]
+
+    miss = ~hit
+    if miss.any():
+        x[miss], y[miss] = transformer.transform(src_x[miss], src_y[miss])
+
+        new = pd.DataFrame({'src_x': src_x[miss], 'src_y': src_y[miss],
+                            'x': x[miss], 'y': y[miss]}, index=ids[miss])
+        new = new[~new.index.duplicated(keep='last')]
+        if cache is not None:
+            new = pd.concat([cache.drop(index=new.index, errors='ignore'), new])
+        _xy_cache[crs] = new
+
+    return x, y
+
+
+# ========================================================================= ##
+# Spatial Index =========================================================== ##
+# ========================================================================= ##
+
+
+class SegmentIndex:
+    """
+    Class that wraps a set of features (typically river segments)
+    projected to Can_LCC_wkt together with a shapely STRtree built over
+    them. Build 1 SegmentIndex per river dataset and pass it in place
+    of the edge GeoDataFrame to connect_points_to_feature(),
+    snap_points(), connectors(), assign_stations(as_table=True) and
+    assign_stations_many(as_table=True) to avoid reprojecting the
+    features and rebuilding a spatial index on every call.
+
+    SegmentIndex objects can be saved to and loaded from disk. The
+    features are stored as WKB alongside their index labels and
+    lengths, so a saved index can be reused for as long as the river
+    dataset it was built from does not change.
+
+    Query methods accept points as a GeoSeries or GeoDataFrame (which
+    are projected to Can_LCC_wkt if necessary) or as an array-like of
+    shapely geometries that are assumed to be in Can_LCC_wkt already.
+    Query results are positions, not index labels; use
+    SegmentIndex.index to retrieve labels of the matched features.
+
+    examples:
+        1: index = SegmentIndex(load_data.load_rivers(bbox=bbox))
+           index.save("rivers.npz")
+        2: index = SegmentIndex.load("rivers.npz")
+           table = assign_stations(index, hydat, as_table=True)
+    """
+    def __init__(self, edges: gpd.GeoDataFrame, len_f='LENGTH_KM', len_unit='km'):
+        """
+        :param edges: Geopandas GeoDataFrame or GeoSeries
+            The features to index. Must have a set CRS.
+
+        :param len_f: string or None (default='LENGTH_KM')
+            Field holding the length of each feature, used to scale
+            distances along features (see assign_stations()). If "" or
+            None is passed, distances are not scaled and no length
+            field is looked up.
+
+        :param len_unit: string {'km', 'm'} (default='km')
+            The unit of the len_f field.
+        """
+        edges = to_lcc(edges)
+
+        self.index = edges.index
+        self.geometries = np.asarray(edges.geometry.values, dtype=object)
+        self.length_m = None
+        if type(edges) is gpd.GeoDataFrame and len_f:
+            self.length_m = edge_length_m(edges, len_f=len_f, len_unit=len_unit).to_numpy()
+
+        self.tree = shapely.STRtree(self.geometries)
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def nearest(self, points, max_distance=None, all_matches=True):
+        """
+        Finds the closest feature to each point.
+
+        :param points: GeoSeries, GeoDataFrame or array-like of geometry
+            The points to search from.
+
+        :param max_distance: float or None (default)
+            Maximum distance (in CRS units) to search within. Points
+            with no features within max_distance are omitted.
+
+        :param all_matches: bool (default=True)
+            If True, returns every feature tied for closest. If False,
+            returns 1 feature per point.
+
+        :return: tuple of np.ndarray
+            (point positions, feature positions, distances)
+        """
+        (pt_pos, edge_pos), dist = self.tree.query_nearest(
+            self._geoms(points), max_distance=max_distance, return_distance=True,
+            all_matches=all_matches)
+        return pt_pos, edge_pos, dist
+
+    def within(self, points, distance):
+        """
+        Finds all features within a distance of each point.
+
+        :param points: GeoSeries, GeoDataFrame or array-like of geometry
+            The points to search from.
+
+        :param distance: float or array-like of float
+            The distance (in CRS units) to search within.
+
+        :return: tuple of np.ndarray
+            (point positions, feature positions); 1 pair per
+            point/feature combination found.
+        """
+        return self.query(points, predicate='dwithin', distance=distance)
+
+    def snap(self, stations, max_distance=None) -> gpd.GeoDataFrame:
+        """
+        Snaps stations to their closest features and measures the
+        location of each station along them. Stations tied between
+        features (i.e. at a junction of river segments) are snapped
+        to each of them.
+
+        :param stations: Geopandas GeoDataFrame
+            The station Points. Must contain a 'Station_ID' field.
+
+        :param max_distance: float or None (default)
+            The maximum distance (in meters) within which to snap a
+            station. Stations farther from every feature are omitted.
+
+        :return: GeoDataFrame
+            Assignment table; see assign_stations(as_table=True).
+        """
+        return _snap_stations(self, to_lcc(stations), max_distance)
+
+    def query(self, geoms, predicate=None, distance=None):
+        """
+        Batched spatial query of the index. Wrapper for
+        shapely.STRtree.query(); refer to the shapely documentation
+        for accepted predicates.
+
+        :param geoms: GeoSeries, GeoDataFrame or array-like of geometry
+            The geometries to query with.
+
+        :param predicate: string or None (default)
+            If None, returns features whose bounding boxes intersect
+            those of geoms.
+
+        :param distance: float or None (default)
+            Required if predicate is 'dwithin'.
+
+        :return: tuple of np.ndarray
+            (geometry positions, feature positions)
+        """
+        return tuple(self.tree.query(self._geoms(geoms), predicate=predicate,
+                                     distance=distance))
+
+    def save(self, path):
+        """
+        Saves the index to a .npz file. Geometry is stored as WKB.
+
+        :param path: string
+            The file path to save to.
+        """
+        wkb = shapely.to_wkb(self.geometries)
+        offsets = np.cumsum([0] + [len(b) for b in wkb])
+        index = np.asarray(self.index)
+        if index.dtype == object:
+            index = index.astype(str)
+
+        np.savez(path, wkb=np.frombuffer(b"".join(wkb), dtype=np.uint8),
+                 offsets=offsets, index=index,
+                 length_m=np.array([]) if self.length_m is None else self.length_m)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads an index saved with SegmentIndex.save(). The STRtree is
+        rebuilt from the stored geometry, which is much faster than
+        reprojecting and reading the original dataset.
+
+        :param path: string
+            The .npz file path to load from.
+
+        :return: SegmentIndex
+            The loaded index.
+        """
+        with np.load(path) as data:
+            buffer = data['wkb'].tobytes()
+            offsets = data['offsets']
+            wkb = [buffer[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+            index = SegmentIndex.__new__(SegmentIndex)
+            index.index = pd.Index(data['index'])
+            index.geometries = shapely.from_wkb(wkb)
+            index.length_m = data['length_m'] if data['length_m'].size else None
+
+        index.tree = shapely.STRtree(index.geometries)
+        return index
+
+    @staticmethod
+    def _geoms(geoms):
+        """
+        Converts query geometries to an array of shapely geometries in
+        Can_LCC_wkt.
+        """
+        if type(geoms) in [gpd.GeoDataFrame, gpd.GeoSeries]:
+            geoms = to_lcc(geoms)
+            geoms = geoms.geometry.values
+        return np.asarray(geoms, dtype=object)
+
+
 # ========================================================================= ##
 # Data Processing ========================================================= ##
 # ========================================================================= ##
 
 
-def connect_points_to_feature(points: gpd.GeoDataFrame, other: gpd.GeoDataFrame) -> dict:
+def connect_points_to_feature(points: gpd.GeoDataFrame, other) -> dict:
     """
     For each point in points, determines the closest location on other
     and creates a line between them.
@@ -140,9 +413,10 @@ def connect_points_to_feature(points: gpd.GeoDataFrame, other: gpd.GeoDataFrame)
         The point features to snap to other. Must have a set CRS.
         Must contain only Point geometry.
 
-    :param other: GeoPandas GeoDataFrame
+    :param other: GeoPandas GeoDataFrame or SegmentIndex
         GeoDataFrame to snap the points to. May be points, lines,
-        or polygons, and must have a set CRS.
+        or polygons, and must have a set CRS. Pass a SegmentIndex
+        when snapping to the same features repeatedly.
 
     :return: tuple of GeoDataFrame
         Contains the new points on other and the lines connecting the
@@ -155,24 +429,67 @@ def connect_points_to_feature(points: gpd.GeoDataFrame, other: gpd.GeoDataFrame)
 
     # Spatial manipulation is performed in Lambert conformal conic
     # but the geometry of the original datasets are not changed.
-    if points.crs != Can_LCC_wkt:
-        points = points.to_crs(crs=Can_LCC_wkt)
-    if other.crs != Can_LCC_wkt:
-        other = other.to_crs(crs=Can_LCC_wkt)
+    points = to_lcc(points)
 
-    # create a unique identifier and a copy of the geometry of other
-    other = other.assign(unique_ind=other.index, other=other.geometry)
-    closest = points.sjoin_nearest(other, how='left', distance_col='distance')
+    snapped = snap_arrays(points.geometry.values, other)
+    index = points.index[snapped['point_pos']]
 
-    shortest_lines = closest.geometry.shortest_line(closest['other'])
-
-    # Potentially find a more efficient solution that doesn't use apply
-    new_points = shortest_lines.apply(lambda line: Point(line.coords[1]))
+    new_points = gpd.GeoSeries(snapped['snapped'], index=index, crs=Can_LCC_crs)
+    shortest_lines = gpd.GeoSeries(snapped['connector'], index=index, crs=Can_LCC_crs)
 
     return new_points, shortest_lines
 
 
-def snap_points(points: gpd.GeoDataFrame, other: gpd.GeoDataFrame):
+def snap_arrays(points, other, max_distance=None) -> dict:
+    """
+    Vectorized core of connect_points_to_feature(). For each point,
+    finds the closest feature of other and the closest location on it
+    in a single pass over arrays.
+
+    :param points: array-like of shapely Point
+        The points to snap. Must be in Can_LCC_wkt.
+
+    :param other: GeoPandas GeoDataFrame or SegmentIndex
+        The features to snap points to. May be points, lines or
+        polygons, and must have a set CRS.
+
+    :param max_distance: float or None (default)
+        Maximum snapping distance (in CRS units). Points with no
+        features within max_distance are omitted from the results.
+
+    :return: dict of {str: np.ndarray}
+        1 entry per point/closest feature pair (points equidistant to
+        several features appear once per feature), in order of points:
+            - point_pos: position of the point in points
+            - feature_pos: position of the feature in other
+            - snapped: closest location on the feature (Point)
+            - connector: 2 vertex LineString from the point to snapped
+            - distance: length of connector
+            - fraction: normalized distance of snapped along the
+              feature; NaN if the feature is not a LineString
+    """
+    if type(other) is not SegmentIndex:
+        # generic features have no length field to look up
+        other = SegmentIndex(other, len_f=None)
+    points = np.asarray(points, dtype=object)
+
+    pt_pos, feature_pos, distance = other.nearest(points, max_distance=max_distance)
+    features = other.geometries[feature_pos]
+    points = points[pt_pos]
+
+    connector = shapely.shortest_line(points, features)
+    snapped = shapely.get_point(connector, 1)
+
+    fraction = np.full(len(features), np.nan)
+    is_line = shapely.get_type_id(features) == shapely.GeometryType.LINESTRING
+    fraction[is_line] = shapely.line_locate_point(features[is_line], snapped[is_line],
+                                                  normalized=True)
+
+    return {'point_pos': pt_pos, 'feature_pos': feature_pos, 'snapped': snapped,
+            'connector': connector, 'distance': distance, 'fraction': fraction}
+
+
+def snap_points(points: gpd.GeoDataFrame, other):
     """
     Snaps a set of points to the closest geometry in another set of
     features.
@@ -183,7 +500,7 @@ def snap_points(points: gpd.GeoDataFrame, other: gpd.GeoDataFrame):
     :param points: gpd.GeoDataFrame
         Original point dataset.
 
-    :param other: gpd.GeoDataFrame
+    :param other: gpd.GeoDataFrame or SegmentIndex
         Features to snap Points to.
 
     :return: GeoPandas GeoDataFrame
@@ -193,7 +510,7 @@ def snap_points(points: gpd.GeoDataFrame, other: gpd.GeoDataFrame):
     return connect_points_to_feature(points, other)[0]
 
 
-def connectors(points: gpd.GeoDataFrame, other: gpd.GeoDataFrame):
+def connectors(points: gpd.GeoDataFrame, other):
     """
     Finds the shortest lines between a set of points to the closest
     geometry in another set of features.
@@ -208,14 +525,333 @@ def connectors(points: gpd.GeoDataFrame, other: gpd.GeoDataFrame):
     return connect_points_to_feature(points, other)[1]
 
 
+# ========================================================================= ##
+# Line Geometry =========================================================== ##
+# ========================================================================= ##
+
+# Used in place of substrings that have no length
+_empty_line = shapely.from_wkt("LINESTRING EMPTY")
+
+
+def vertex_distances(lines):
+    """
+    Computes the distance of every vertex of every line from the start
+    of that line, measured along the line. All lines are processed at
+    once from a single flat coordinate array.
+
+    :param lines: GeoSeries or array-like of shapely LineString
+        The lines to measure. Must not contain missing or empty
+        geometries.
+
+    :return: tuple of np.ndarray
+        (coords, index, dist) where:
+            - coords is an (N, 2) array of the vertices of all lines
+            - index is the position in lines of the line each vertex
+              belongs to
+            - dist is the cumulative length along the line from its
+              first vertex to each vertex
+    """
+    coords, index = shapely.get_coordinates(np.asarray(lines, dtype=object),
+                                            return_index=True)
+    seg_len = np.zeros(len(coords))
+    if len(coords) > 1:
+        seg_len[1:] = np.hypot(*(coords[1:] - coords[:-1]).T)
+        # the first vertex of a line does not continue the previous line
+        seg_len[1:][index[1:] != index[:-1]] = 0
+
+    dist = np.cumsum(seg_len)
+    dist -= dist[np.searchsorted(index, index)]
+    return coords, index, dist
+
+
+def line_substrings(lines, start, end):
+    """
+    Extracts the part of each line between 2 distances along it.
+    Vectorized replacement for cutting lines one vertex at a time with
+    line.project(); the location of every vertex along its line is
+    computed once and each substring is assembled from the vertices
+    that fall between start and end.
+
+    lines, start, and end are broadcast against each other, so a
+    single line can be split at many distances (or many lines at a
+    single distance) in one call.
+
+    :param lines: LineString, GeoSeries or array-like of LineString
+        The lines to extract substrings from.
+
+    :param start: float or array-like of float
+        Distance along each line (in CRS units) the substring starts
+        at. Clipped to the length of the line.
+
+    :param end: float or array-like of float
+        Distance along each line (in CRS units) the substring ends
+        at. Clipped to the length of the line.
+
+    :return: np.ndarray of LineString
+        The substrings. Where start is greater than end, the substring
+        runs from start to end (opposite the direction of the line).
+        Where start and end are equal after clipping, the substring is
+        an empty LineString.
+
+    tests:
+    >>> line = LineString([(0, 0), (10, 0), (10, 10)])
+    >>> parts = line_substrings(line, [0, 5, 15, 12], [5, 15, 5, 12])
+    >>> assert list(parts[0].coords) == [(0, 0), (5, 0)]
+    >>> assert list(parts[1].coords) == [(5, 0), (10, 0), (10, 5)]
+    >>> assert list(parts[2].coords) == [(10, 5), (10, 0), (5, 0)]
+    >>> assert parts[3].is_empty
+    """
+    lines, start, end = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(lines, dtype=object)),
+        np.atleast_1d(np.asarray(start, dtype=float)),
+        np.atleast_1d(np.asarray(end, dtype=float)))
+    lines = np.array(lines, dtype=object)
+
+    lengths = shapely.length(lines)
+    lo = np.clip(np.minimum(start, end), 0, lengths)
+    hi = np.clip(np.maximum(start, end), 0, lengths)
+
+    coords, index, dist = vertex_distances(lines)
+    inner = (dist > lo[index]) & (dist < hi[index])
+
+    # each substring is made of an interpolated start point, the
+    # vertices between start and end, and an interpolated end point
+    pos = np.arange(len(lines))
+    all_coords = np.concatenate([
+        shapely.get_coordinates(shapely.line_interpolate_point(lines, lo)),
+        coords[inner],
+        shapely.get_coordinates(shapely.line_interpolate_point(lines, hi))])
+    all_index = np.concatenate([pos, index[inner], pos])
+    sort_key = np.concatenate([np.full(len(lines), -1.0), dist[inner],
+                               np.full(len(lines), np.inf)])
+
+    order = np.lexsort((sort_key, all_index))
+    parts = shapely.linestrings(all_coords[order], indices=all_index[order])
+
+    flipped = start > end
+    parts[flipped] = shapely.reverse(parts[flipped])
+    parts[lo >= hi] = _empty_line
+    return parts
+
+
+def cut_lines(lines, distances):
+    """
+    Cuts each line in 2 at a distance from its starting point.
+
+    Replaces the cut() recipe from the shapely documentation, which
+    projected every vertex onto the line until it passed the cut
+    distance. See line_substrings() for the vectorized implementation.
+
+    :param lines: LineString, GeoSeries or array-like of LineString
+        The lines to cut. Broadcast against distances.
+
+    :param distances: float or array-like of float
+        Distance along each line (in CRS units) to cut it at.
+
+    :return: tuple of np.ndarray of LineString
+        (heads, tails); the part of each line before and after the
+        cut. If the cut is at or before the start of a line, its head
+        is an empty LineString and its tail is the entire line (and
+        vice versa if the cut is at or past the end of the line).
+    """
+    return (line_substrings(lines, 0, distances),
+            line_substrings(lines, distances, np.inf))
+
+
+def line_endpoints(lines):
+    """
+    Retrieves the first and last vertex of every line.
+
+    :param lines: GeoSeries or array-like of shapely LineString
+        The lines to retrieve the endpoints of. Must not contain
+        missing or empty geometries.
+
+    :return: tuple of np.ndarray
+        (starts, ends); (N, 2) arrays of the coordinates of the first
+        and last vertex of each line.
+    """
+    lines = np.asarray(lines, dtype=object)
+    return (shapely.get_coordinates(shapely.get_point(lines, 0)),
+            shapely.get_coordinates(shapely.get_point(lines, -1)))
+
+
+def line_directions(lines, normalize=True):
+    """
+    Computes the vector from the first to the last vertex of every
+    line.
+
+    :param lines: GeoSeries or array-like of shapely LineString
+        The lines to compute directions of. Must not contain missing
+        or empty geometries.
+
+    :param normalize: bool (default=True)
+        If True, returns unit vectors. Lines that start and end at the
+        same point have a direction of (0, 0).
+
+    :return: np.ndarray
+        (N, 2) array of direction vectors.
+    """
+    starts, ends = line_endpoints(lines)
+    directions = ends - starts
+    if normalize:
+        length = np.hypot(*directions.T)[:, None]
+        directions = np.divide(directions, length, out=np.zeros_like(directions),
+                               where=length > 0)
+    return directions
+
+
+# ========================================================================= ##
+# Watersheds ============================================================== ##
+# ========================================================================= ##
+
+# Version of the watershed delineation method. Stored alongside each
+# watershed in a WatershedStore; change it when the delineation method
+# or its parameters change so old watersheds are delineated again.
+watershed_method = "PySheds-1"
+
+
+class WatershedStore:
+    """
+    Class that represents a persistent store of delineated watershed
+    polygons, keyed by station ID and delineation method version.
+    Watersheds are stored in a single GeoPackage layer in Can_LCC_wkt
+    with the following fields:
+        - Station_ID (str)
+        - method (str)
+        - geometry (Polygon or MultiPolygon)
+
+    If a station is stored more than once under the same method, the
+    most recently added watershed is used.
+
+    examples:
+        1: store = WatershedStore()
+           missing = set(station_ids) - set(store.stored_ids())
+        2: wsheds = WatershedStore().load(station_ids)
+           wsheds['02HA006'].area
+    """
+    layer = 'watersheds'
+
+    def __init__(self, path=load_data.watershed_path, method=watershed_method):
+        """
+        :param path: string (default=load_data.watershed_path)
+            The GeoPackage file path. Created when watersheds are first
+            added.
+
+        :param method: string (default=watershed_method)
+            The delineation method version to read and write.
+        """
+        self.path = path
+        self.method = method
+
+    def stored_ids(self) -> pd.Index:
+        """
+        :return: Pandas Index of str
+            IDs of the stations stored under self.method.
+        """
+        if not os.path.isfile(self.path):
+            return pd.Index([], dtype=object)
+
+        # GeoPackages are sqlite3 databases, so the IDs can be read
+        # without reading any geometry
+        conn = sqlite3.connect(self.path)
+        try:
+            ids = pd.read_sql_query(f'SELECT DISTINCT Station_ID FROM "{self.layer}" '
+                                    'WHERE method = ?', conn, params=(self.method,))
+        finally:
+            conn.close()
+        return pd.Index(ids['Station_ID'].astype(str))
+
+    def add(self, watersheds: gpd.GeoDataFrame):
+        """
+        Adds watersheds to the store.
+
+        :param watersheds: Geopandas GeoDataFrame
+            The watershed polygons, with a 'Station_ID' field. Must
+            have a set CRS.
+        """
+        if len(watersheds) == 0:
+            return
+
+        watersheds = gpd.GeoDataFrame(
+            {'Station_ID': watersheds['Station_ID'].astype(str).to_numpy(),
+             'method': self.method},
+            geometry=to_lcc(watersheds).geometry.values, crs=Can_LCC_crs)
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        mode = 'a' if os.path.isfile(self.path) else 'w'
+        watersheds.to_file(self.path, layer=self.layer, driver='GPKG', mode=mode)
+
+    def add_files(self, ids, output_dir="output", since=None):
+        """
+        Adds the '<id>.geojson' watershed files produced by the
+        delineation library to the store. Stations without a file
+        (i.e. failed delineations) are skipped.
+
+        output_dir may hold files left by earlier runs. Pass since to
+        only add files written by the current run; otherwise the files
+        must have been removed before delineating (as
+        delineate_stations() does), or a stale watershed may be stored
+        for a station whose delineation failed.
+
+        :param ids: list-like
+            IDs of the stations to add.
+
+        :param output_dir: string (default="output")
+            Directory containing the .geojson files.
+
+        :param since: float or None (default)
+            Time (as returned by time.time()) the delineations were
+            started at. Files last modified before it are treated as
+            missing. If None, every file is added.
+
+        :return: list
+            IDs of the stations without a file.
+        """
+        found, missing = [], []
+        for st_id in ids:
+            path = os.path.join(output_dir, f"{st_id}.geojson")
+            if os.path.isfile(path) and (since is None or os.path.getmtime(path) >= since):
+                found.append(to_lcc(gpd.read_file(path)).iloc[:1].assign(Station_ID=str(st_id)))
+            else:
+                missing.append(st_id)
+
+        if found:
+            self.add(pd.concat(found))
+        return missing
+
+    def load(self, ids=None) -> gpd.GeoSeries:
+        """
+        Loads stored watersheds.
+
+        :param ids: list-like or None (default)
+            IDs of the stations to load. If None, loads every
+            watershed stored under self.method.
+
+        :return: Geopandas GeoSeries
+            Watershed polygons in Can_LCC_wkt indexed by Station_ID
+            (as str). Stations that are not stored are omitted.
+        """
+        if not os.path.isfile(self.path):
+            return gpd.GeoSeries([], index=pd.Index([], dtype=object), crs=Can_LCC_crs)
+
+        wsheds = gpd.read_file(self.path, layer=self.layer)
+        wsheds = wsheds[wsheds['method'] == self.method]
+        if ids is not None:
+            wsheds = wsheds[wsheds['Station_ID'].isin(pd.Index(ids).astype(str))]
+
+        wsheds = wsheds.drop_duplicates(subset='Station_ID', keep='last')
+        return gpd.GeoSeries(wsheds.geometry.values, index=pd.Index(wsheds['Station_ID']),
+                             crs=Can_LCC_crs)
+
+
 # ========================================================================= ##
 # HydroRIVERS ============================================================= ##
 # ========================================================================= ##
 
 
-def assign_stations(edges: gpd.GeoDataFrame, stations: gpd.GeoDataFrame,
+def assign_stations(edges, stations: gpd.GeoDataFrame,
                     prefix="", max_distance=750, save_dist=False, len_f='LENGTH_KM',
-                    len_unit='km') -> gpd.GeoDataFrame:
+                    len_unit='km', as_table=False) -> gpd.GeoDataFrame:
     """
     Snaps stations to the closest features in edges and assigns
     descriptors to line segments. Uses a solution similar
@@ -230,10 +866,15 @@ def assign_stations(edges: gpd.GeoDataFrame, stations: gpd.GeoDataFrame,
 
     To accommodate multiple stations being assigned to the same edge
     feature, station ids and distances are stored in DataFrames.
+    Alternatively, if as_table is True, the assignments are returned
+    as a single flat table and edges is not copied or modified. Pass
+    the table to dfs_search() through its assignments parameter.
 
-    :param edges: Geopandas GeoDataFrame
+    :param edges: Geopandas GeoDataFrame or SegmentIndex
         The lines/features to assign stations to. Must contain the
-        'len_f' field.
+        'len_f' field. A SegmentIndex may be passed instead to reuse
+        a prebuilt spatial index, in which case as_table must be True
+        and len_f and len_unit are taken from the index.
 
     :param stations: Geopandas GeoDataFrame
         The station points to assign to edges. Requires that a
@@ -263,6 +904,10 @@ def assign_stations(edges: gpd.GeoDataFrame, stations: gpd.GeoDataFrame,
     :param len_unit: string {'km', 'm'} (default='km')
         The unit of the len_f field.
 
+    :param as_table: bool (default=False)
+        If True, returns the flat assignment table described below
+        instead of a copy of edges.
+
     :return: Geopandas GeoDataFrame
         A copy of edges that includes selected station related
         data. Has the following additional fields:
@@ -286,9 +931,19 @@ def assign_stations(edges: gpd.GeoDataFrame, stations: gpd.GeoDataFrame,
         unique_ind (int)
             Used as a unique identifier for joining and merging data.
 
+        If as_table is True, instead returns a GeoDataFrame with 1
+        row per assigned station, sorted by edge_index and dist_along,
+        with the following columns:
+            - Station_ID
+            - edge_index (index label of the edge in edges)
+            - dist_along (float)
+            - dist_from (float)
+            - geometry (original station location)
+
     :raises ValueError:
         If stations contains geometries aside from Points
         If edges contains geometries aside from LineStrings
+        If edges is a SegmentIndex and as_table is False
 
     :raises KeyError:
         If stations doesn't contain a 'Station_ID' field.
@@ -296,52 +951,251 @@ def assign_stations(edges: gpd.GeoDataFrame, stations: gpd.GeoDataFrame,
     # check inputs
     if not check_geom(stations, 'Point'):
         raise ValueError("Station GeoDataFrame expected to only contain Points.")
-    if not check_geom(edges, 'LineString'):
-        raise ValueError("Edge GeoDataFrame expected to only contain LineStrings.")
     if not ('Station_ID' in stations.columns):
         raise ValueError('Stations GeoDataFrame does not contain required "Station_ID" field.')
 
-    if stations.crs != Can_LCC_wkt:
-        stations = stations.to_crs(crs=Can_LCC_wkt)
-    if edges.crs != Can_LCC_wkt:
-        edges = edges.to_crs(crs=Can_LCC_wkt)
+    stations = to_lcc(stations)
+    edges, index = _segment_index(edges, len_f, len_unit, as_table)
+
+    table = _snap_stations(index, stations, max_distance)
+
+    if save_dist:
+        table.to_csv(prefix + ".csv")
+
+    if as_table:
+        return table
+
+    return _merge_assignments(edges.assign(LENGTH_M=_index_length_m(index)), {prefix: table},
+                              {prefix: stations})
+
+
+def assign_stations_many(edges, station_sets: dict, max_distance=750,
+                         len_f='LENGTH_KM', len_unit='km', as_table=False):
+    """
+    Assigns several sets of stations to edges at once. Equivalent to
+    calling assign_stations() once per station set, but edges are
+    projected once, a single spatial index is built and shared by the
+    nearest queries of every set, and all '<prefix>_data' columns are
+    attached to edges in a single step.
+
+    i.e.
+    >>> lines = assign_stations_many(lines, {'hydat': hydat, 'pwqmn': pwqmn})
+
+    :param edges: Geopandas GeoDataFrame or SegmentIndex
+        The lines/features to assign stations to. If a SegmentIndex is
+        passed, as_table must be True.
+
+    :param station_sets: dict of {str: GeoDataFrame}
+        Station sets keyed by the prefix to assign them under. Every
+        set must contain only Points and a 'Station_ID' field.
+
+    :param max_distance: int (default=750)
+        The maximum distance (in CRS units) within which to assign a
+        station to edges. See assign_stations().
+
+    :param len_f: string (default='LENGTH_KM')
+        The field to calculate dist_along with. See assign_stations().
+
+    :param len_unit: string {'km', 'm'} (default='km')
+        The unit of the len_f field.
+
+    :param as_table: bool (default=False)
+        If True, returns the flat assignment table of each station set
+        instead of a copy of edges.
+
+    :return: Geopandas GeoDataFrame or dict of {str: GeoDataFrame}
+        A copy of edges with a '<prefix>_data' column per station set
+        (see assign_stations()) or, if as_table is True, the assignment
+        tables keyed by prefix.
+
+    :raises ValueError:
+        If any station set contains geometries aside from Points or
+        lacks a 'Station_ID' field.
+        If edges contains geometries aside from LineStrings
+        If edges is a SegmentIndex and as_table is False
+    """
+    for prefix, stations in station_sets.items():
+        if not check_geom(stations, 'Point'):
+            raise ValueError(f"Station GeoDataFrame '{prefix}' expected to only contain Points.")
+        if not ('Station_ID' in stations.columns):
+            raise ValueError(f'Stations GeoDataFrame "{prefix}" does not contain required '
+                             '"Station_ID" field.')
+
+    edges, index = _segment_index(edges, len_f, len_unit, as_table)
+
+    tables = {}
+    for prefix, stations in station_sets.items():
+        stations = to_lcc(stations)
+        tables[prefix] = _snap_stations(index, stations, max_distance)
+
+    if as_table:
+        return tables
 
+    return _merge_assignments(edges.assign(LENGTH_M=_index_length_m(index)), tables,
+                              station_sets)
+
+
+def _segment_index(edges, len_f, len_unit, as_table):
+    """
+    Validates the edges passed to assign_stations() or
+    assign_stations_many() and builds a SegmentIndex over them if one
+    was not passed.
+
+    :return: tuple of (GeoDataFrame or None, SegmentIndex)
+        edges projected to Can_LCC_wkt (None if edges was a
+        SegmentIndex) and the index of edges.
+    """
+    if type(edges) is SegmentIndex:
+        if not as_table:
+            raise ValueError("as_table must be True when assigning stations to a SegmentIndex.")
+        return None, edges
+
+    if not check_geom(edges, 'LineString'):
+        raise ValueError("Edge GeoDataFrame expected to only contain LineStrings.")
+    edges = to_lcc(edges)
+
+    return edges, SegmentIndex(edges, len_f=len_f, len_unit=len_unit)
+
+
+def _index_length_m(index):
+    """
+    Length of each feature of a SegmentIndex in meters, falling back
+    to the computed length when the index has no length field.
+    """
+    if index.length_m is None:
+        return shapely.length(index.geometries)
+    return index.length_m
+
+
+def _snap_stations(index, stations, max_distance):
+    """
+    Finds the closest edge to each station using a prebuilt spatial
+    index of edges and measures the location of the station along it.
+
+    :param index: SegmentIndex
+        Spatial index of the edges to snap to.
+
+    :param stations: Geopandas GeoDataFrame
+        The stations to snap (in Can_LCC_wkt).
+
+    :param max_distance: float or None
+        The maximum distance within which to assign a station.
+
+    :return: GeoDataFrame
+        Assignment table; see assign_stations(as_table=True). If the
+        index has lengths, dist_along is scaled by them rather than
+        the computed length of the edge geometry.
+    """
+    stations = stations.drop_duplicates('Station_ID')
+    points = np.asarray(stations.geometry.values, dtype=object)
+
+    st_pos, edge_pos, dist_from = index.nearest(points, max_distance=max_distance)
+
+    lines = index.geometries[edge_pos]
+    dist_along = shapely.line_locate_point(lines, points[st_pos])
+    if index.length_m is not None:
+        dist_along = dist_along / shapely.length(lines) * index.length_m[edge_pos]
+
+    table = gpd.GeoDataFrame({'Station_ID': stations['Station_ID'].to_numpy()[st_pos],
+                              'edge_index': index.index[edge_pos],
+                              'dist_along': dist_along,
+                              'dist_from': dist_from},
+                             geometry=points[st_pos], crs=Can_LCC_crs)
+    return table.sort_values(by=['edge_index', 'dist_along'], kind='stable', ignore_index=True)
+
+
+def edge_length_m(edges: gpd.GeoDataFrame, len_f='LENGTH_KM', len_unit='km') -> pd.Series:
+    """
+    Retrieves the length of each edge in meters from a length field,
+    falling back to the GeoPandas computed length.
+
+    :param edges: Geopandas GeoDataFrame
+        The lines to retrieve lengths of. Computed lengths are in CRS
+        units, so edges should be in a projected CRS.
+
+    :param len_f: string (default='LENGTH_KM')
+        The field holding edge lengths. If "" is passed or len_f is not
+        found, prints a warning message and uses the GeoPandas computed
+        length.
+
+    :param len_unit: string {'km', 'm'} (default='km')
+        The unit of the len_f field.
+
+    :return: Pandas Series
+        Length of each edge in meters, with the same index as edges.
+    """
     if len_f and len_f in edges.columns:
         conversion = {'m': 1, 'km': 1000}[len_unit]
-        edges = edges.assign(LENGTH_M=edges[len_f] * conversion)
-    elif not (len_f in edges.columns):
-        print(f'Warning: Edges GeoDataFrame does not contain {len_f} field.'
-               'GeoPandas computed length will be used.')
-        edges = edges.assign(LENGTH_M=edges.geometry.length)
+        return edges[len_f] * conversion
 
-    edges = edges.assign(unique_ind=edges.index, other=edges.geometry)
-    stations = stations.drop_duplicates('Station_ID')
-    stations = stations.sjoin_nearest(edges, how='left', max_distance=max_distance,
-                                      distance_col='dist_from')
+    print(f'Warning: Edges GeoDataFrame does not contain {len_f} field.'
+          'GeoPandas computed length will be used.')
+    return edges.geometry.length
 
-    dist_along = stations['other'].project(stations.geometry)
-    if len_f:
-        dist_along = dist_along / stations['other'].length * stations['LENGTH_M']
 
-    stations = stations.assign(dist_along=dist_along)
-    stations = stations[['Station_ID', 'unique_ind', 'dist_along', 'geometry', 'dist_from']]
+def _merge_assignments(edges, tables, station_sets=None):
+    """
+    Stores flat station assignment tables in edges as 1 DataFrame per
+    edge in '<prefix>_data' object columns (the form produced by
+    assign_stations() when as_table is False). Columns for every
+    table are attached at once.
 
-    if save_dist:
-        stations.to_csv(prefix + ".csv")
+    :param edges: Geopandas GeoDataFrame
+        The edges the stations were assigned to.
 
-    grouped = stations.groupby(by='unique_ind', sort=False)
+    :param tables: dict of {str: GeoDataFrame}
+        Assignment tables keyed by prefix; see assign_stations().
 
-    temp_data = {'unique_ind': [], prefix + '_data': []}
-    for ind, data in grouped:
-        temp_data['unique_ind'].append(ind)
-        temp_data[prefix + '_data'].append(data)
+    :param station_sets: dict of {str: GeoDataFrame} or None (default)
+        The stations each table was built from, keyed by prefix. If
+        passed, the stations of each edge keep the order they have in
+        their station set instead of being ordered by dist_along.
 
-    matches = edges.merge(pd.DataFrame(data=temp_data), on='unique_ind', how='left')
-    matches.drop(columns=['unique_ind', 'other'], inplace=True)
-    return matches
+    :return: Geopandas GeoDataFrame
+        A copy of edges with a '<prefix>_data' column per table and a
+        reset index.
+    """
+    positions = pd.Series(np.arange(len(edges)), index=edges.index)
+    columns = {}
+
+    for prefix, table in tables.items():
+        if station_sets is not None:
+            order = pd.Index(station_sets[prefix]['Station_ID'].drop_duplicates()).get_indexer(
+                table['Station_ID'])
+            table = table.iloc[np.argsort(order, kind='stable')]
+        table = table.assign(unique_ind=positions.loc[table['edge_index']].values)
+        table = table[['Station_ID', 'unique_ind', 'dist_along', 'geometry', 'dist_from']]
+
+        column = np.full(len(edges), np.nan, dtype=object)
+        for ind, data in table.groupby(by='unique_ind', sort=False):
+            column[ind] = data
+        columns[prefix + '_data'] = column
 
+    return edges.reset_index(drop=True).assign(**columns)
 
-def delineate_matches(match_df, prefix1, data_1, prefix2, data_2):
+
+def _table_lookup(table):
+    """
+    Builds a lookup from edge index labels to the rows of a sorted
+    station assignment table that belong to that edge.
+
+    :param table: GeoDataFrame
+        Assignment table produced by assign_stations(as_table=True).
+
+    :return: dict of {edge index: (int, int)}
+        Start and stop positions of the rows of each edge.
+    """
+    edge_ind = table['edge_index'].to_numpy()
+    if len(edge_ind) == 0:
+        return {}
+    starts = np.flatnonzero(np.r_[True, edge_ind[1:] != edge_ind[:-1]])
+    stops = np.r_[starts[1:], len(edge_ind)]
+    return dict(zip(edge_ind[starts].tolist(), zip(starts.tolist(), stops.tolist())))
+
+
+def delineate_matches(match_df, prefix1, data_1, prefix2, data_2,
+                      store_path=load_data.watershed_path, method=watershed_method,
+                      workers=None, timeout=None):
     """
     For each PWQMN and HYDAT station in match_df, delineates the
     watershed basin using the Watershed_Delineation library developed
@@ -357,6 +1211,20 @@ def delineate_matches(match_df, prefix1, data_1, prefix2, data_2):
 
     All fields are in m^2
 
+    Delineated watersheds are kept in a WatershedStore. Each station is
+    delineated once, even if it appears in several matches, and
+    stations already in the store (i.e. from previous runs) are not
+    delineated again.
+
+    Stations are delineated in worker processes (see
+    delineate_stations()), so this must be called from within an
+    'if __name__ == "__main__":' block of the calling script on
+    platforms that start processes by spawning them (i.e. Windows).
+
+    i.e.
+    >>> if __name__ == "__main__":
+    >>>     delineated = delineate_matches(match_df, "hydat", hydat, "pwqmn", pwqmn)
+
     :param match_df: DataFrame
         DataFrame of a similar structure as that produced by
         dfs_search(). Must contain "{prefix1}_id" and "{prefix2}_id"
@@ -379,13 +1247,29 @@ def delineate_matches(match_df, prefix1, data_1, prefix2, data_2):
         Must contain a latitude/longitude field. Must contain a
         Station_ID field.
 
+    :param store_path: string (default=load_data.watershed_path)
+        The GeoPackage to store delineated watersheds in.
+
+    :param method: string (default=watershed_method)
+        The delineation method version watersheds are stored under.
+        Change it when changing the delineation method so previously
+        stored watersheds are not reused.
+
+    :param workers: int or None (default)
+        Number of stations to delineate in parallel. If None, uses
+        the number of CPUs. See delineate_stations().
+
+    :param timeout: float or None (default)
+        Maximum time in seconds to spend delineating a single station.
+        If None, there is no limit.
+
     :return: DataFrame
         Copy of the input DataFrame with additional watershed fields
         calculated.
 
-    :saves: watersheds.geojson
-        Geojson containing polygons of the delineated watersheds for
-        each station.
+    :saves: <id>.geojson
+        Geojson containing the polygon of the delineated watershed of
+        each newly delineated station, in the "output" folder.
     """
     def normalize(df):
         x, y = find_xy_fields(df)
@@ -401,47 +1285,33 @@ def delineate_matches(match_df, prefix1, data_1, prefix2, data_2):
     data_1 = normalize(data_1)[['Station_ID', 'lat', 'lon']]
     data_2 = normalize(data_2)[['Station_ID', 'lat', 'lon']]
 
+    # each station only needs to be delineated once
     stations = pd.concat([data_1, data_2], axis=0)
+    stations = pd.DataFrame(stations).drop_duplicates(subset='Station_ID')
 
-    # create output folder
-    print("create output folder")
-    output_dir = "output"
-    if not os.path.isdir(output_dir):
-        os.mkdir(output_dir)
+    store = WatershedStore(store_path, method=method)
+    stations = stations[~stations['Station_ID'].astype(str).isin(store.stored_ids())]
 
-    dir_path = os.path.dirname(os.path.realpath(__file__))
+    if len(stations) > 0:
+        # create output folder
+        print("create output folder")
+        output_dir = "output"
+        if not os.path.isdir(output_dir):
+            os.mkdir(output_dir)
 
-    # change the next two lines to use a different method for the
-    # watershed delineation by changing the module and delineation
-    # function being imported
-    sys.path.append(dir_path + os.path.join("/..", "..", "Watershed_Delineation", "src", "PySheds"))
-    from main import delineate
-
-    print("begining delineations")
-    try:
-        delineate(basins=stations, id_field='Station_ID')
-    except:
-        stations.rename(columns={'lon': 'lng'}, inplace=True)
-        delineate(basins=stations, id_field='Station_ID')
+        print(f"begining delineations of {len(stations)} stations")
+        delineate_stations(stations, workers=workers, timeout=timeout,
+                           output_dir=output_dir, store=store)
+    else:
+        print("all watersheds previously delineated")
 
-    # read the delineated basins
+    # load every watershed once and compare them
     print("Loading delineated watersheds and performing comparisons")
-    wsheds_a_1 = []
-    wsheds_a_2 = []
-    overlap = []
+    wsheds = store.load(pd.concat([subset1, subset2]))
 
-    for ind, row in match_df.iterrows():
-        wshed1 = gpd.read_file(os.path.join("output", f"{row[prefix1 + '_id']}.geojson"))
-        wshed2 = gpd.read_file(os.path.join("output", f"{row[prefix2 + '_id']}.geojson"))
+    wsheds_a_1, wsheds_a_2, overlap = compare_watersheds(
+        wsheds, match_df[prefix1 + '_id'], match_df[prefix2 + '_id'])
 
-        wshed1 = wshed1.geometry.to_crs(crs=Can_LCC_wkt)
-        wshed2 = wshed2.geometry.to_crs(crs=Can_LCC_wkt)
-
-        wsheds_a_1.append(wshed1.iloc[0].area)
-        wsheds_a_2.append(wshed2.iloc[0].area)
-
-        overlap.append(wshed1.intersection(wshed2).iloc[0].area)
-    
     match_df[f'{prefix1}_wshed_area'] = wsheds_a_1
     match_df[f'{prefix2}_wshed_area'] = wsheds_a_2
     match_df[f'wshed_overlap'] = overlap
@@ -449,6 +1319,255 @@ def delineate_matches(match_df, prefix1, data_1, prefix2, data_2):
     return match_df
 
 
+def compare_watersheds(wsheds: gpd.GeoSeries, ids1, ids2):
+    """
+    Calculates the areas of the watersheds of pairs of stations and
+    the area of their overlap.
+
+    Areas are computed once per station, and overlaps once per unique
+    pair with vectorized shapely intersections. Pairs whose bounding
+    boxes do not intersect are not intersected and have an overlap
+    of 0.
+
+    :param wsheds: Geopandas GeoSeries
+        Watershed polygons indexed by Station_ID (as str), in a
+        projected CRS (see WatershedStore.load()).
+
+    :param ids1: list-like
+        ID of the first station of each pair.
+
+    :param ids2: list-like
+        ID of the second station of each pair.
+
+    :return: tuple of np.ndarray
+        (area of the first watershed, area of the second watershed,
+        area of overlap) of each pair, in CRS units squared. NaN for
+        pairs involving a station without a watershed.
+    """
+    wsheds = wsheds[~wsheds.index.duplicated(keep='last')]
+    areas = pd.Series(wsheds.area.to_numpy(), index=wsheds.index)
+    ids1 = pd.Index(ids1).astype(str)
+    ids2 = pd.Index(ids2).astype(str)
+
+    area1 = areas.reindex(ids1).to_numpy()
+    area2 = areas.reindex(ids2).to_numpy()
+
+    # intersect each unique pair once
+    pairs = pd.DataFrame({'id1': ids1, 'id2': ids2})
+    unique = pairs.drop_duplicates(ignore_index=True)
+    pos1 = wsheds.index.get_indexer(unique['id1'])
+    pos2 = wsheds.index.get_indexer(unique['id2'])
+
+    unique_overlap = np.full(len(unique), np.nan)
+    valid = (pos1 >= 0) & (pos2 >= 0)
+    unique_overlap[valid] = 0
+
+    geoms = wsheds.values
+    bounds = wsheds.bounds.to_numpy()
+    b1, b2 = bounds[pos1[valid]], bounds[pos2[valid]]
+    touching = ((b1[:, 0] <= b2[:, 2]) & (b2[:, 0] <= b1[:, 2]) &
+                (b1[:, 1] <= b2[:, 3]) & (b2[:, 1] <= b1[:, 3]))
+
+    rows = np.flatnonzero(valid)[touching]
+    unique_overlap[rows] = shapely.area(shapely.intersection(
+        geoms[pos1[rows]], geoms[pos2[rows]]))
+
+    lookup = pd.MultiIndex.from_frame(unique)
+    overlap = unique_overlap[lookup.get_indexer(pd.MultiIndex.from_frame(pairs))]
+
+    return area1, area2, overlap
+
+
+def delineate_stations(stations: pd.DataFrame, workers=None, timeout=None,
+                       output_dir="output", store=None) -> dict:
+    """
+    Delineates the watershed of each station in a pool of long-lived
+    worker processes. Each worker imports the delineation library once
+    and is then sent stations 1 at a time. Stations are delineated
+    independently: a station that raises an error, crashes its worker
+    or exceeds the timeout is recorded as failed and the remaining
+    stations are still delineated. Only the worker of a station that
+    crashes or times out is replaced.
+
+    Results are read from the '<id>.geojson' files written by the
+    delineation library to output_dir and, if a store is provided,
+    added to it as soon as each station finishes, so completed
+    watersheds are kept even if the batch is interrupted. Any
+    '<id>.geojson' file left in output_dir by an earlier run is removed
+    before the station is delineated, so a failed delineation is never
+    recorded as done.
+
+    Must be called from within an 'if __name__ == "__main__":' block
+    of the calling script on platforms that start processes by
+    spawning them (i.e. Windows), as each worker process imports the
+    calling script.
+
+    :param stations: DataFrame
+        Stations to delineate, with 'Station_ID', 'lat' and 'lon'
+        fields.
+
+    :param workers: int or None (default)
+        Number of worker processes, i.e. the maximum number of
+        stations to delineate at once. If None, uses the number of
+        CPUs.
+
+    :param timeout: float or None (default)
+        Maximum time in seconds to spend delineating a single station.
+        Workers exceeding it are terminated and replaced. If None,
+        there is no limit.
+
+    :param output_dir: string (default="output")
+        Directory the delineation library writes watersheds to.
+
+    :param store: WatershedStore or None (default)
+        Store to add delineated watersheds to.
+
+    :return: dict
+        {'done': list of station IDs delineated,
+         'failed': dict of {station ID: reason}}
+    """
+    workers = workers or os.cpu_count() or 1
+    pending = stations[['Station_ID', 'lat', 'lon']].to_dict('records')[::-1]
+    total = len(pending)
+    idle = []
+    running = {}
+    done, failed = [], {}
+
+    def start_worker():
+        conn, worker_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_delineate_worker, args=(worker_conn,))
+        process.start()
+        worker_conn.close()
+        return process, conn
+
+    def stop_worker(process, conn, terminate=False):
+        if terminate:
+            process.terminate()
+        else:
+            try:
+                conn.send(None)
+            except OSError:
+                # the worker already exited
+                pass
+        process.join()
+        conn.close()
+
+    def finish(st_id, reason=None):
+        if reason is None and not os.path.isfile(os.path.join(output_dir, f"{st_id}.geojson")):
+            reason = "no watershed produced"
+
+        if reason is None:
+            done.append(st_id)
+            if store is not None:
+                store.add_files([st_id], output_dir)
+        else:
+            failed[st_id] = reason
+        print(f"[{len(done) + len(failed)}/{total}] {st_id}: {reason or 'done'}")
+
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                station = pending.pop()
+                # a file left by an earlier run would pass as this run's result
+                stale = os.path.join(output_dir, f"{station['Station_ID']}.geojson")
+                if os.path.isfile(stale):
+                    os.remove(stale)
+
+                process, conn = idle.pop() if idle else start_worker()
+                conn.send(station)
+                deadline = None if timeout is None else time.monotonic() + timeout
+                running[station['Station_ID']] = (process, conn, deadline)
+
+            # wait for a worker to reply or exit, or the earliest deadline
+            deadlines = [d for _, _, d in running.values() if d is not None]
+            wait_time = None if not deadlines else max(0, min(deadlines) - time.monotonic())
+            multiprocessing.connection.wait(
+                [conn for _, conn, _ in running.values()] +
+                [process.sentinel for process, _, _ in running.values()], timeout=wait_time)
+
+            now = time.monotonic()
+            for st_id, (process, conn, deadline) in list(running.items()):
+                if conn.poll():
+                    try:
+                        reason = conn.recv()
+                    except EOFError:
+                        # the worker died without reporting a result
+                        del running[st_id]
+                        stop_worker(process, conn)
+                        finish(st_id, f"process exited with code {process.exitcode}")
+                        continue
+                    del running[st_id]
+                    idle.append((process, conn))
+                    finish(st_id, reason)
+                elif not process.is_alive():
+                    del running[st_id]
+                    stop_worker(process, conn)
+                    finish(st_id, f"process exited with code {process.exitcode}")
+                elif deadline is not None and now >= deadline:
+                    del running[st_id]
+                    stop_worker(process, conn, terminate=True)
+                    finish(st_id, f"timed out after {timeout} s")
+    finally:
+        for process, conn in idle:
+            stop_worker(process, conn)
+        for process, conn, _ in running.values():
+            stop_worker(process, conn, terminate=True)
+
+    return {'done': done, 'failed': failed}
+
+
+def _delineate_worker(conn):
+    """
+    Delineates the stations sent through conn in a worker process of
+    delineate_stations() until None is sent. Replies to each station
+    with None on success or a description of the error on failure.
+    """
+    try:
+        delineate = _load_delineate()
+        load_error = None
+    except Exception as e:
+        load_error = f"{type(e).__name__}: {e}"
+    lon_field = 'lon'
+
+    while True:
+        station = conn.recv()
+        if station is None:
+            break
+        if load_error is not None:
+            conn.send(load_error)
+            continue
+
+        try:
+            basin = pd.DataFrame([station]).rename(columns={'lon': lon_field})
+            try:
+                delineate(basins=basin, id_field='Station_ID')
+            except KeyError as e:
+                # some versions of the delineation library expect 'lng';
+                # use it for the rest of the stations once found
+                if lon_field != 'lon' or e.args != ('lng',):
+                    raise
+                lon_field = 'lng'
+                delineate(basins=basin.rename(columns={'lon': lon_field}), id_field='Station_ID')
+            conn.send(None)
+        except Exception as e:
+            conn.send(f"{type(e).__name__}: {e}")
+    conn.close()
+
+
+def _load_delineate():
+    """
+    Imports the watershed delineation function.
+
+    Change the path and import to use a different method for the
+    watershed delineation by changing the module and delineation
+    function being imported. If you do, also change watershed_method.
+    """
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    sys.path.append(dir_path + os.path.join("/..", "..", "Watershed_Delineation", "src", "PySheds"))
+    from main import delineate
+    return delineate
+
+
 def assign_period_overlap(match_df, prefix1, drange_1, prefix2, drange_2):
     """
     Caculates the number of days where data is available for each pair
@@ -484,26 +1603,16 @@ def assign_period_overlap(match_df, prefix1, drange_1, prefix2, drange_2):
         The original DataFrame with additional 'data_overlap',
         'total_{prefix1}_records', and 'total_{prefix2}_records' columns.
     """
-    overlap_lst = []
-    set_1_count = []
-    set_2_count = []
-
-    for ind, row in match_df.iterrows():
-        # cast ids because using the @ operator in .query()
-        # makes the id into a string for some reason and
-        # introduces other weird behaviour
-        set_1_id = row[f"{prefix1}_id"]
-        set_1_ps = drange_1.query('Station_ID == @set_1_id')
+    set_1_ids = match_df[f"{prefix1}_id"].to_numpy()
+    set_2_ids = match_df[f"{prefix2}_id"].to_numpy()
 
-        set_2_id = row[f"{prefix2}_id"]
-        set_2_ps = drange_2.query('Station_ID == @set_2_id')
+    # get the total number of records
+    set_1_count = _total_records(drange_1, set_1_ids)
+    set_2_count = _total_records(drange_2, set_2_ids)
 
-        # get the total number of records
-        set_1_count.append(set_1_ps['Num_Days'].sum())
-        set_2_count.append(set_2_ps['Num_Days'].sum())
-
-        # calculate the amount of overlap between the two period sets
-        overlap_lst.append(period_overlap(set_1_ps, set_2_ps))
+    # calculate the amount of overlap between the period sets of
+    # every pair at once
+    overlap_lst = period_overlap_pairs(set_1_ids, drange_1, set_2_ids, drange_2)
 
     # add the results to the matches
     match_df = match_df.assign(data_overlap=overlap_lst)
@@ -513,8 +1622,18 @@ def assign_period_overlap(match_df, prefix1, drange_1, prefix2, drange_2):
     return match_df
 
 
+def _total_records(drange, ids):
+    """
+    Sums Num_Days of each station in ids; 0 for stations not in drange.
+    """
+    totals = drange.groupby('Station_ID')['Num_Days'].sum()
+    return totals.reindex(ids).fillna(0).astype(totals.dtype).to_numpy()
+
+
 def dfs_search(network: nx.DiGraph, prefix1, prefix2,
-               max_distance=5000, max_depth=100, max_matches=10, **kwargs):
+               max_distance=5000, max_depth=100, max_matches=10,
+               assignments=None, max_area_ratio=None, area_field='UPLAND_SKM',
+               rank_by_area=False, **kwargs):
     """
     For the station closest to each network edge denoted by prefix1,
     locates 1 upstream and 1 downstream station denoted by prefix2
@@ -526,6 +1645,10 @@ def dfs_search(network: nx.DiGraph, prefix1, prefix2,
     attribute for each prefix suffixed by "_data". To encode
     this data to the network, assign stations to the GeoDataFrame
     before converting it to a Network using assign_stations().
+    Alternatively, pass the flat tables produced by
+    assign_stations(as_table=True) through assignments; edges are then
+    matched to their stations through the 'edge_index' edge attribute
+    added by hyriv_gdf_to_network().
 
     Distance accumulation is calculated using 2 network edge
     attributes; the 'LENGTH_M' attribute (length of the river reach
@@ -550,9 +1673,12 @@ def dfs_search(network: nx.DiGraph, prefix1, prefix2,
         Prefix denoting the network edge attribute holding origin
         station data.
 
-    :param prefix2: string
+    :param prefix2: string or list of string
         Prefix denoting the network edge attribute holding candidate
-        station data.
+        station data. If a list, every set of candidate stations is
+        checked at each edge visited by a single traversal of the
+        network, with separate max_matches for each set, and the
+        matches of all sets are returned in a single table.
 
     :param max_distance: int (default=5000)
         Maximum distance to search for a matching station in CRS units.
@@ -564,12 +1690,40 @@ def dfs_search(network: nx.DiGraph, prefix1, prefix2,
         The maximum number of river segments to traverse from an origin
         station to search for a match. The greater the resolution of the
         dataset used to build the network, the greater this value should
-        be. (HYDAT -> 10; OHN -> 100)
+        be. (HYDAT -> 10; OHN -> 100). Edges of contracted networks
+        count as the number of segments they were merged from (see
+        contract_network()).
 
     :param max_matches: int (default=10)
         Approximate maximum number of candidates to locate per origin
         station.
 
+    :param assignments: dict of {str: GeoDataFrame} or None (default)
+        Station assignment tables keyed by prefix, as produced by
+        assign_stations(as_table=True). Prefixes found here are read
+        from the tables instead of '<prefix>_data' edge attributes.
+
+    :param max_area_ratio: float or None (default)
+        Maximum ratio between the drainage areas of the edges of the
+        origin and candidate stations (the larger area over the
+        smaller). Upstream and downstream traversal stops at the first
+        edge exceeding this ratio, so searches along large rivers end
+        well before max_distance. If None, drainage areas are not
+        compared. Edges without a drainage area are never excluded.
+
+        Drainage areas are read from the area_field edge attribute.
+        Edges of contracted networks hold the area of their most
+        downstream segment (see contract_network()).
+
+    :param area_field: string (default='UPLAND_SKM')
+        Edge attribute holding the drainage area of each edge. Other
+        attributes that grow downstream, such as 'DIS_AV_CMS' (average
+        discharge), may be used instead.
+
+    :param rank_by_area: bool (default=False)
+        If True, the matches of each origin station are ordered by
+        area_ratio, then by dist.
+
     :param kwargs: keyword arguments
         Additional arguments for the operation. As of submission
         @e251ed9 the following are accepted:
@@ -600,216 +1754,384 @@ def dfs_search(network: nx.DiGraph, prefix1, prefix2,
             - data_overlap (int)
                 The number of days where data is present for both the
                 HYDAT and PWQMN stations.
+
+        If max_area_ratio is passed or rank_by_area is True:
+            - area_ratio (float)
+                Ratio between the drainage areas of the edges of the
+                origin and matched station (the larger area over the
+                smaller). 1 for stations on the same edge or edges
+                without a drainage area.
+
+        If prefix2 is a list, the prefix2_id and prefix2_dist_from_net
+        columns are replaced by:
+            - cand_source (string)
+                Prefix of the set of candidate stations the matched
+                station belongs to.
+            - cand_id (string)
+                ID of the station matched to the origin station.
+            - cand_dist_from_net (float)
+                Distance of the matched station from the network.
+
+        i.e.
+        >>> matches = dfs_search(network, 'hydat', ['pwqmn', 'datastream'])
+        >>> matches.groupby('cand_source').size()
     """
-    def bfs(source):
-        pass
-
-    # copied from the shapely documentation
-    def cut(line, distance):
-        # Cuts a line in two at a distance from its starting point
-        if distance <= 0.0 or distance >= line.length:
-            return [LineString(line)]
-
-        coords = list(line.coords)
-        for i, p in enumerate(coords):
-            pd = line.project(Point(p))
-            if pd == distance:
-                return [
-                    LineString(coords[:i+1]),
-                    LineString(coords[i:])]
-            if pd > distance:
-                cp = line.interpolate(distance)
-                return [
-                    LineString(coords[:i] + [(cp.x, cp.y)]),
-                    LineString([(cp.x, cp.y)] + coords[i:])]
-
-    def dfs(source, prefix, direction, cum_dist, depth):
-        """
-        Traverses edges recursively along the network depth-first.
-        Does not accept candidates that are greater than max_distance
-        units or max_depth segments away.
+    params = [{'max_distance': max_distance, 'max_depth': max_depth,
+               'max_matches': max_matches, 'max_area_ratio': max_area_ratio}]
+    prefixes = [prefix2] if isinstance(prefix2, str) else list(prefix2)
+    tables = _dfs_search(network, prefix1, prefixes, params, assignments=assignments,
+                         area_field=area_field)
+    matches = tables[0] if isinstance(prefix2, str) else _combine_sources(tables, prefixes)
+
+    if rank_by_area:
+        # keep the order of origin stations, and rank the matches of each
+        origins = pd.factorize(matches[prefix1 + '_id'])[0]
+        order = np.lexsort((matches['dist'].to_numpy(), matches['area_ratio'].to_numpy(), origins))
+        matches = matches.iloc[order].reset_index(drop=True)
+    elif max_area_ratio is None:
+        matches = matches.drop(columns='area_ratio')
+    return matches
+
+
+def dfs_search_sweep(network: nx.DiGraph, prefix1, prefix2,
+                     max_distance=5000, max_depth=100, max_matches=10,
+                     assignments=None, max_area_ratio=None, area_field='UPLAND_SKM'):
+    """
+    Runs dfs_search() for every combination of the passed search
+    limits, traversing the network from each origin station only once.
+
+    The traversal from each origin station is continued up to the
+    largest limits and shared by every combination; each combination
+    then accepts the same candidates dfs_search() would with those
+    limits. Sweeping several limits costs about as much as a single
+    dfs_search() with the largest limits.
+
+    i.e.
+    >>> sweep = dfs_search_sweep(network, 'hydat', 'pwqmn',
+    >>>                          max_distance=[1000, 2000, 5000, 10000],
+    >>>                          max_depth=[10, 100])
+    >>> sweep.groupby(['max_distance', 'max_depth']).size()
+
+    :param network: NetworkX Directed Graph
+        The graph to search; see dfs_search().
+
+    :param prefix1: string
+        Prefix of the origin stations.
+
+    :param prefix2: string or list of string
+        Prefix(es) of the candidate stations; see dfs_search().
+
+    :param max_distance: int or list of int (default=5000)
+        Maximum distance(s) to search for a matching station in CRS
+        units; see dfs_search().
+
+    :param max_depth: int or list of int (default=100)
+        Maximum number(s) of river segments to traverse; see
+        dfs_search().
 
-        :param source:
-            Source node key to search from.
+    :param max_matches: int or list of int (default=10)
+        Approximate maximum number(s) of candidates to locate per
+        origin station; see dfs_search().
 
-        :param prefix: string
-            Prefix of candidate station data.
+    :param assignments: dict of {str: GeoDataFrame} or None (default)
+        Station assignment tables keyed by prefix; see dfs_search().
+
+    :param max_area_ratio: float, list of float or None (default)
+        Maximum ratio(s) between the drainage areas of the origin and
+        candidate stations; see dfs_search(). If None, drainage areas
+        are not compared.
+
+    :param area_field: string (default='UPLAND_SKM')
+        Edge attribute holding the drainage area of each edge; see
+        dfs_search().
+
+    :return: Geopandas GeoDataFrame
+        The matches of every combination of limits, one after another,
+        with the columns of dfs_search() (including those for a list
+        of prefix2) and 'max_distance',
+        'max_depth' and 'max_matches' columns holding the limits each
+        match was found with. If max_area_ratio is passed, also holds
+        'area_ratio' and 'max_area_ratio' columns.
+    """
+    def as_list(value):
+        return list(value) if np.ndim(value) else [value]
+
+    params = [{'max_distance': dist, 'max_depth': depth, 'max_matches': count}
+              for dist in as_list(max_distance)
+              for depth in as_list(max_depth)
+              for count in as_list(max_matches)]
+    if max_area_ratio is not None:
+        params = [{**param, 'max_area_ratio': ratio}
+                  for param in params for ratio in as_list(max_area_ratio)]
+
+    prefixes = [prefix2] if isinstance(prefix2, str) else list(prefix2)
+    tables = _dfs_search(network, prefix1, prefixes, params, assignments=assignments,
+                         area_field=area_field)
+
+    sweep = []
+    for i, param in enumerate(params):
+        if isinstance(prefix2, str):
+            table = tables[i]
+        else:
+            table = _combine_sources(tables[i * len(prefixes):(i + 1) * len(prefixes)], prefixes)
+        if max_area_ratio is None:
+            table = table.drop(columns='area_ratio')
+        for key, value in param.items():
+            table[key] = value
+        sweep.append(table)
+
+    return gpd.GeoDataFrame(pd.concat(sweep, ignore_index=True), geometry='path',
+                            crs=Can_LCC_crs)
+
+
+def _combine_sources(tables, prefixes):
+    """
+    Combines the matches of several sets of candidate stations into a
+    single table with generic 'cand_source', 'cand_id' and
+    'cand_dist_from_net' columns.
+
+    :param tables: list of GeoDataFrame
+        Matches of each set of candidate stations, as produced by
+        dfs_search().
+
+    :param prefixes: list of string
+        Prefix of the set of candidate stations of each table.
+
+    :return: Geopandas GeoDataFrame
+        The matches of each table, one after another.
+    """
+    combined = []
+    for table, prefix in zip(tables, prefixes):
+        table = table.rename(columns={prefix + '_id': 'cand_id',
+                                      prefix + '_dist_from_net': 'cand_dist_from_net'})
+        table.insert(1, 'cand_source', prefix)
+        combined.append(table)
+    return gpd.GeoDataFrame(pd.concat(combined, ignore_index=True), geometry='path',
+                            crs=Can_LCC_crs)
+
+
+def _dfs_search(network, prefix1, prefixes, params, assignments=None,
+                area_field='UPLAND_SKM'):
+    """
+    Runs dfs_search() with each set of search limits in params, for
+    each set of candidate stations in prefixes.
+
+    Edges reached from each origin station are produced once, in
+    depth-first order, up to the largest limits (see _dfs_edges()), and
+    are replayed for every set of limits and every repeated search from
+    the same origin station. Each set of limits accepts the candidates
+    on the first edge in that order that holds unmatched candidates
+    within its limits, which are the candidates the recursive search
+    would stop at. Each set of candidate stations is searched for
+    separately, with its own max_matches, over the same traversal.
+
+    :param prefixes: list of string
+        Prefixes of the sets of candidate stations.
+
+    :param params: list of dict
+        Sets of search limits, holding 'max_distance', 'max_depth',
+        'max_matches' and optionally 'max_area_ratio' (None or missing
+        for no limit).
+
+    :param area_field: string (default='UPLAND_SKM')
+        Edge attribute holding the drainage area of each edge.
+
+    :return: list of GeoDataFrame
+        The matches found with each set of limits and candidate
+        stations, with an 'area_ratio' column; for each set of limits
+        in the order of params, the matches of each prefix in the order
+        of prefixes.
+    """
+    def station_data(data, prefix):
+        """
+        Retrieves the stations denoted by prefix that are assigned to
+        an edge, from either the edge attributes or assignment tables.
+
+        :return: DataFrame or None
+            The stations on the edge, or None if there are none.
+        """
+        return _edge_stations(data, prefix, assignments, lookups)
+
+    def edge_candidates(data, prefix, direction, cum_dist):
+        """
+        Locates the candidate stations denoted by prefix on an edge
+        reached by the search, ordered by distance from the origin
+        station. Computed once per edge and origin station, and shared
+        by every set of limits.
+
+        :return: list of tuple
+            (ID, dist_from, dist, network distance, area ratio,
+            path_last_seg) of each candidate station, where dist is the
+            greater of the direct and network distance from the origin
+            station.
+        """
+        cand_stations = station_data(data, prefix)
+        if cand_stations is None:
+            return []
+
+        cand_stations = cand_stations.sort_values(by='dist_along', ascending=not direction)
+
+        # locate and cut the edge at every candidate station at once
+        st_dists = shapely.line_locate_point(data['geometry'], cand_stations['geometry'].values)
+        snapped = shapely.line_interpolate_point(data['geometry'], st_dists)
+        pieces = cut_lines(data['geometry'], st_dists)[direction]
+        ratio = _area_ratio(origin_area, data.get(area_field))
+
+        cands = []
+        for (ind, series), snap, piece in zip(cand_stations.iterrows(), snapped, pieces):
+            direct_dist = station['geometry'].distance(series['geometry'])
+            dist = cum_dist + abs(direction * data['LENGTH_M'] - series['dist_along'])
+
+            seg = list(piece.coords)
+            if direction == 0:
+                seg.reverse()
+
+            cands.append((series['Station_ID'], series['dist_from'], max(direct_dist, dist),
+                          dist, ratio, [series['geometry'], snap, *seg]))
+        return cands
+
+    def dfs(events, direction, run):
+        """
+        Searches the edges reached from the origin station depth-first.
+        Does not accept candidates that are greater than max_distance
+        units or max_depth segments away, or that were already matched
+        to the origin station.
+
+        :param events: _Replay
+            The edges reached from the origin station in depth-first
+            order, as produced by _dfs_edges().
 
         :param direction: int (0 or 1)
             Integer flag indicating direction to search.
             0=Downstream, 1=Upstream.
 
-        :param cum_dist: float
-            Approximate cumulative distance from origin node.
-
-        :param depth: int
-            The number of segments that have been traversed.
+        :param run: dict
+            Search limits, candidate prefix and matches of the search.
 
         :return:
             If search was successful:
 
-                ID (str), dist (float), depth (int), cord_n (tuple), ... ,cord_0 (tuple)
+                IDs (list), dist_froms (list), dists (list),
+                depths (list), area_ratios (list), path_last_segs (list),
+                cord_n (tuple), ... ,cord_0 (tuple)
 
-                Where cord_n is the location of the matched candidate
-                station, cord_0 is the location of the origin station,
-                and all cords in between are that of network nodes
-                between the origin and matched station.
+                Where cord_n ... cord_0 are the coordinates of the
+                network edges between the edge of the matched candidate
+                stations and the origin station.
 
             If search was unsuccessful:
-                -1, -1, -1
+                -1, -1, -1, -1, -1, -1
         """
-        if direction == 0:
-            edges = network.out_edges(nbunch=source, data=True)
-        elif direction == 1:
-            edges = network.in_edges(nbunch=source, data=True)
-        else:
-            raise ValueError('Invalid direction')
-
-        if (cum_dist >= max_distance) or (len(edges) == 0) or (depth >= max_depth):
-            return -1, -1, -1, -1, -1
-
-        for u, v, data in edges:
-            if type(data[prefix + '_data']) in [pd.DataFrame, gpd.GeoDataFrame]:
-
-                cand_stations = data[prefix + '_data'].sort_values(by='dist_along', ascending=not direction)
-
-                ids = []
-                dist_froms = []
-                dists = []
-                depths = []
-                path_last_segs = []
-
-                for ind, series in cand_stations.iterrows():
-                    # get all indices where the origin and candidate station ids appear
-                    pref_1_indices = set([i for i, x, in enumerate(matches[prefix1 + '_id']) if x == station['Station_ID']])
-                    pref_2_indices = set([i for i, x, in enumerate(matches[prefix2 + '_id']) if x == series['Station_ID']])
-                    
-                    # if any of them appear at the same index with matches, it indicates that
-                    # the matched pair has already been added
-                    if len(pref_1_indices & pref_2_indices) == 0:
-                    
-                        direct_dist = station['geometry'].distance(series['geometry'])
-                        dist = cum_dist + abs(direction * data['LENGTH_M'] - series['dist_along'])
-                        
-                        st_dist = data['geometry'].project(series['geometry'])
-                        
-                        try:
-                            seg = list(cut(data['geometry'], st_dist)[direction].coords)
-                        except IndexError:
-                            seg = []
-                        
-                        if direction == 0:
-                            seg.reverse()
-                        
-                        if dist < max_distance:
-                            ids.append(series['Station_ID'])
-                            dist_froms.append(series['dist_from'])
-                            dists.append(max(direct_dist, dist))
-                            depths.append(depth)
-                            path_last_segs.append([
-                                series['geometry'],
-                                data['geometry'].interpolate(data['geometry'].project(series['geometry'])),
-                                *seg])
-                        else:
-                            break
-                            
-                if len(ids) > 0:
-                    return ids, dist_froms, dists, depths, path_last_segs
-            
-            if direction == 0:
-                segment = list(data['geometry'].coords)
-                segment.reverse()
-            else:
-                segment = list(data['geometry'].coords)
-                
-            result = *dfs((u, v)[not direction], prefix2, direction, cum_dist + data['LENGTH_M'], depth + 1), *segment
-                            
-
-            if result[0] != -1:
-                return result
-        # This is only run if there are no edges and the function has
-        # reached the end of the line
-        return -1, -1, -1, -1, -1
-
-    def add_to_matches(id1, id2, dist_from_1, dist_from_2, path, dist_, pos_, depth):
+        max_distance = run['max_distance']
+        prefix = run['prefix']
+        for event in events:
+            u, v, data, cum_dist, depth, chain, path_ratio, found = event
+            # edges past any limit are not reached with this set of limits
+            if (cum_dist >= max_distance) or (depth >= run['max_depth']) or \
+                    (path_ratio > run['max_area_ratio']):
+                continue
+            if found is None:
+                found = event[7] = {}
+            if prefix not in found:
+                found[prefix] = edge_candidates(data, prefix, direction, cum_dist)
+            cands = found[prefix]
+
+            ids = []
+            dist_froms = []
+            dists = []
+            depths = []
+            ratios = []
+            path_last_segs = []
+
+            for cand_id, dist_from, dist, net_dist, ratio, seg in cands:
+                # skip pairs that have already been matched
+                if (station['Station_ID'], cand_id) not in run['pairs']:
+                    if net_dist < max_distance:
+                        ids.append(cand_id)
+                        dist_froms.append(dist_from)
+                        dists.append(dist)
+                        depths.append(depth)
+                        ratios.append(ratio)
+                        path_last_segs.append(seg)
+                    else:
+                        break
+
+            if len(ids) > 0:
+                # edges traversed to reach this edge, nearest first
+                point_list = []
+                while chain is not None:
+                    seg_data, chain = chain
+                    segment = list(seg_data['geometry'].coords)
+                    if direction == 0:
+                        segment.reverse()
+                    point_list += segment
+                return ids, dist_froms, dists, depths, ratios, path_last_segs, *point_list
+
+        return -1, -1, -1, -1, -1, -1
+
+    def add_to_matches(run, id1, id2, dist_from_1, dist_from_2, path, dist_, pos_, depth,
+                       ratio):
         """
         Helper function that adds a set of values to a dictionary with specific keys.
         """
+        matches = run['matches']
         matches[prefix1 + '_id'].append(id1)
-        matches[prefix2 + '_id'].append(id2)
+        matches[run['prefix'] + '_id'].append(id2)
         matches[prefix1 + '_dist_from_net'].append(dist_from_1)
-        matches[prefix2 + '_dist_from_net'].append(dist_from_2)
+        matches[run['prefix'] + '_dist_from_net'].append(dist_from_2)
         matches['path'].append(path)
         matches['dist'].append(dist_)
         matches['pos'].append(pos_)
         matches['seg_apart'].append(depth)
+        matches['area_ratio'].append(ratio)
+        run['pairs'].add((id1, id2))
 
-    def on_segment():
+    def on_segment(run, row, piece, row_snap):
         """
         Helper function defining algorithm behaviour for stations on
         the same segment. Distance is measured as either the absolute
         distance between their geometries or the distance between
         them along the network - whichever is greater.
+
+        piece is the part of the edge between the origin and candidate
+        station, and row_snap the location of the candidate station on
+        the edge. Both are computed for all candidates on the edge at
+        once by the main loop.
         """
         direct_dist = station['geometry'].distance(row['geometry'])
         segment_dist = abs(station['dist_along'] - row['dist_along'])
         on_dist = max(segment_dist, direct_dist)
-        
-        st_dist = data['geometry'].project(station['geometry'])
-        row_dist = data['geometry'].project(row['geometry'])
-        
-        try:
-            split = cut(data['geometry'], st_dist)
 
-            if st_dist <= row_dist:
-                piece_coords = list(cut(split[1], row_dist - st_dist)[0].coords)
-            else:
-                piece_coords = list(cut(split[0], row_dist)[1].coords)
-                piece_coords.reverse()
-
-            points = [
-                station['geometry'],
-                data['geometry'].interpolate(st_dist),
-                *piece_coords,
-                data['geometry'].interpolate(row_dist),
-                row['geometry']
-            ]
-        except:
-            points = [
-                station['geometry'],
-                data['geometry'].interpolate(st_dist),
-                data['geometry'].interpolate(row_dist),
-                row['geometry']
-            ]
+        points = [
+            station['geometry'],
+            st_snap,
+            *piece.coords,
+            row_snap,
+            row['geometry']
+        ]
 
         pos = 'On-' + ('Up' if station['dist_along'] > row['dist_along'] else 'Down')
-        add_to_matches(station['Station_ID'], row['Station_ID'],
+        add_to_matches(run, station['Station_ID'], row['Station_ID'],
                        station['dist_from'], row['dist_from'],
                        LineString(points),
-                       on_dist, pos, 0)
+                       on_dist, pos, 0, 1.0)
 
-    def off_segment(match_count):
+    def off_segment(run, match_count):
         """
         Helper function defining algorithm behaviour for stations not
         on the same segment.
         """
         # Check for candidate stations upstream and downstream
-        down_id, down_from, down_dist, down_depth, down_seg, *point_list = dfs(
-                v, prefix2, 0, data['LENGTH_M'] - station['dist_along'], 0)
+        down_id, down_from, down_dist, down_depth, down_ratio, down_seg, *point_list = dfs(
+            down_events, 0, run)
+        up_id, up_from, up_dist, up_depth, up_ratio, up_seg, *point_list2 = dfs(
+            up_events, 1, run)
 
-        up_id, up_from, up_dist, up_depth, up_seg, *point_list2 = dfs(
-                u, prefix2, 1, station['dist_along'], 0)
-        
-        st_dist = data['geometry'].project(station['geometry'])
-        split = cut(data['geometry'], st_dist)
-        start = [data['geometry'].interpolate(st_dist), station['geometry']]
+        start = [st_snap, station['geometry']]
         
-        try:
-            coords = list(split[1].coords)
-            coords.reverse()
-            coords2 = list(split[0].coords)
-        except IndexError:
-            coords, coords2 = [],  []
+        coords = list(st_tail.coords)
+        coords.reverse()
+        coords2 = list(st_head.coords)
         
         point_list += coords + start
         point_list2 += coords2 + start
@@ -818,59 +2140,940 @@ def dfs_search(network: nx.DiGraph, prefix1, prefix2,
             for i in range(len(down_id)):
                 pts = down_seg[i] + point_list
                 match_count += 1
-                add_to_matches(station['Station_ID'], down_id[i], station['dist_from'],
+                add_to_matches(run, station['Station_ID'], down_id[i], station['dist_from'],
                                down_from[i], LineString(pts), down_dist[i],
-                               "Down", down_depth[i])
+                               "Down", down_depth[i], down_ratio[i])
 
         if up_id != -1:
             for i in range(len(up_id)):
                 pts = up_seg[i] + point_list2
                 match_count += 1
-                add_to_matches(station['Station_ID'], up_id[i], station['dist_from'],
+                add_to_matches(run, station['Station_ID'], up_id[i], station['dist_from'],
                                up_from[i], LineString(pts), up_dist[i],
-                               "Up", up_depth[i])
+                               "Up", up_depth[i], up_ratio[i])
         return match_count
 
     # ===================================================================== #
     # Algorithm main
     # ===================================================================== #
-    
-    matches = {prefix1 + '_id': [], prefix2 + '_id' : [],
-               prefix1 + '_dist_from_net': [], prefix2 + '_dist_from_net': [],
-               'path': [], 'dist': [], 'pos': [], 'seg_apart': []}
+
+    runs = []
+    for param in params:
+        max_area_ratio = param.get('max_area_ratio')
+        for prefix2 in prefixes:
+            runs.append({**param, 'prefix': prefix2, 'pairs': set(), 'matches': {
+                prefix1 + '_id': [], prefix2 + '_id': [],
+                prefix1 + '_dist_from_net': [], prefix2 + '_dist_from_net': [],
+                'path': [], 'dist': [], 'pos': [], 'seg_apart': [], 'area_ratio': []},
+                'max_area_ratio': np.inf if max_area_ratio is None else max_area_ratio})
+
+    # the traversal is shared by every set of limits, so it goes as far
+    # as the largest of them
+    limit_distance = max(run['max_distance'] for run in runs)
+    limit_depth = max(run['max_depth'] for run in runs)
+    limit_ratio = max(run['max_area_ratio'] for run in runs)
+
+    if assignments is None:
+        assignments = {}
+    lookups = {prefix: _table_lookup(table) for prefix, table in assignments.items()}
 
     # check each edge for origin stations
     for u, v, data in network.out_edges(data=True):
-        match_count = 0
+        for run in runs:
+            run['count'] = 0
 
-        pref_1_data = data[prefix1 + '_data']
-        pref_2_data = data[prefix2 + '_data']
+        pref_1_data = station_data(data, prefix1)
 
         # check for the presence of origin station data
-        if type(pref_1_data) in [pd.DataFrame, gpd.GeoDataFrame]:
+        if pref_1_data is not None:
             if not pref_1_data.empty:
                 # for each origin station on the edge
                 stations = pref_1_data.sort_values(by='dist_along', ascending=True)
 
-                for ind, station in stations.iterrows():
+                # locate every station on the edge and build the pieces
+                # of the edge used to construct paths in bulk
+                st_dists = shapely.line_locate_point(data['geometry'], stations['geometry'].values)
+                st_snaps = shapely.line_interpolate_point(data['geometry'], st_dists)
+                st_heads, st_tails = cut_lines(data['geometry'], st_dists)
+                origin_area = data.get(area_field)
+
+                # candidate stations on the same edge, of each prefix
+                on_edge = {}
+                for prefix2 in prefixes:
+                    pref_2_data = station_data(data, prefix2)
+                    if pref_2_data is not None:
+                        row_dists = shapely.line_locate_point(data['geometry'], pref_2_data['geometry'].values)
+                        on_edge[prefix2] = ([row for ind, row in pref_2_data.iterrows()], row_dists,
+                                            shapely.line_interpolate_point(data['geometry'], row_dists))
+
+                for (ind, station), st_dist, st_snap, st_head, st_tail in zip(
+                        stations.iterrows(), st_dists, st_snaps, st_heads, st_tails):
+                    down_events = _Replay(_dfs_edges(
+                        network, v, 0, data['LENGTH_M'] - station['dist_along'], 0,
+                        limit_distance, limit_depth, origin_area, area_field, limit_ratio))
+                    up_events = _Replay(_dfs_edges(
+                        network, u, 1, station['dist_along'], 0, limit_distance, limit_depth,
+                        origin_area, area_field, limit_ratio))
+
                     # Check if there are candidate stations on the same river segment
-                    if type(pref_2_data) in [pd.DataFrame, gpd.GeoDataFrame]:
-                        for ind, row in pref_2_data.iterrows():
-                            match_count += 1
-                            on_segment()
+                    pieces = {prefix2: line_substrings(data['geometry'], st_dist, row_dists)
+                              for prefix2, (rows, row_dists, row_snaps) in on_edge.items()}
+
+                    for run in runs:
+                        if run['prefix'] in on_edge:
+                            rows, row_dists, row_snaps = on_edge[run['prefix']]
+                            for row, row_snap, piece in zip(rows, row_snaps, pieces[run['prefix']]):
+                                run['count'] += 1
+                                on_segment(run, row, piece, row_snap)
+
+                        for i in range(run['max_matches'] - run['count']):
+                            if run['count'] >= run['max_matches']:
+                                break
+                            run['count'] = off_segment(run, run['count'])
+
+    return [gpd.GeoDataFrame(data=run['matches'], geometry='path', crs=Can_LCC_crs)
+            for run in runs]
+
+
+def _dfs_edges(network, source, direction, cum_dist, depth, max_distance, max_depth,
+               area=None, area_field='UPLAND_SKM', max_area_ratio=np.inf):
+    """
+    Generates the edges reached from source in depth-first order; each
+    edge is followed by the edges reached through it, then by the
+    edges after it at the same node. Edges are not followed past
+    nodes max_distance units or max_depth segments from source, or
+    past edges whose drainage area ratio to area exceeds
+    max_area_ratio (these edges are not generated).
+
+    :param direction: int (0 or 1)
+        Integer flag indicating direction to search.
+        0=Downstream, 1=Upstream.
+
+    :param cum_dist: float
+        Approximate cumulative distance from the origin station to
+        source.
+
+    :param depth: int
+        The number of segments between the origin station and source.
+
+    :param area: float or None (default)
+        Drainage area of the edge of the origin station.
+
+    :param area_field: string (default='UPLAND_SKM')
+        Edge attribute holding the drainage area of each edge.
+
+    :param max_area_ratio: float (default=np.inf)
+        Maximum drainage area ratio to area of edges to generate.
+
+    :return: generator of list
+        [u, v, data, cum_dist, depth, chain, ratio, None] of each edge,
+        where cum_dist and depth are those of the node the edge was
+        reached from, chain holds the data of the edges traversed to
+        reach it as nested tuples (data, (data, ... None)), nearest
+        first, and ratio is the largest drainage area ratio of the
+        edge and the edges traversed to reach it. The last item is left
+        for the caller to store results in.
+    """
+    if direction not in (0, 1):
+        raise ValueError('Invalid direction')
+
+    def node_edges(node, cum_dist, depth, chain, ratio):
+        if (cum_dist >= max_distance) or (depth >= max_depth):
+            return iter(())
+        if direction == 0:
+            edges = network.out_edges(nbunch=node, data=True)
+        else:
+            edges = network.in_edges(nbunch=node, data=True)
+        return ((u, v, data, cum_dist, depth, chain, ratio) for u, v, data in edges)
+
+    # an iterative traversal, so deep searches are not limited by the
+    # recursion limit
+    stack = [node_edges(source, cum_dist, depth, None, 1.0)]
+    while stack:
+        edge = next(stack[-1], None)
+        if edge is None:
+            stack.pop()
+            continue
+
+        u, v, data, cum_dist, depth, chain, ratio = edge
+        # the largest ratio along the path, so every edge past one
+        # exceeding max_area_ratio is left out too
+        ratio = max(ratio, _area_ratio(area, data.get(area_field)))
+        if ratio > max_area_ratio:
+            continue
+
+        yield [u, v, data, cum_dist, depth, chain, ratio, None]
+        stack.append(node_edges((u, v)[not direction], cum_dist + data['LENGTH_M'],
+                                depth + data.get('n_segments', 1), (data, chain), ratio))
+
+
+def _area_ratio(area, edge_area):
+    """
+    Ratio between 2 drainage areas; the larger area over the smaller.
+
+    :return: float
+        The ratio, or 1 if either area is missing or not positive.
+    """
+    if area is None or edge_area is None or pd.isna(area) or pd.isna(edge_area) \
+            or area <= 0 or edge_area <= 0:
+        return 1.0
+    return max(area / edge_area, edge_area / area)
+
 
-                    for i in range(max_matches - match_count):
-                        if match_count >= max_matches:
-                            break
-                        match_count = off_segment(match_count)
+class _Replay:
+    """
+    Iterable over the items of a generator that keeps the items as they
+    are produced, so they can be iterated over again from the start
+    without producing them again.
+    """
+    def __init__(self, generator):
+        self.generator = generator
+        self.items = []
+
+    def __iter__(self):
+        i = 0
+        while True:
+            if i == len(self.items):
+                try:
+                    self.items.append(next(self.generator))
+                except StopIteration:
+                    return
+            yield self.items[i]
+            i += 1
+
+
+def _edge_stations(data, prefix, assignments, lookups):
+    """
+    Retrieves the stations denoted by prefix that are assigned to an
+    edge, from either the edge attributes or assignment tables.
+
+    :param data: dict
+        Attributes of the edge.
+
+    :param prefix: string
+        Prefix of the stations to retrieve.
+
+    :param assignments: dict of {str: GeoDataFrame}
+        Assignment tables keyed by prefix; see dfs_search().
+
+    :param lookups: dict of {str: dict}
+        _table_lookup() of each table in assignments.
+
+    :return: DataFrame or None
+        The stations on the edge, or None if there are none.
+    """
+    if prefix in lookups:
+        bounds = lookups[prefix].get(data.get('edge_index'))
+        if bounds is None:
+            return None
+        return assignments[prefix].iloc[bounds[0]:bounds[1]]
+
+    st_data = data.get(prefix + '_data')
+    if type(st_data) in [pd.DataFrame, gpd.GeoDataFrame]:
+        return st_data
+    return None
+
+
+class CandidateIndex:
+    """
+    The k nearest candidate stations downstream and upstream of every
+    node of a river network.
+
+    Built by sweeping the network once in reverse topological order
+    (downstream candidates) and once in topological order (upstream
+    candidates): the candidates of a node are those on its edges and
+    the candidates of the nodes at the other end of its edges, shifted
+    by the edge length. Finding the nearest candidates of a station is
+    then a lookup at the end of its edge instead of a search.
+
+    Each entry is a tuple (dist, depth, candidate, edge, tail), where
+    dist is the distance along the network from the node to the
+    candidate, depth the number of segments in between, candidate
+    the position of the candidate in self.candidates, edge the edge
+    leaving the node towards the candidate and tail the entry of the
+    node at the other end of edge (None if the candidate is on edge).
+    Entries of successive nodes share their tails, so the path to
+    every candidate is stored once.
+
+    The sweeps require a topological order, so the index can only be
+    built for networks without cycles (directed loops, which momepy
+    built networks of braided rivers or misdigitized segments may
+    contain). Use dfs_search() for such networks; check_hyriv_network()
+    and nx.find_cycle() help locate the offending segments.
+
+    :param network: NetworkX MultiDiGraph
+        Network without cycles, such as produced by
+        hyriv_gdf_to_network(). Edges must hold 'LENGTH_M' and
+        'geometry' attributes.
+
+    :param prefix: string
+        Prefix denoting candidate station data; see dfs_search().
+
+    :param k: int (default=1)
+        Number of candidates to keep per node and direction.
+
+    :param max_distance: float or None (default)
+        Candidates farther than max_distance meters along the network
+        are not kept. If None, there is no limit.
+
+    :param assignments: dict of {str: GeoDataFrame} or None (default)
+        Station assignment tables keyed by prefix; see dfs_search().
+
+    :raises ValueError:
+        If the network contains cycles.
+    """
+    def __init__(self, network: nx.MultiDiGraph, prefix, k=1, max_distance=None,
+                 assignments=None):
+        self.network = network
+        self.prefix = prefix
+        self.k = k
+        self.max_distance = max_distance
+
+        assignments = assignments or {}
+        lookups = {key: _table_lookup(table) for key, table in assignments.items()}
+
+        # candidates grouped by edge and sorted by distance along it
+        tables = []
+        self.on_edge = {}
+        start = 0
+        for u, v, key, data in network.edges(keys=True, data=True):
+            st_data = _edge_stations(data, prefix, assignments, lookups)
+            if st_data is None or st_data.empty:
+                continue
+            st_data = st_data.sort_values(by='dist_along')
+            tables.append(st_data[['Station_ID', 'dist_along', 'dist_from', 'geometry']])
+            self.on_edge[(u, v, key)] = np.arange(start, start + len(st_data))
+            start += len(st_data)
+
+        if tables:
+            self.candidates = gpd.GeoDataFrame(pd.concat(tables, ignore_index=True),
+                                               geometry='geometry', crs=Can_LCC_crs)
+        else:
+            self.candidates = gpd.GeoDataFrame(
+                columns=['Station_ID', 'dist_along', 'dist_from', 'geometry'],
+                geometry='geometry', crs=Can_LCC_crs)
+        along = self.candidates['dist_along'].to_numpy()
+
+        try:
+            order = list(nx.topological_sort(network))
+        except nx.NetworkXUnfeasible:
+            raise ValueError("CandidateIndex requires a network without cycles; "
+                             "use dfs_search() for networks with cycles.")
+
+        self.down = {}
+        for node in reversed(order):
+            entries = []
+            for edge in network.out_edges(node, keys=True):
+                data = network.edges[edge]
+                entries += [(along[c], 0, c, edge, None) for c in self.on_edge.get(edge, ())]
+                entries += [(tail[0] + data['LENGTH_M'], tail[1] + data.get('n_segments', 1),
+                             tail[2], edge, tail) for tail in self.down.get(edge[1], ())]
+            self.down[node] = self._best(entries)
+
+        self.up = {}
+        for node in order:
+            entries = []
+            for edge in network.in_edges(node, keys=True):
+                data = network.edges[edge]
+                entries += [(data['LENGTH_M'] - along[c], 0, c, edge, None)
+                            for c in self.on_edge.get(edge, ())[::-1]]
+                entries += [(tail[0] + data['LENGTH_M'], tail[1] + data.get('n_segments', 1),
+                             tail[2], edge, tail) for tail in self.up.get(edge[0], ())]
+            self.up[node] = self._best(entries)
+
+    def nearest(self, edge, dist_along, direction=0, k=None, max_distance=None):
+        """
+        Finds the nearest candidates downstream or upstream of a
+        location on an edge, excluding candidates on the same edge.
+
+        :param edge: tuple
+            (u, v, key) of the edge.
+
+        :param dist_along: float
+            Distance of the location along the edge in meters.
+
+        :param direction: int (0 or 1)
+            0=Downstream, 1=Upstream.
+
+        :param k: int or None (default)
+            Number of candidates to return; at most self.k. If None,
+            uses self.k.
+
+        :param max_distance: float or None (default)
+            Maximum distance along the network in meters; at most
+            self.max_distance. If None, uses self.max_distance.
+
+        :return: list of tuple
+            (candidate, dist, depth, edges) of each candidate, from
+            nearest to farthest. edges are the edges traversed from the
+            end of edge to the candidate, ending with the edge holding
+            the candidate.
+
+        :raises ValueError:
+            If k or max_distance exceed those the index was built with,
+            as the index does not hold the additional candidates.
+        """
+        k = self.k if k is None else k
+        max_distance = self.max_distance if max_distance is None else max_distance
+        self.check_limits(k, max_distance)
+        if direction == 0:
+            offset = self.network.edges[edge]['LENGTH_M'] - dist_along
+            entries = self.down.get(edge[1], ())
+        elif direction == 1:
+            offset = dist_along
+            entries = self.up.get(edge[0], ())
+        else:
+            raise ValueError('Invalid direction')
+
+        results = []
+        for entry in entries[:k]:
+            dist = entry[0] + offset
+            if max_distance is not None and dist >= max_distance:
+                break
+            candidate, depth = int(entry[2]), entry[1]
+            edges = []
+            while entry is not None:
+                edges.append(entry[3])
+                entry = entry[4]
+            results.append((candidate, dist, depth, edges))
+        return results
+
+    def check_limits(self, k, max_distance):
+        """
+        Checks that the index holds enough candidates to answer queries
+        for k candidates within max_distance.
+
+        :raises ValueError:
+            If k is greater than self.k, or max_distance is greater
+            than self.max_distance (or None while self.max_distance is
+            not).
+        """
+        if k > self.k:
+            raise ValueError(f"Cannot find {k} candidates with a CandidateIndex "
+                             f"built with k={self.k}.")
+        if self.max_distance is not None and (max_distance is None or
+                                              max_distance > self.max_distance):
+            raise ValueError(f"Cannot find candidates within {max_distance} m with a "
+                             f"CandidateIndex built with max_distance={self.max_distance}.")
+
+    def segments(self, edges):
+        """
+        Expands edges of a path into the 'edge_index' of the segments
+        they are made of (see contract_network()).
+
+        :param edges: list of tuple
+            (u, v, key) of each edge.
+
+        :return: list
+            'edge_index' of each segment along the path.
+        """
+        segments = []
+        for edge in edges:
+            data = self.network.edges[edge]
+            segments += data.get('segments', [data.get('edge_index')])
+        return segments
+
+    def _best(self, entries):
+        """
+        Keeps the k nearest entries within max_distance, 1 per
+        candidate.
+        """
+        entries.sort(key=lambda entry: (entry[0], entry[2]))
+        best, seen = [], set()
+        for entry in entries:
+            if self.max_distance is not None and entry[0] >= self.max_distance:
+                break
+            if entry[2] not in seen:
+                seen.add(entry[2])
+                best.append(entry)
+                if len(best) == self.k:
+                    break
+        return tuple(best)
 
-    matches = gpd.GeoDataFrame(data=matches, geometry='path', crs=Can_LCC_wkt)
+
+def nearest_search(network: nx.MultiDiGraph, prefix1, prefix2, max_distance=5000,
+                   k=1, assignments=None, index=None):
+    """
+    For each station denoted by prefix1, locates the k nearest
+    upstream and k nearest downstream stations denoted by prefix2
+    along the network, as well as every prefix2 station on the same
+    edge, using a CandidateIndex.
+
+    Unlike dfs_search(), which returns the candidates of the first
+    branch it finds, the located candidates are the nearest along the
+    network, and the cost of matching does not depend on the number
+    of edges between stations. The output has the same structure as
+    that of dfs_search().
+
+    :param network: NetworkX MultiDiGraph
+        The network to search, without cycles. Must contain station
+        data stored as edge attributes or passed through assignments.
+
+    :param prefix1: string
+        Prefix denoting origin station data.
+
+    :param prefix2: string
+        Prefix denoting candidate station data.
+
+    :param max_distance: int (default=5000)
+        Maximum distance along the network in meters to search for a
+        matching station.
+
+    :param k: int (default=1)
+        Number of candidates to locate in each direction per origin
+        station.
+
+    :param assignments: dict of {str: GeoDataFrame} or None (default)
+        Station assignment tables keyed by prefix; see dfs_search().
+
+    :param index: CandidateIndex or None (default)
+        A prebuilt index of the prefix2 stations of network, with
+        index.k >= k and index.max_distance either None or
+        >= max_distance. If None, one is built.
+
+    :return: Geopandas GeoDataFrame
+        See dfs_search().
+
+    :raises ValueError:
+        If the network contains cycles (see CandidateIndex).
+    """
+    if assignments is None:
+        assignments = {}
+    lookups = {prefix: _table_lookup(table) for prefix, table in assignments.items()}
+    if index is None:
+        index = CandidateIndex(network, prefix2, k=k, max_distance=max_distance,
+                               assignments=assignments)
+
+    cands = index.candidates
+    cand_geoms = cands.geometry.values
+    matches = {prefix1 + '_id': [], prefix2 + '_id': [],
+               prefix1 + '_dist_from_net': [], prefix2 + '_dist_from_net': [],
+               'path': [], 'dist': [], 'pos': [], 'seg_apart': []}
+
+    def add_to_matches(station, cand, path, dist_, pos_, depth):
+        matches[prefix1 + '_id'].append(station['Station_ID'])
+        matches[prefix2 + '_id'].append(cands['Station_ID'].iat[cand])
+        matches[prefix1 + '_dist_from_net'].append(station['dist_from'])
+        matches[prefix2 + '_dist_from_net'].append(cands['dist_from'].iat[cand])
+        matches['path'].append(LineString(path))
+        matches['dist'].append(dist_)
+        matches['pos'].append(pos_)
+        matches['seg_apart'].append(depth)
+
+    def cand_piece(cand, edge, direction):
+        """
+        The part of the edge holding a candidate between the node it is
+        reached from and the candidate, and the snapped candidate.
+        """
+        line = network.edges[edge]['geometry']
+        cand_dist = shapely.line_locate_point(line, cand_geoms[cand])
+        start = 0 if direction == 0 else np.inf
+        return (line_substrings(line, start, cand_dist)[0],
+                shapely.line_interpolate_point(line, cand_dist))
+
+    for u, v, key, data in network.edges(keys=True, data=True):
+        stations = _edge_stations(data, prefix1, assignments, lookups)
+        if stations is None or stations.empty:
+            continue
+
+        edge = (u, v, key)
+        line = data['geometry']
+        stations = stations.sort_values(by='dist_along', ascending=True)
+        st_dists = shapely.line_locate_point(line, stations['geometry'].values)
+        st_snaps = shapely.line_interpolate_point(line, st_dists)
+        st_heads, st_tails = cut_lines(line, st_dists)
+
+        on_edge = index.on_edge.get(edge, np.array([], dtype=int))
+        row_dists = shapely.line_locate_point(line, cand_geoms[on_edge])
+        row_snaps = shapely.line_interpolate_point(line, row_dists)
+        row_along = cands['dist_along'].to_numpy()[on_edge]
+
+        for (ind, station), st_dist, st_snap, st_head, st_tail in zip(
+                stations.iterrows(), st_dists, st_snaps, st_heads, st_tails):
+            # direct distances are only measured to candidates that are
+            # matched, so matching stays linear in the number of stations
+            on_direct = shapely.distance(station['geometry'], cand_geoms[on_edge])
+
+            # candidates on the same edge
+            pieces = line_substrings(line, st_dist, row_dists)
+            for cand, along, row_snap, piece, direct in zip(on_edge, row_along, row_snaps,
+                                                            pieces, on_direct):
+                on_dist = max(abs(station['dist_along'] - along), direct)
+                pos = 'On-' + ('Up' if station['dist_along'] > along else 'Down')
+                add_to_matches(station, cand,
+                               [station['geometry'], st_snap, *piece.coords,
+                                row_snap, cand_geoms[cand]],
+                               on_dist, pos, 0)
+
+            # candidates downstream and upstream; paths are built from
+            # the origin and reversed to match dfs_search()
+            for direction, pos, st_piece in ((0, "Down", st_tail), (1, "Up", st_head)):
+                st_coords = list(st_piece.coords)
+                if direction == 1:
+                    st_coords.reverse()
+
+                for cand, dist, depth, edges in index.nearest(
+                        edge, station['dist_along'], direction, k=k, max_distance=max_distance):
+                    path = [station['geometry'], st_snap, *st_coords]
+                    for traversed in edges[:-1]:
+                        seg = list(network.edges[traversed]['geometry'].coords)
+                        if direction == 1:
+                            seg.reverse()
+                        path += seg
+                    piece, snap = cand_piece(cand, edges[-1], direction)
+                    path += [*piece.coords, snap, cand_geoms[cand]]
+                    path.reverse()
+
+                    direct = station['geometry'].distance(cand_geoms[cand])
+                    add_to_matches(station, cand, path, max(direct, dist), pos, depth)
+
+    matches = gpd.GeoDataFrame(data=matches, geometry='path', crs=Can_LCC_crs)
 
     return matches
 
 
+class NetworkQuery:
+    """
+    Finds the nearest candidate stations along a river network to
+    arbitrary locations.
+
+    The spatial index, station assignments, network and CandidateIndex
+    are built once, so each batch of locations only needs to be
+    snapped to the network and looked up in the CandidateIndex. When
+    several candidate sets are passed, they share the spatial index
+    and network, and only the CandidateIndex is built per set.
+
+    examples:
+        1: query = NetworkQuery(load_data.load_rivers(bbox=bbox), hydat, k=3)
+           nearest = query.query([-79.4, -80.1], [43.7, 43.5], direction='up')
+        2: query = NetworkQuery(rivers, {'hydat': hydat, 'pwqmn': pwqmn}, k=3)
+           nearest = query.query([-79.4, -80.1], [43.7, 43.5], station_set='pwqmn')
+
+    :param rivers: Geopandas GeoDataFrame
+        HydroRIVERS (or similar) LineStrings; see hyriv_gdf_to_network().
+        The index labels must be unique; they are reported as the
+        segment IDs of paths.
+
+    :param candidates: Geopandas GeoDataFrame or dict of {str: GeoDataFrame}
+        The candidate station Points, or several sets of them keyed by
+        set name. Each must contain a 'Station_ID' field. A single
+        GeoDataFrame is named 'candidate'.
+
+    :param k: int (default=5)
+        Maximum number of candidates that can be requested per
+        location and direction.
+
+    :param max_distance: float or None (default)
+        Maximum distance along the network in meters to search for
+        candidates. If None, there is no limit.
+
+    :param snap_distance: int (default=750)
+        The maximum distance within which to snap candidates and query
+        locations to the network. See assign_stations().
+
+    :param len_f: string (default='LENGTH_KM')
+        Field holding the length of each river segment. See
+        assign_stations().
+
+    :param len_unit: string {'km', 'm'} (default='km')
+        The unit of the len_f field.
+
+    :param contract: bool (default=True)
+        If True, merge river segments without candidates of any set
+        into single edges (see contract_network()).
+
+    :raises ValueError:
+        If the network built from rivers contains cycles (see
+        CandidateIndex).
+    """
+    def __init__(self, rivers: gpd.GeoDataFrame, candidates, k=5, max_distance=None,
+                 snap_distance=750, len_f='LENGTH_KM', len_unit='km', contract=True):
+        rivers = to_lcc(rivers)
+        if isinstance(candidates, gpd.GeoDataFrame):
+            candidates = {'candidate': candidates}
+        self.k = k
+        self.max_distance = max_distance
+        self.snap_distance = snap_distance
+
+        self.segment_index = SegmentIndex(rivers, len_f=len_f, len_unit=len_unit)
+        self.assignments = {name: assign_stations(self.segment_index, stations, prefix=name,
+                                                  max_distance=snap_distance, as_table=True)
+                            for name, stations in candidates.items()}
+
+        lengths = pd.Series(_index_length_m(self.segment_index), index=self.segment_index.index)
+        self.network = hyriv_gdf_to_network(rivers.assign(LENGTH_M=lengths.to_numpy()),
+                                            contract=contract, assignments=self.assignments)
+        self.candidate_indexes = {name: CandidateIndex(self.network, name, k=k,
+                                                       max_distance=max_distance,
+                                                       assignments=self.assignments)
+                                  for name in candidates}
+
+        # network edge holding each segment, and the distance from the
+        # start of the edge to the start of the segment
+        self.locations = {}
+        for u, v, key, data in self.network.edges(keys=True, data=True):
+            offset = 0
+            for segment in data.get('segments', [data['edge_index']]):
+                self.locations[segment] = ((u, v, key), offset)
+                offset += lengths[segment]
+
+    def snap(self, lon, lat) -> pd.DataFrame:
+        """
+        Finds the river segment closest to each location.
+
+        :param lon: float or array-like of float
+            Longitude of each location (EPSG:4326).
+
+        :param lat: float or array-like of float
+            Latitude of each location (EPSG:4326).
+
+        :return: DataFrame
+            'point' (position of the location in lon/lat), 'segment'
+            (index label of the segment), 'dist_along' and 'dist_from'
+            of each location within snap_distance of the network,
+            sorted by location. Locations at a junction are snapped to
+            every segment meeting there.
+        """
+        points = gpd.GeoSeries(gpd.points_from_xy(np.atleast_1d(lon), np.atleast_1d(lat)),
+                               crs=4326)
+        table = self.segment_index.snap(gpd.GeoDataFrame({'Station_ID': np.arange(len(points))},
+                                                         geometry=points),
+                                        max_distance=self.snap_distance)
+        table = pd.DataFrame({'point': table['Station_ID'], 'segment': table['edge_index'],
+                              'dist_along': table['dist_along'],
+                              'dist_from': table['dist_from']})
+        return table.sort_values(by='point', kind='stable', ignore_index=True)
+
+    def query(self, lon, lat, direction='either', k=None, max_distance=None, station_set=None):
+        """
+        Finds the k nearest candidates along the network to each
+        location.
+
+        :param lon: float or array-like of float
+            Longitude of each location (EPSG:4326).
+
+        :param lat: float or array-like of float
+            Latitude of each location (EPSG:4326).
+
+        :param direction: string {'up', 'down', 'either'} (default='either')
+            Whether to return the k nearest candidates upstream,
+            downstream or in either direction. Candidates on the same
+            river segment count as both upstream or downstream
+            depending on their position.
+
+        :param k: int or None (default)
+            Number of candidates to return per location; at most
+            self.k. If None, uses self.k.
+
+        :param max_distance: float or None (default)
+            Maximum distance along the network in meters; at most
+            self.max_distance. If None, uses self.max_distance.
+
+        :param station_set: string or None (default)
+            Name of the candidate set to search. May only be None if
+            the query was built with a single set.
+
+        :return: DataFrame
+            1 row per location/candidate pair, sorted by location and
+            distance, with the following columns:
+            - point (int): position of the location in lon/lat
+            - Station_ID: ID of the candidate
+            - pos (string): one of "On-Up", "On-Down", "Up" or "Down"
+            - dist (float): distance along the network in meters
+            - seg_apart (int): number of river segments separating the
+              segments of the location and candidate
+            - segments (list): index labels of the river segments from
+              the location to the candidate, in order
+            - dist_from_net (float): distance from the location to the
+              network
+            Locations farther than snap_distance from the network are
+            omitted.
+
+        :raises ValueError:
+            If direction is unknown, station_set is None with several
+            sets, or k or max_distance exceed those the query was built
+            with. Build the query with a larger k or max_distance to
+            request more candidates.
+
+        :raises KeyError:
+            If station_set is not one of the candidate sets.
+        """
+        if direction not in ('up', 'down', 'either'):
+            raise ValueError(f"Unknown direction '{direction}'.")
+        index = self._candidate_index(station_set)
+        k = self.k if k is None else k
+        max_distance = self.max_distance if max_distance is None else max_distance
+        index.check_limits(k, max_distance)
+
+        table = self.snap(lon, lat)
+
+        cands = index.candidates
+        cand_along = cands['dist_along'].to_numpy()
+        directions = {'up': [1], 'down': [0], 'either': [0, 1]}[direction]
+
+        # locations at junctions are snapped to every segment meeting
+        # there; their candidates are pooled
+        found = {}
+        dists_from = {}
+        for point, segment, along, dist_from in zip(table['point'], table['segment'],
+                                                    table['dist_along'], table['dist_from']):
+            edge, offset = self.locations[segment]
+            along = along + offset
+            dists_from[point] = dist_from
+            point_found = found.setdefault(point, [])
+
+            for cand in index.on_edge.get(edge, ()):
+                pos = 'On-' + ('Up' if along > cand_along[cand] else 'Down')
+                if direction != 'either' and pos != 'On-' + direction.title():
+                    continue
+                dist = abs(along - cand_along[cand])
+                if max_distance is None or dist < max_distance:
+                    point_found.append((dist, int(cand), pos, 0, [segment]))
+
+            for drc in directions:
+                for cand, dist, depth, edges in index.nearest(edge, along, drc, k=k,
+                                                              max_distance=max_distance):
+                    segments = self._path_segments(index, edge, segment, edges, drc)
+                    point_found.append((dist, cand, ('Down', 'Up')[drc], len(segments) - 2,
+                                        segments))
+
+        rows = []
+        for point in sorted(found):
+            seen = set()
+            for dist, cand, pos, depth, segments in sorted(found[point], key=lambda m: m[:2]):
+                if cand in seen:
+                    continue
+                seen.add(cand)
+                rows.append((point, cands['Station_ID'].iat[cand], pos, dist, depth,
+                             segments, dists_from[point]))
+                if len(seen) == k:
+                    break
+
+        return pd.DataFrame(rows, columns=['point', 'Station_ID', 'pos', 'dist', 'seg_apart',
+                                           'segments', 'dist_from_net'])
+
+    def _candidate_index(self, station_set):
+        if station_set is None:
+            if len(self.candidate_indexes) > 1:
+                raise ValueError("A station_set is required when querying several "
+                                 f"candidate sets ({', '.join(self.candidate_indexes)}).")
+            return next(iter(self.candidate_indexes.values()))
+        if station_set not in self.candidate_indexes:
+            raise KeyError(f"Unknown station set '{station_set}'.")
+        return self.candidate_indexes[station_set]
+
+    @staticmethod
+    def _path_segments(index, edge, segment, edges, direction):
+        """
+        Index labels of the river segments from the segment of a
+        location to a candidate, in the order they are traversed.
+        """
+        start = index.segments([edge])
+        start = start[start.index(segment):] if direction == 0 else start[start.index(segment)::-1]
+
+        path = []
+        for traversed in edges:
+            segments = index.segments([traversed])
+            path += segments if direction == 0 else segments[::-1]
+        return start + path
+
+
+def prune_network(network: nx.DiGraph, prefix1, prefix2, max_distance=5000,
+                  assignments=None) -> nx.DiGraph:
+    """
+    Extracts the part of a network that dfs_search() can reach from
+    origin stations, so matching does not traverse station-free
+    branches.
+
+    Keeps only the weakly connected components containing both origin
+    and candidate stations, and within them only the edges within
+    max_distance along the network of an edge holding an origin
+    station, downstream or upstream. Distances are measured from the
+    ends of origin edges, so every edge dfs_search() could traverse
+    is kept and searching the pruned network produces the same
+    matches as searching the full network.
+
+    :param network: NetworkX Directed Graph
+        The graph to prune. Edges must hold a 'LENGTH_M' attribute and
+        station data; see dfs_search().
+
+    :param prefix1: string
+        Prefix denoting origin station data.
+
+    :param prefix2: string
+        Prefix denoting candidate station data.
+
+    :param max_distance: int (default=5000)
+        Maximum distance in meters that will be searched from an origin
+        station. Should match the max_distance passed to dfs_search().
+
+    :param assignments: dict of {str: GeoDataFrame} or None (default)
+        Station assignment tables keyed by prefix; see dfs_search().
 
-def hyriv_gdf_to_network(hyriv_gdf: gpd.GeoDataFrame, plot=False, show=False) -> nx.DiGraph:
+    :return: NetworkX Directed Graph
+        A copy of the reachable part of network, of the same type.
+    """
+    if assignments is None:
+        assignments = {}
+
+    def has_stations(prefix):
+        if prefix in assignments:
+            labels = set(assignments[prefix]['edge_index'].tolist())
+            return lambda data: data.get('edge_index') in labels
+
+        def check(data):
+            st_data = data.get(prefix + '_data')
+            return isinstance(st_data, pd.DataFrame) and not st_data.empty
+        return check
+
+    has_origin = has_stations(prefix1)
+    has_cand = has_stations(prefix2)
+
+    component = {}
+    for ind, nodes in enumerate(nx.weakly_connected_components(network)):
+        component.update(dict.fromkeys(nodes, ind))
+
+    if network.is_multigraph():
+        edges = network.edges(keys=True, data=True)
+    else:
+        edges = network.edges(data=True)
+
+    origin_edges = []
+    origin_comps, cand_comps = set(), set()
+    for edge in edges:
+        data = edge[-1]
+        if has_origin(data):
+            origin_edges.append(edge[:-1])
+            origin_comps.add(component[edge[0]])
+        if has_cand(data):
+            cand_comps.add(component[edge[0]])
+
+    comps = origin_comps & cand_comps
+    origin_edges = [edge for edge in origin_edges if component[edge[0]] in comps]
+    sources = {node for edge in origin_edges for node in edge[:2]}
+
+    # distance from the closest origin edge going down and upstream
+    if sources:
+        down = nx.multi_source_dijkstra_path_length(
+            network, sources, cutoff=max_distance, weight='LENGTH_M')
+        up = nx.multi_source_dijkstra_path_length(
+            network.reverse(copy=False), sources, cutoff=max_distance, weight='LENGTH_M')
+    else:
+        down, up = {}, {}
+
+    keep = set(origin_edges)
+    if network.is_multigraph():
+        edges = network.edges(keys=True)
+    else:
+        edges = network.edges()
+    keep.update(edge for edge in edges if edge[0] in down or edge[1] in up)
+
+    return network.edge_subgraph(keep).copy()
+
+
+def hyriv_gdf_to_network(hyriv_gdf: gpd.GeoDataFrame, plot=False, show=False,
+                         method='auto', topology=None, contract=False,
+                         assignments=None) -> nx.DiGraph:
     """
     Creates a directed network from a hydroRIVER line GeoDataFrame.
 
@@ -890,11 +3093,54 @@ def hyriv_gdf_to_network(hyriv_gdf: gpd.GeoDataFrame, plot=False, show=False) ->
     :param show: bool (default=False)
         If True, display the plot. If False, do nothing.
 
+    :param method: string {'auto', 'topology', 'momepy'} (default='auto')
+        How to connect edges. 'topology' connects edges using the
+        HYRIV_ID and NEXT_DOWN fields (see hyriv_topology()); 'momepy'
+        connects edges whose end points share coordinates. 'auto' uses
+        'topology' if hyriv_gdf contains both fields and 'momepy'
+        otherwise (i.e. for non HydroRIVERS datasets such as OHN).
+
+    :param topology: dict or None (default)
+        A prebuilt hyriv_topology() of hyriv_gdf, such as the one
+        returned by network_snapshot(). If passed, method is ignored.
+
+    :param contract: bool (default=False)
+        If True, merge unbranched chains of edges without stations into
+        single edges (see contract_network()).
+
+    :param assignments: dict of {str: GeoDataFrame} or None (default)
+        Station assignment tables keyed by prefix, as passed to
+        dfs_search(). Only used when contract is True, to keep edges
+        holding stations.
+
     :return: networkX DiGraph
-        The resultant networkx directed graph.
+        The resultant networkx directed graph. Edges hold every field
+        of hyriv_gdf as attributes, as well as:
+            - 'edge_index': index label of the edge in hyriv_gdf; used
+              to look up stations in assignment tables
+            - 'LENGTH_M': edge length in meters, if not already present
     """
-    hyriv_gdf = hyriv_gdf.to_crs(crs=Can_LCC_wkt)
-    p_graph = momepy.gdf_to_nx(hyriv_gdf, approach='primal', directed=True)
+    hyriv_gdf = to_lcc(hyriv_gdf)
+    if 'edge_index' not in hyriv_gdf.columns:
+        hyriv_gdf = hyriv_gdf.assign(edge_index=hyriv_gdf.index)
+    if 'LENGTH_M' not in hyriv_gdf.columns:
+        hyriv_gdf = hyriv_gdf.assign(LENGTH_M=edge_length_m(hyriv_gdf))
+
+    if method == 'auto':
+        has_ids = {'HYRIV_ID', 'NEXT_DOWN'}.issubset(hyriv_gdf.columns)
+        method = 'topology' if has_ids else 'momepy'
+
+    if topology is not None:
+        p_graph = topology_to_network(topology, hyriv_gdf)
+    elif method == 'topology':
+        p_graph = topology_to_network(hyriv_topology(hyriv_gdf), hyriv_gdf)
+    elif method == 'momepy':
+        p_graph = momepy.gdf_to_nx(hyriv_gdf, approach='primal', directed=True)
+    else:
+        raise ValueError(f"Unknown network construction method '{method}'.")
+
+    if contract:
+        p_graph = contract_network(p_graph, assignments=assignments)
 
     if plot:
         # Plot
@@ -911,11 +3157,305 @@ def hyriv_gdf_to_network(hyriv_gdf: gpd.GeoDataFrame, plot=False, show=False) ->
     return p_graph
 
 
-def check_hyriv_network(digraph: nx.DiGraph) -> float:
+def hyriv_topology(hyriv_gdf: gpd.GeoDataFrame) -> dict:
+    """
+    Builds the directed topology of a HydroRIVERS line GeoDataFrame
+    from its HYRIV_ID and NEXT_DOWN fields, without matching end point
+    coordinates.
+
+    Every edge gets its own start (upstream) node. The end node of an
+    edge is the start node of its NEXT_DOWN edge or, if NEXT_DOWN is 0
+    or not in hyriv_gdf (i.e. cropped by a bounding box), a new node
+    at the last vertex of the edge.
+
+    :param hyriv_gdf: Geopandas GeoDataFrame
+        HydroRIVERS LineStrings with 'HYRIV_ID' and 'NEXT_DOWN' fields.
+        Node coordinates are in the CRS of hyriv_gdf.
+
+    :return: dict of {str: np.ndarray}
+        Arrays describing the network:
+            - 'u': start node of each edge (int)
+            - 'v': end node of each edge (int)
+            - 'down': position of the NEXT_DOWN edge of each edge in
+              hyriv_gdf, or -1 if it is not in hyriv_gdf
+            - 'nodes': (n_nodes, 2) array of node coordinates
+            - 'edge_index': index labels of the edges in hyriv_gdf
+
+    :raises ValueError:
+        If HYRIV_ID is not unique.
+    """
+    ids = pd.Index(hyriv_gdf['HYRIV_ID'])
+    if not ids.is_unique:
+        raise ValueError("HYRIV_ID values must be unique to build a topology.")
+
+    geoms = hyriv_gdf.geometry.values
+    down = ids.get_indexer(hyriv_gdf['NEXT_DOWN'])
+    outlets = np.flatnonzero(down == -1)
+
+    n = len(hyriv_gdf)
+    u = np.arange(n)
+    v = np.where(down == -1, 0, down)
+    v[outlets] = n + np.arange(len(outlets))
+
+    nodes = np.concatenate([line_endpoints(geoms)[0], line_endpoints(geoms[outlets])[1]])
+
+    return {'u': u, 'v': v, 'down': down, 'nodes': nodes,
+            'edge_index': np.asarray(hyriv_gdf.index)}
+
+
+def river_basins(hyriv_gdf: gpd.GeoDataFrame, method='auto') -> np.ndarray:
+    """
+    Labels each river segment with the drainage basin it belongs to.
+    Segments of different basins are never connected, so stations in
+    different basins can never be matched along the network and each
+    basin can be searched independently.
+
+    :param hyriv_gdf: Geopandas GeoDataFrame
+        The river LineStrings.
+
+    :param method: string {'auto', 'main_riv', 'topology', 'endpoints'} (default='auto')
+        How to find basins:
+            - 'main_riv': the HydroRIVERS MAIN_RIV field (ID of the
+              most downstream segment of the basin)
+            - 'topology': connected components of the HYRIV_ID and
+              NEXT_DOWN fields (see hyriv_topology())
+            - 'endpoints': connected components of segments sharing
+              end point coordinates, as connected by momepy (i.e. for
+              OHN)
+        'auto' uses the first method whose fields hyriv_gdf contains.
+
+    :return: np.ndarray
+        The basin label of each segment of hyriv_gdf. Labels are
+        MAIN_RIV values or component numbers.
+    """
+    if method == 'auto':
+        if 'MAIN_RIV' in hyriv_gdf.columns:
+            method = 'main_riv'
+        elif {'HYRIV_ID', 'NEXT_DOWN'}.issubset(hyriv_gdf.columns):
+            method = 'topology'
+        else:
+            method = 'endpoints'
+
+    if method == 'main_riv':
+        return hyriv_gdf['MAIN_RIV'].to_numpy()
+    elif method == 'topology':
+        topology = hyriv_topology(hyriv_gdf)
+        u, v, n_nodes = topology['u'], topology['v'], len(topology['nodes'])
+    elif method == 'endpoints':
+        starts, ends = line_endpoints(hyriv_gdf.geometry.values)
+        nodes, inverse = np.unique(np.concatenate([starts, ends]), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        u, v, n_nodes = inverse[:len(starts)], inverse[len(starts):], len(nodes)
+    else:
+        raise ValueError(f"Unknown basin method '{method}'.")
+
+    graph = coo_matrix((np.ones(len(u)), (u, v)), shape=(n_nodes, n_nodes))
+    _, labels = connected_components(graph, directed=True, connection='weak')
+    return labels[u]
+
+
+def topology_to_network(topology: dict, hyriv_gdf: gpd.GeoDataFrame) -> nx.MultiDiGraph:
+    """
+    Creates a networkx view of a topology produced by hyriv_topology().
+    The graph matches the structure produced by momepy.gdf_to_nx():
+    nodes are keyed by (x, y) coordinate tuples and hold 'x' and 'y'
+    attributes, and edges hold every field of hyriv_gdf.
+
+    :param topology: dict
+        Output of hyriv_topology(hyriv_gdf).
+
+    :param hyriv_gdf: Geopandas GeoDataFrame
+        The GeoDataFrame the topology was built from.
+
+    :return: networkX MultiDiGraph
+        The directed graph.
+    """
+    keys = list(map(tuple, topology['nodes'].tolist()))
+    records = pd.DataFrame(hyriv_gdf).to_dict('records')
+
+    graph = nx.MultiDiGraph(crs=hyriv_gdf.crs, approach='primal')
+    graph.add_edges_from(zip(map(keys.__getitem__, topology['u']),
+                             map(keys.__getitem__, topology['v']),
+                             records))
+    nx.set_node_attributes(graph, {key: {'x': key[0], 'y': key[1]} for key in graph.nodes})
+    return graph
+
+
+def contract_network(network: nx.MultiDiGraph, assignments=None) -> nx.MultiDiGraph:
+    """
+    Merges unbranched chains of edges without stations into single
+    edges, so traversals of the network scale with the number of
+    junctions and stations rather than the number of river segments.
+
+    A node is merged away if it has exactly 1 incoming and 1 outgoing
+    edge and neither edge holds stations, either in a '<prefix>_data'
+    attribute or in an assignment table. Merged edges hold the
+    attributes of the most downstream segment of the chain, except:
+        - 'geometry': the segment geometries joined in order
+        - 'LENGTH_M': the total length of the segments
+        - 'edge_index': None, as the edge is not in the original data
+    Every edge of the contracted network also holds:
+        - 'n_segments': the number of segments the edge was merged
+          from; counted as depth by dfs_search()
+        - 'segments': list of the 'edge_index' of those segments, from
+          upstream to downstream, to expand paths to the original
+          segments
+
+    Outgoing and incoming edges of each node keep their order, and
+    nodes keep theirs, so dfs_search() visits branches and origin
+    stations in the same order and returns the same matches in the
+    same order as on the original network. This holds unless
+    contraction creates parallel edges between the same 2 nodes
+    (i.e. braided channels in momepy built networks with
+    bifurcations): NetworkX lists parallel edges together, so the
+    original order cannot always be kept, and matches may then differ
+    in order or in which branch is found first.
+
+    :param network: NetworkX MultiDiGraph
+        The network to contract, such as produced by
+        hyriv_gdf_to_network(). Edges must hold 'geometry' and
+        'LENGTH_M' attributes.
+
+    :param assignments: dict of {str: GeoDataFrame} or None (default)
+        Station assignment tables keyed by prefix, as passed to
+        dfs_search().
+
+    :return: NetworkX MultiDiGraph
+        The contracted network.
+    """
+    labels = set()
+    for table in (assignments or {}).values():
+        labels.update(table['edge_index'].tolist())
+
+    def has_stations(data):
+        if data.get('edge_index') in labels:
+            return True
+        return any(isinstance(value, pd.DataFrame) and not value.empty
+                   for key, value in data.items() if key.endswith('_data'))
+
+    def pass_through(node):
+        if network.in_degree(node) != 1 or network.out_degree(node) != 1:
+            return False
+        (u, _, in_data), = network.in_edges(node, data=True)
+        (_, v, out_data), = network.out_edges(node, data=True)
+        return u != node and v != node and not (has_stations(in_data) or has_stations(out_data))
+
+    merged = {node for node in network.nodes if pass_through(node)}
+
+    # position of each edge in network.edges (the order of outgoing
+    # edges) and its rank among the incoming edges of its end node
+    out_rank = {edge: rank for rank, edge in enumerate(network.edges(keys=True))}
+    in_rank = {}
+    for node in network.nodes:
+        for rank, edge in enumerate(network.in_edges(node, keys=True)):
+            in_rank[edge] = rank
+
+    visited = set()
+
+    def follow(edge):
+        chain = [edge]
+        while chain[-1][1] in merged:
+            visited.add(chain[-1][1])
+            chain.append(next(iter(network.out_edges(chain[-1][1], keys=True, data=True))))
+        return chain
+
+    def chains():
+        for edge in network.edges(keys=True, data=True):
+            if edge[0] not in merged:
+                yield follow(edge)
+
+        # cycles made only of pass-through nodes are kept as a single
+        # edge starting and ending at one of their nodes
+        for node in list(merged - visited):
+            if node not in visited:
+                merged.discard(node)
+                yield follow(next(iter(network.out_edges(node, keys=True, data=True))))
+
+    edges = []
+    for chain in chains():
+        u = chain[0][0]
+        segments = [edge[3] for edge in chain]
+        attrs = dict(segments[-1])
+        attrs['n_segments'] = sum(seg.get('n_segments', 1) for seg in segments)
+        attrs['segments'] = [i for seg in segments for i in seg.get('segments', [seg.get('edge_index')])]
+        if len(chain) > 1:
+            coords = [shapely.get_coordinates(seg['geometry']) for seg in segments]
+            attrs['geometry'] = LineString(np.concatenate(coords))
+            attrs['LENGTH_M'] = sum(seg['LENGTH_M'] for seg in segments)
+            attrs['edge_index'] = None
+        edges.append((out_rank[chain[0][:3]], in_rank[chain[-1][:3]], u, chain[-1][1], attrs))
+
+    contracted = network.__class__(**network.graph)
+    contracted.add_nodes_from((node, data) for node, data in network.nodes(data=True)
+                              if node not in merged)
+    contracted.add_edges_from((edges[i][2], edges[i][3], edges[i][4])
+                              for i in _insertion_order(edges))
+    return contracted
+
+
+def _insertion_order(edges):
+    """
+    Orders the edges of contract_network() so that adding them to a
+    graph in that order gives the outgoing edges of each node the
+    order of their first segment, and the incoming edges of each node
+    the order of their last segment (a topological order of the 2
+    orders, preferring the order of first segments). Where the 2
+    orders conflict, the first remaining edge by first segment is
+    added next.
+
+    :param edges: list of tuple
+        (out rank, in rank, u, v, attrs) of each edge.
+
+    :return: list of int
+        Positions of the edges in insertion order.
+    """
+    # each edge follows the previous outgoing edge of its start node
+    # and the previous incoming edge of its end node
+    after = [[] for _ in edges]
+    n_before = [0] * len(edges)
+    for end, rank in [(2, 0), (3, 1)]:
+        groups = {}
+        for i, edge in enumerate(edges):
+            groups.setdefault(edge[end], []).append(i)
+        for group in groups.values():
+            group.sort(key=lambda i: edges[i][rank])
+            for prev, i in zip(group[:-1], group[1:]):
+                after[prev].append(i)
+                n_before[i] += 1
+
+    ready = [(edges[i][0], i) for i in range(len(edges)) if n_before[i] == 0]
+    heapq.heapify(ready)
+    remaining = sorted(range(len(edges)), key=lambda i: edges[i][0], reverse=True)
+    added = [False] * len(edges)
+    order = []
+    while len(order) < len(edges):
+        if ready:
+            i = heapq.heappop(ready)[1]
+        else:
+            # conflicting orders; add the first remaining outgoing edge
+            while added[remaining[-1]]:
+                remaining.pop()
+            i = remaining[-1]
+        if added[i]:
+            continue
+        added[i] = True
+        order.append(i)
+        for j in after[i]:
+            n_before[j] -= 1
+            if n_before[j] == 0 and not added[j]:
+                heapq.heappush(ready, (edges[j][0], j))
+    return order
+
+
+def check_hyriv_network(digraph: nx.DiGraph, return_table=False):
     """
     Checks a NetworkX DiGraph (directed graph) created from a
     HydroRIVERS shapefile for correct connectivity and directionality.
 
+    The downstream ID of every edge (NEXT_DOWN) is compared against the
+    IDs (HYRIV_ID) of the edges leaving its end node with a single
+    table join, rather than by querying the graph per edge.
+
     Note: Reliability not guaranteed. See assumption below.
 
     Assumptions: If there are no edges leading away from a node,
@@ -931,41 +3471,65 @@ def check_hyriv_network(digraph: nx.DiGraph) -> float:
             - 'NEXT_DOWN'
             - 'HYRIV_ID'
 
-    :return: float
+    :param return_table: bool (default=False)
+        If True, also returns per edge diagnostics.
+
+    :return: float or tuple of (float, DataFrame)
         A decimal value representing the percentage of edges with
-        correct connectivity. Between 0.0 and 1.0.
+        correct connectivity. Between 0.0 and 1.0. If return_table is
+        True, also returns a DataFrame with 1 row per edge (in the
+        order of digraph.edges) and the following columns:
+            - u, v (node keys)
+            - HYRIV_ID, NEXT_DOWN
+            - n_downstream (int): number of edges leaving v
+            - correct (bool): NEXT_DOWN is among the edges leaving v,
+              or no edges leave v (see assumptions)
+            - missing_downstream (bool): NEXT_DOWN is not 0 but no
+              edges leave v; counted as correct
+            - wrong_downstream (bool): edges leave v, but none of
+              them is NEXT_DOWN
+            - unexpected_downstream (bool): NEXT_DOWN is 0 (an outlet)
+              but edges leave v
+            - multiple_outlets (bool): more than 1 edge leaves v
     """
-    correct_edges, total_edges = 0, 0
-
-    # Obtain from the directed graph every single edge and the ID
-    # of the edge that lies directly downstream from it
-    for u, v, data in digraph.edges(data="NEXT_DOWN"):
-        total_edges += 1
-
-        out_edges = digraph.out_edges(nbunch=v, data='HYRIV_ID')
-
-        if data == 0 and len(out_edges) != 0:
-            # A 'NEXT_DOWN' value of 0 indicates there is no directly
-            # connected segment downstream. The presence of outgoing
-            # edges indicates incorrect connectivity.
-            break
-        elif len(out_edges) == 0:
-            # If there are no edges leading away from the node, the
-            # node is assumed to be at the edge of the selected BBox
-            # and connectivity assumed to be correct. This however may
-            # not always be the case.
-            correct_edges += 1
-
-        for out_edge in out_edges:
-            # check every edge leading away from v. If any of them
-            # match the ID of NEXT_DOWN, connectivity should be correct
-            if out_edge[2] == data:
-                correct_edges += 1
-                break
-
+    node_ids = {node: i for i, node in enumerate(digraph.nodes)}
+    u, v, hyriv_id, next_down = [], [], [], []
+    for u_key, v_key, data in digraph.edges(data=True):
+        u.append(u_key)
+        v.append(v_key)
+        hyriv_id.append(data['HYRIV_ID'])
+        next_down.append(data['NEXT_DOWN'])
+
+    u_ind = np.fromiter(map(node_ids.__getitem__, u), dtype=int, count=len(u))
+    v_ind = np.fromiter(map(node_ids.__getitem__, v), dtype=int, count=len(v))
+    hyriv_id, next_down = np.asarray(hyriv_id), np.asarray(next_down)
+
+    # join the (end node, NEXT_DOWN) of each edge against the
+    # (start node, HYRIV_ID) of every edge
+    n_downstream = np.bincount(u_ind, minlength=len(node_ids))[v_ind]
+    matched = pd.MultiIndex.from_arrays([v_ind, next_down]).isin(
+        pd.MultiIndex.from_arrays([u_ind, hyriv_id]))
+
+    outlet = next_down == 0
+    has_downstream = n_downstream > 0
+    unexpected = outlet & has_downstream
+    correct = (~has_downstream | matched) & ~unexpected
+
+    correct_edges, total_edges = int(correct.sum()), len(correct)
     ratio = correct_edges / total_edges
     print(f"{correct_edges}/{total_edges} ({ratio * 100}%) correct.")
-    return ratio
+
+    if not return_table:
+        return ratio
+
+    table = pd.DataFrame({'u': u, 'v': v, 'HYRIV_ID': hyriv_id, 'NEXT_DOWN': next_down,
+                          'n_downstream': n_downstream,
+                          'correct': correct,
+                          'missing_downstream': ~outlet & ~has_downstream,
+                          'wrong_downstream': ~outlet & has_downstream & ~matched,
+                          'unexpected_downstream': unexpected,
+                          'multiple_outlets': n_downstream > 1})
+    return ratio, table
 
 
 def straighten(lines):
@@ -975,14 +3539,13 @@ def straighten(lines):
 
     :param lines: GeoDataFrame
         The line features to straighten. Must contain only shapely
-        Line objects that contain 'boundary' and 'crs' attributes.
+        LineStrings.
 
     :return: GeoDataFrame
         The straightened lines.
     """
-    pairs = []
-    for line in lines.geometry:
-        pairs.append(LineString(line.boundary.geoms))
+    starts, ends = line_endpoints(lines.geometry.values)
+    pairs = shapely.linestrings(np.stack([starts, ends], axis=1))
     return gpd.GeoDataFrame(geometry=pairs, crs=lines.crs)
 
 
@@ -1001,3 +3564,335 @@ def __draw_network__(p_graph, ax=None, **kwargs):
         ax = plt.axes()
     positions = {n: [n[0], n[1]] for n in list(p_graph.nodes)}
     nx.draw(p_graph, pos=positions, ax=ax, node_size=3, **kwargs)
+
+
+# ========================================================================= ##
+# Network Snapshots ======================================================= ##
+# ========================================================================= ##
+
+# Increment when the snapshot layout or the assignment logic changes
+# to invalidate existing snapshots.
+snapshot_version = 1
+
+
+def network_snapshot(station_sets: dict, rivers_path=load_data.hydroRIVERS_path, bbox=None,
+                     max_distance=750, len_f='LENGTH_KM', len_unit='km',
+                     cache_dir=load_data.cache_path):
+    """
+    Loads rivers, assigns stations to them and builds the river
+    topology, or loads the result of doing so from a snapshot saved
+    by a previous call with the same inputs.
+
+    Snapshots are keyed by a fingerprint of the river dataset files,
+    bbox, the station sets and the assignment parameters, so a
+    snapshot is rebuilt whenever any of them change. Station sets that
+    change between runs (i.e. the origin stations of
+    6_find_streamflow_gauge.py) should be assigned separately with
+    assign_stations(as_table=True) against the returned edges.
+
+    i.e.
+    >>> lines, tables, topology = network_snapshot({'hydat': hydat})
+    >>> tables['origin'] = assign_stations(lines, origin, as_table=True)
+    >>> network = hyriv_gdf_to_network(lines, topology=topology)
+    >>> matches = dfs_search(network, 'origin', 'hydat', assignments=tables)
+
+    :param station_sets: dict of {str: GeoDataFrame}
+        Station sets keyed by prefix; see assign_stations_many().
+
+    :param rivers_path: string (default=load_data.hydroRIVERS_path)
+        The file path to load the river dataset from.
+
+    :param bbox: BBox or None (default)
+        BBox to load rivers within; see load_data.load_rivers().
+
+    :param max_distance: int (default=750)
+        See assign_stations().
+
+    :param len_f: string (default='LENGTH_KM')
+        See assign_stations().
+
+    :param len_unit: string {'km', 'm'} (default='km')
+        See assign_stations().
+
+    :param cache_dir: string (default=load_data.cache_path)
+        Directory to store snapshots in.
+
+    :return: tuple of (GeoDataFrame, dict, dict or None)
+        The rivers in Can_LCC_wkt (with 'edge_index' and 'LENGTH_M'
+        fields), the assignment tables keyed by prefix, and the
+        hyriv_topology() of the rivers (None if the rivers lack
+        HYRIV_ID or NEXT_DOWN fields). If the rivers cannot be saved
+        to a snapshot (see save_network_snapshot()), prints a warning
+        and returns them without saving a snapshot.
+    """
+    key = snapshot_key(file_fingerprint(rivers_path), bbox,
+                       {prefix: stations_fingerprint(stations)
+                        for prefix, stations in station_sets.items()},
+                       max_distance=max_distance, len_f=len_f, len_unit=len_unit)
+    path = os.path.join(cache_dir, key)
+
+    snapshot = load_network_snapshot(path, key=key)
+    if snapshot is not None:
+        print(f"Loaded network snapshot from '{path}'")
+        return snapshot
+
+    edges = to_lcc(load_data.load_rivers(path=rivers_path, bbox=bbox))
+    index = SegmentIndex(edges, len_f=len_f, len_unit=len_unit)
+    tables = assign_stations_many(index, station_sets, max_distance=max_distance,
+                                  as_table=True)
+    edges = edges.assign(edge_index=edges.index, LENGTH_M=_index_length_m(index))
+
+    topology = None
+    if {'HYRIV_ID', 'NEXT_DOWN'}.issubset(edges.columns):
+        topology = hyriv_topology(edges)
+
+    try:
+        save_network_snapshot(path, edges, tables, topology=topology, key=key)
+        print(f"Saved network snapshot to '{path}'")
+    except ValueError as e:
+        print(f"Warning: Network snapshot was not saved. {e}")
+    return edges, tables, topology
+
+
+def save_network_snapshot(path, edges: gpd.GeoDataFrame, tables: dict, topology=None, key=""):
+    """
+    Saves edges, station assignment tables and a topology to a
+    directory of .npy files and a meta.json file. Edge geometry is
+    stored as coordinate arrays so it can be memory mapped on load.
+
+    :param path: string
+        The directory to save the snapshot to. Replaced if it exists.
+
+    :param edges: Geopandas GeoDataFrame
+        LineString edges in Can_LCC_wkt. Object fields must contain
+        only strings and missing values (None or NaN), which are
+        loaded as missing values.
+
+    :param tables: dict of {str: GeoDataFrame}
+        Assignment tables keyed by prefix; see assign_stations().
+
+    :param topology: dict or None (default)
+        Output of hyriv_topology(edges).
+
+    :param key: string (default="")
+        The key to save the snapshot under; see snapshot_key().
+
+    :raises ValueError:
+        If edges contains geometries aside from LineStrings, or an
+        object field containing values aside from strings and missing
+        values. Raised before anything is written.
+    """
+    if not check_geom(edges, 'LineString'):
+        raise ValueError("Edge GeoDataFrame expected to only contain LineStrings.")
+
+    arrays = {'index': _storable(edges.index, 'index')}
+    columns = [col for col in edges.columns if col != edges.geometry.name]
+    masked = []
+    for i, col in enumerate(columns):
+        arrays[f'col_{i}'], mask = _storable_field(edges[col], col)
+        if mask is not None:
+            arrays[f'col_{i}_mask'] = mask
+            masked.append(i)
+
+    geoms = edges.geometry.values
+    arrays['coords'] = shapely.get_coordinates(geoms)
+    arrays['num_coords'] = shapely.get_num_coordinates(geoms)
+
+    for prefix, table in tables.items():
+        arrays[f'{prefix}_Station_ID'] = _storable(table['Station_ID'], 'Station_ID')
+        arrays[f'{prefix}_edge_index'] = _storable(table['edge_index'], 'edge_index')
+        for col in ['dist_along', 'dist_from']:
+            arrays[f'{prefix}_{col}'] = table[col].to_numpy(dtype=float)
+        arrays[f'{prefix}_xy'] = shapely.get_coordinates(table.geometry.values)
+
+    if topology is not None:
+        for name in ['u', 'v', 'down', 'nodes']:
+            arrays[f'topology_{name}'] = topology[name]
+
+    meta = {'key': key, 'version': snapshot_version, 'crs': Can_LCC_crs.to_wkt(),
+            'columns': columns, 'masked': masked, 'prefixes': list(tables),
+            'topology': topology is not None}
+
+    # write to a temporary directory first so an interrupted save
+    # never leaves behind a partial snapshot
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, f'{name}.npy'), array, allow_pickle=False)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+
+
+def load_network_snapshot(path, key=None, mmap=True):
+    """
+    Loads a snapshot saved with save_network_snapshot().
+
+    :param path: string
+        The snapshot directory.
+
+    :param key: string or None (default)
+        If provided, the snapshot is only loaded if it was saved
+        under the same key.
+
+    :param mmap: bool (default=True)
+        If True, arrays are memory mapped rather than read into
+        memory.
+
+    :return: tuple of (GeoDataFrame, dict, dict or None) or None
+        Edges, assignment tables and topology (see network_snapshot()),
+        or None if the snapshot does not exist, was saved under a
+        different key or by a different snapshot version.
+    """
+    meta_path = os.path.join(path, 'meta.json')
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta['version'] != snapshot_version or (key is not None and meta['key'] != key):
+        return None
+
+    mmap_mode = 'r' if mmap else None
+
+    def load(name):
+        return np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+    num_coords = load('num_coords')
+    geometry = shapely.linestrings(load('coords'),
+                                   indices=np.repeat(np.arange(len(num_coords)), num_coords))
+    index = pd.Index(load('index'))
+    data = {col: load(f'col_{i}') for i, col in enumerate(meta['columns'])}
+    for i in meta.get('masked', []):
+        col = meta['columns'][i]
+        data[col] = np.where(load(f'col_{i}_mask'), None, data[col].astype(object))
+    edges = gpd.GeoDataFrame(data, index=index, geometry=geometry, crs=Can_LCC_crs)
+
+    tables = {}
+    for prefix in meta['prefixes']:
+        xy = load(f'{prefix}_xy')
+        tables[prefix] = gpd.GeoDataFrame(
+            {'Station_ID': load(f'{prefix}_Station_ID'),
+             'edge_index': load(f'{prefix}_edge_index'),
+             'dist_along': load(f'{prefix}_dist_along'),
+             'dist_from': load(f'{prefix}_dist_from')},
+            geometry=shapely.points(xy), crs=Can_LCC_crs)
+
+    topology = None
+    if meta['topology']:
+        topology = {name: load(f'topology_{name}') for name in ['u', 'v', 'down', 'nodes']}
+        topology['edge_index'] = np.asarray(index)
+
+    return edges, tables, topology
+
+
+def file_fingerprint(path) -> str:
+    """
+    Fingerprints a data file by the name, size and modification time
+    of the file and of any sidecar files sharing its name (i.e. the
+    .dbf and .shx files of a shapefile).
+
+    :param path: string
+        The file path.
+
+    :return: string
+        Hexadecimal fingerprint.
+    """
+    stem = os.path.splitext(path)[0]
+    files = sorted(glob.glob(glob.escape(stem) + '.*')) or [path]
+
+    digest = hashlib.sha1()
+    for file in files:
+        stat = os.stat(file)
+        digest.update(f'{os.path.basename(file)}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()
+
+
+def stations_fingerprint(stations: gpd.GeoDataFrame) -> str:
+    """
+    Fingerprints a set of stations by their IDs and locations.
+
+    :param stations: Geopandas GeoDataFrame
+        Station points with a 'Station_ID' field.
+
+    :return: string
+        Hexadecimal fingerprint.
+    """
+    stations = to_lcc(stations)
+    frame = pd.DataFrame({'Station_ID': stations['Station_ID'].astype(str).to_numpy(),
+                          'x': stations.geometry.x.to_numpy(),
+                          'y': stations.geometry.y.to_numpy()})
+    hashed = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    return hashlib.sha1(hashed.tobytes()).hexdigest()
+
+
+def snapshot_key(rivers_fingerprint, bbox, station_fingerprints: dict, **params) -> str:
+    """
+    Combines the fingerprints of the inputs of network_snapshot() into
+    a single key.
+
+    :param rivers_fingerprint: string
+        See file_fingerprint().
+
+    :param bbox: BBox or None
+        The bounding box rivers were loaded within.
+
+    :param station_fingerprints: dict of {str: str}
+        See stations_fingerprint(); keyed by prefix.
+
+    :param params:
+        Any other parameters that affect the snapshot.
+
+    :return: string
+        Hexadecimal key.
+    """
+    bounds = None if bbox is None else list(BBox.to_tuple(bbox))
+    contents = json.dumps({'rivers': rivers_fingerprint, 'bbox': bounds,
+                           'stations': station_fingerprints, 'params': params,
+                           'version': snapshot_version}, sort_keys=True, default=str)
+    return hashlib.sha1(contents.encode()).hexdigest()[:16]
+
+
+def _storable(values, name) -> np.ndarray:
+    """
+    Converts a Series or Index to an array that can be saved without
+    pickling. Object arrays of strings are converted to unicode
+    arrays.
+
+    :raises ValueError:
+        If values is an object array containing values aside from
+        strings.
+    """
+    array = np.asarray(values)
+    if array.dtype == object:
+        if not all(type(value) is str for value in array):
+            raise ValueError(f"Field '{name}' cannot be saved to a snapshot; object fields "
+                             "must contain only strings.")
+        array = array.astype(str)
+    return array
+
+
+def _storable_field(values, name) -> tuple:
+    """
+    Converts an edge field to an array that can be saved without
+    pickling (see _storable()). Object fields holding strings and
+    missing values (None or NaN), common in OHN and custom river
+    layers, are converted to unicode arrays with missing values
+    stored as "" and flagged in a mask.
+
+    :return: tuple of (np.ndarray, np.ndarray or None)
+        The array and the mask of missing values (None if no values
+        are missing).
+
+    :raises ValueError:
+        If values is an object array containing values aside from
+        strings and missing values.
+    """
+    array = np.asarray(values)
+    if array.dtype == object:
+        missing = pd.isna(array)
+        if missing.any() and all(type(value) is str for value in array[~missing]):
+            return np.where(missing, '', array).astype(str), missing
+    return _storable(values, name), None
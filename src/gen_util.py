@@ -1,6 +1,10 @@
 import cartopy.crs as ccrs
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import pyproj
+import zlib
+from functools import lru_cache
 from datetime import datetime
 from datetime import timedelta
 from datetime import date
@@ -74,6 +78,10 @@ Can_LCC_wkt = ('PROJCS["Canada_Lambert_Conformal_Conic",'
                     'AXIS["Northing",NORTH],'
                     'AUTHORITY["ESRI","102002"]]')
 
+# Parsed form of Can_LCC_wkt. Comparing against and converting to
+# this object avoids parsing the WKT string on every comparison.
+Can_LCC_crs = pyproj.CRS.from_wkt(Can_LCC_wkt)
+
 # Coordinate Reference System Constants
 geodetic = ccrs.Geodetic()
 lambert = ccrs.LambertConformal(central_longitude=central_lon,
@@ -136,6 +144,38 @@ def find_xy_fields(fields) -> [str, str]:
     return x, y
 
 
+@lru_cache(maxsize=None)
+def lcc_transformer(crs=4326) -> pyproj.Transformer:
+    """
+    Returns a pyproj Transformer from crs to Can_LCC_wkt (x/y or
+    lon/lat axis order). Transformers are cached per crs, so repeated
+    conversions do not pay for building a new transformer.
+
+    :param crs: value (default=4326)
+        The source CRS. Can be anything hashable accepted by
+        pyproj.CRS.from_user_input().
+
+    :return: pyproj Transformer
+    """
+    return pyproj.Transformer.from_crs(crs, Can_LCC_crs, always_xy=True)
+
+
+def to_lcc(data):
+    """
+    Projects a GeoDataFrame or GeoSeries to Can_LCC_wkt, if it is not
+    already in that CRS.
+
+    :param data: GeoPandas GeoDataFrame or GeoSeries
+        The data to project. Must have a set CRS.
+
+    :return: GeoPandas GeoDataFrame or GeoSeries
+        data, or a projected copy of data.
+    """
+    if data.crs is Can_LCC_crs or data.crs == Can_LCC_crs:
+        return data
+    return data.to_crs(crs=Can_LCC_crs)
+
+
 def check_geom(data, type_str):
     """
     Checks if all geometry in data is of type type_str using
@@ -301,6 +341,138 @@ def period_overlap(ps1, ps2):
     else:
         print("periods not in same format. No calculation performed.")
 
+def day_numbers(dates) -> np.ndarray:
+    """
+    Converts dates to integer day numbers (days since 1970-01-01).
+
+    :param dates: list-like of str, date, or datetime64
+        The dates to convert. Strings must be in "YYYY-MM-DD" format.
+
+    :return: np.ndarray of int
+        The day number of each date.
+
+    tests:
+    >>> assert list(day_numbers(["1970-01-01", "1970-01-02", "1969-12-31"])) == [0, 1, -1]
+    """
+    return pd.to_datetime(pd.Series(dates)).to_numpy().astype('datetime64[D]').astype(np.int64)
+
+
+def period_overlap_pairs(ids1, ps1: pd.DataFrame, ids2, ps2: pd.DataFrame) -> np.ndarray:
+    """
+    Vectorized equivalent of period_overlap() for many pairs of
+    stations at once. For each i, calculates the number of days that
+    overlap between the periods of station ids1[i] in ps1 and the
+    periods of station ids2[i] in ps2.
+
+    Dates are converted to day numbers once. The periods of each set
+    are sorted by (station, day) into a single array, so the periods
+    of any station can be searched with np.searchsorted using
+    (station, day) keys. For a station with periods A_k, the number of
+    days of A that fall on or before day t is
+
+        sum(t - s_k + 1 for s_k <= t) - sum(t - e_k for e_k < t)
+
+    which is evaluated from prefix sums of the sorted starts (s_k) and
+    ends (e_k). The overlap of every period (g, f) of the other
+    station with A is then the number of days of A on or before f
+    minus the number on or before g - 1.
+
+    Equal to period_overlap() for period sets without overlapping
+    periods; if a period set has overlapping dates, overlapping days
+    are counted once per period.
+
+    :param ids1: list-like
+        Station IDs to look up in ps1.
+
+    :param ps1: DataFrame
+        The first set of periods. Must contain 'Station_ID', 'P_Start'
+        and 'P_End' columns.
+
+    :param ids2: list-like
+        Station IDs to look up in ps2. Must be the same length as ids1.
+
+    :param ps2: DataFrame
+        The other set of periods; see ps1.
+
+    :return: np.ndarray of int
+        The total number of days of overlap of each pair. Stations with
+        no periods have no overlap.
+
+    tests:
+    >>> ps1 = pd.DataFrame({'Station_ID': ['A', 'A'], 'P_Start': ["2002-02-12", "2006-04-12"],
+    ...                     'P_End': ["2005-10-12", "2008-10-12"]})
+    >>> ps2 = pd.DataFrame({'Station_ID': ['B'], 'P_Start': ["2005-10-10"], 'P_End': ["2006-04-20"]})
+    >>> assert list(period_overlap_pairs(['A', 'A', 'C'], ps1, ['B', 'C', 'B'], ps2)) == [12, 0, 0]
+    """
+    ids1, ids2 = np.asarray(ids1), np.asarray(ids2)
+    starts1, ends1 = day_numbers(ps1['P_Start']), day_numbers(ps1['P_End'])
+    starts2, ends2 = day_numbers(ps2['P_Start']), day_numbers(ps2['P_End'])
+    if len(ids1) == 0 or len(starts1) == 0 or len(starts2) == 0:
+        return np.zeros(len(ids1), dtype=np.int64)
+
+    # composite (station, day) keys; days are shifted so that the day
+    # before the earliest start is still within the station's key range
+    first = min(starts1.min(), starts2.min()) - 1
+    span = max(ends1.max(), ends2.max()) - first + 1
+
+    stations1 = pd.Index(pd.unique(ps1['Station_ID']))
+    codes1 = stations1.get_indexer(ps1['Station_ID'])
+    start_keys = np.sort(codes1 * span + (starts1 - first))
+    end_keys = np.sort(codes1 * span + (ends1 - first))
+    start_sums = np.concatenate([[0], np.cumsum(start_keys % span)])
+    end_sums = np.concatenate([[0], np.cumsum(end_keys % span)])
+
+    def days_before(code, day):
+        # number of days of the periods of station code on or before day
+        base = code * span
+        t = day - first
+        lo_s = np.searchsorted(start_keys, base)
+        hi_s = np.searchsorted(start_keys, base + t, side='right')
+        lo_e = np.searchsorted(end_keys, base)
+        hi_e = np.searchsorted(end_keys, base + t)
+        started = (hi_s - lo_s) * (t + 1) - (start_sums[hi_s] - start_sums[lo_s])
+        ended = (hi_e - lo_e) * t - (end_sums[hi_e] - end_sums[lo_e])
+        return started - ended
+
+    # expand each pair into 1 row per period of its second station
+    stations2 = pd.Index(pd.unique(ps2['Station_ID']))
+    codes2 = stations2.get_indexer(ps2['Station_ID'])
+    order2 = np.argsort(codes2, kind='stable')
+    sorted_codes2 = codes2[order2]
+
+    pair_codes2 = stations2.get_indexer(ids2)
+    lo2 = np.searchsorted(sorted_codes2, pair_codes2, side='left')
+    counts = np.searchsorted(sorted_codes2, pair_codes2, side='right') - lo2
+    counts[pair_codes2 < 0] = 0
+
+    pair = np.repeat(np.arange(len(ids2)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(counts.cumsum() - counts, counts)
+    rows = order2[np.repeat(lo2, counts) + offset]
+
+    code = stations1.get_indexer(ids1)[pair]
+    valid = code >= 0
+    pair, rows, code = pair[valid], rows[valid], code[valid]
+
+    overlap = days_before(code, ends2[rows]) - days_before(code, starts2[rows] - 1)
+    return np.bincount(pair, weights=overlap, minlength=len(ids1)).astype(np.int64)
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    """
+    Counts the set bits of every element of an array of 64 bit words.
+    Uses np.bitwise_count where available (NumPy >= 2.0) and a SWAR
+    bit count otherwise.
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+
+    words = words - ((words >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    words = (words & np.uint64(0x3333333333333333)) + \
+            ((words >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    words = (words + (words >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (words * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
 # ========================================================================= ##
 # Classes ================================================================= ##
 # ========================================================================= ##
@@ -886,6 +1058,250 @@ class Period:
         return n == 0
 
 
+class AvailabilityIndex:
+    """
+    Class that stores the days on which data is available for a set of
+    stations as 1 packed daily bitmap per station. Every bitmap covers
+    the same range of days, starting at first_day, so the number of
+    days where data is available for 2 stations is a bitwise AND of
+    their bitmaps followed by a popcount.
+
+    Availability indexes are built from data ranges (see
+    Period.generate_data_range()) and can be saved to and loaded from
+    .npz files or a table of a sqlite3 database, where each bitmap is
+    stored as an (optionally zlib compressed) BLOB.
+
+    examples:
+        1: index = AvailabilityIndex.from_data_range(load_data.get_hydat_data_range())
+           index.overlap(['02HA006', '02HA007'], ['02HB001', '02HB004'])
+        2: index = load_data.get_hydat_availability()
+           index.days(['02HA006'], period=("2000-01-01", "2009-12-31"))
+    """
+    # Number of pairs or stations to process at once; bounds memory use
+    _chunk_size = 4096
+
+    def __init__(self, ids, bitmaps, first_day):
+        """
+        :param ids: list-like
+            Station IDs. Must be unique.
+
+        :param bitmaps: np.ndarray of uint8
+            (len(ids), n_bytes) array of packed daily bitmaps (see
+            np.packbits), 1 row per station. Rows are padded with
+            zeros to a multiple of 8 bytes so they can be processed
+            as 64 bit words.
+
+        :param first_day: int
+            The day number (see day_numbers()) of the first bit.
+        """
+        self.ids = pd.Index(ids)
+        bitmaps = np.asarray(bitmaps, dtype=np.uint8)
+        bitmaps = bitmaps.reshape(len(self.ids), -1) if len(self.ids) else bitmaps.reshape(0, 0)
+        pad = -bitmaps.shape[1] % 8
+        self.bitmaps = np.ascontiguousarray(np.pad(bitmaps, ((0, 0), (0, pad))))
+        self.first_day = int(first_day)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def from_data_range(drange: pd.DataFrame):
+        """
+        Builds an availability index from data ranges.
+
+        :param drange: DataFrame
+            Station data ranges. Must contain "Station_ID", "P_Start"
+            and "P_End" fields.
+
+        :return: AvailabilityIndex
+        """
+        ids = pd.Index(pd.unique(drange['Station_ID']))
+        if len(drange) == 0:
+            return AvailabilityIndex(ids, np.zeros((0, 0), dtype=np.uint8), 0)
+
+        rows = ids.get_indexer(drange['Station_ID'])
+        starts, ends = day_numbers(drange['P_Start']), day_numbers(drange['P_End'])
+        first_day = starts.min()
+        n_days = ends.max() - first_day + 1
+        bitmaps = np.zeros((len(ids), (n_days + 7) // 8), dtype=np.uint8)
+
+        # mark the start and day after the end of every period, then
+        # accumulate to get the days covered by each station
+        chunk = max(1, 2 ** 24 // (n_days + 1))
+        for lo in range(0, len(ids), chunk):
+            hi = min(lo + chunk, len(ids))
+            sel = (rows >= lo) & (rows < hi)
+            marks = np.zeros((hi - lo, n_days + 1), dtype=np.int16)
+            np.add.at(marks, (rows[sel] - lo, starts[sel] - first_day), 1)
+            np.add.at(marks, (rows[sel] - lo, ends[sel] - first_day + 1), -1)
+            covered = np.cumsum(marks, axis=1)[:, :n_days] > 0
+            bitmaps[lo:hi] = np.packbits(covered, axis=1)
+
+        return AvailabilityIndex(ids, bitmaps, first_day)
+
+    def overlap(self, ids1, ids2, period=None) -> np.ndarray:
+        """
+        Calculates the number of days on which data is available for
+        both stations of each pair.
+
+        :param ids1: list-like
+            Station IDs of the first station of each pair.
+
+        :param ids2: list-like
+            Station IDs of the second station of each pair. Must be
+            the same length as ids1.
+
+        :param period: Period, list-like of length 2, or None (default)
+            If provided, only counts days within the period. Start and
+            end dates may be strings in "YYYY-MM-DD" format or None.
+
+        :return: np.ndarray of int
+            The number of days of overlap of each pair; 0 for stations
+            not in the index.
+        """
+        rows1, rows2 = self.ids.get_indexer(ids1), self.ids.get_indexer(ids2)
+        mask = self._period_mask(period)
+        result = np.zeros(len(rows1), dtype=np.int64)
+        if len(self.ids) == 0:
+            return result
+
+        words = self.bitmaps.view(np.uint64)
+        for lo in range(0, len(rows1), self._chunk_size):
+            r1, r2 = rows1[lo:lo + self._chunk_size], rows2[lo:lo + self._chunk_size]
+            both = words[r1]
+            both &= words[r2]
+            if mask is not None:
+                both &= mask
+            counts = _popcount(both).sum(axis=1, dtype=np.int64)
+            result[lo:lo + self._chunk_size] = np.where((r1 >= 0) & (r2 >= 0), counts, 0)
+
+        return result
+
+    def days(self, ids=None, period=None) -> np.ndarray:
+        """
+        Calculates the number of days on which data is available for
+        each station.
+
+        :param ids: list-like or None (default)
+            Station IDs. If None, uses every station in the index.
+
+        :param period: Period, list-like of length 2, or None (default)
+            If provided, only counts days within the period.
+
+        :return: np.ndarray of int
+            The number of days of each station; 0 for stations not in
+            the index.
+        """
+        rows = np.arange(len(self.ids)) if ids is None else self.ids.get_indexer(ids)
+        mask = self._period_mask(period)
+        result = np.zeros(len(rows), dtype=np.int64)
+        if len(self.ids) == 0:
+            return result
+
+        words = self.bitmaps.view(np.uint64)
+        for lo in range(0, len(rows), self._chunk_size):
+            r = rows[lo:lo + self._chunk_size]
+            bits = words[r] if mask is None else words[r] & mask
+            result[lo:lo + self._chunk_size] = np.where(
+                r >= 0, _popcount(bits).sum(axis=1, dtype=np.int64), 0)
+
+        return result
+
+    def _period_mask(self, period):
+        """
+        Packed bitmap (as 64 bit words) of the days within period, or
+        None if period is None.
+        """
+        if period is None:
+            return None
+        start, end = (period.start, period.end) if type(period) is Period else period
+
+        days = self.first_day + np.arange(self.bitmaps.shape[1] * 8)
+        inside = np.ones(len(days), dtype=bool)
+        if start is not None:
+            inside &= days >= day_numbers([start])[0]
+        if end is not None:
+            inside &= days <= day_numbers([end])[0]
+        return np.packbits(inside).view(np.uint64)
+
+    def save(self, path, compress=False):
+        """
+        Saves the index to a .npz file.
+
+        :param path: string
+            The file path to save to.
+
+        :param compress: bool (default=False)
+            If True, compresses the file.
+        """
+        save = np.savez_compressed if compress else np.savez
+        save(path, ids=np.asarray(self.ids.astype(str), dtype=str), bitmaps=self.bitmaps,
+             first_day=self.first_day)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads an index saved with AvailabilityIndex.save().
+
+        :param path: string
+            The .npz file path to load from.
+
+        :return: AvailabilityIndex
+        """
+        with np.load(path) as data:
+            return AvailabilityIndex(data['ids'], data['bitmaps'], data['first_day'])
+
+    def to_sql(self, conn, table='Availability', compress=True):
+        """
+        Writes the index to a sqlite3 table with 1 row per station
+        and the following fields. Replaces the table if it exists.
+            - Station_ID
+            - First_Day (day number of the first bit)
+            - Num_Days (number of days with data)
+            - Compressed (1 if Bitmap is zlib compressed)
+            - Bitmap (BLOB)
+
+        :param conn: sqlite3 Connection
+            Connection to the database to write to.
+
+        :param table: string (default='Availability')
+            Name of the table.
+
+        :param compress: bool (default=True)
+            If True, compresses each bitmap with zlib.
+        """
+        blobs = [row.tobytes() for row in self.bitmaps]
+        if compress:
+            blobs = [zlib.compress(blob) for blob in blobs]
+
+        pd.DataFrame({'Station_ID': self.ids, 'First_Day': self.first_day,
+                      'Num_Days': self.days(), 'Compressed': int(compress),
+                      'Bitmap': blobs}).to_sql(table, conn, index=False, if_exists='replace')
+
+    @staticmethod
+    def from_sql(conn, table='Availability'):
+        """
+        Reads an index written with AvailabilityIndex.to_sql().
+
+        :param conn: sqlite3 Connection
+            Connection to the database to read from.
+
+        :param table: string (default='Availability')
+            Name of the table.
+
+        :return: AvailabilityIndex
+        """
+        data = pd.read_sql_query(f'SELECT Station_ID, First_Day, Compressed, Bitmap FROM {table}',
+                                 conn)
+        if len(data) == 0:
+            return AvailabilityIndex([], np.zeros((0, 0), dtype=np.uint8), 0)
+
+        blobs = [zlib.decompress(blob) if compressed else blob
+                 for blob, compressed in zip(data['Bitmap'], data['Compressed'])]
+        bitmaps = np.frombuffer(b"".join(blobs), dtype=np.uint8).reshape(len(data), -1)
+        return AvailabilityIndex(data['Station_ID'], bitmaps, data['First_Day'].iloc[0])
+
+
 class Timer:
     """
     Just for timing operations to compare temporal efficiency.
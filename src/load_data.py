@@ -1,7 +1,7 @@
 import os.path
 import sqlite3
 import check_files
-from gen_util import find_xy_fields, BBox, Period
+from gen_util import find_xy_fields, BBox, Period, AvailabilityIndex
 
 import pandas as pd
 from geopandas import read_file
@@ -59,6 +59,11 @@ monday_path = os.path.join(data_path, "MondayFileGallery")
 datastream_path = os.path.join(data_path, "datastream")
 hydroRIVERS_path = os.path.join(data_path, os.path.join("Hydro_RIVERS_v10", "HydroRIVERS_v10_na.shp"))
 
+# Path to store cached intermediate results in. Created when needed.
+cache_path = os.path.join(data_path, "cache")
+# GeoPackage storing delineated watersheds; see gdf_utils.WatershedStore
+watershed_path = os.path.join(cache_path, "watersheds.gpkg")
+
 
 # Before loading anything, check that the data paths exist
 check_files.check_paths(proj_path, data_path, hydat_path, pwqmn_path, monday_path,
@@ -388,6 +393,8 @@ def pwqmn_create_data_range(interest_var_query=interest_var_query):
       
     out_data = Period.generate_data_range(pwqmn_data)
     out_data.to_sql('Data_Range', conn, index=False, if_exists='replace')
+    # the availability index is built from Data_Range; see get_pwqmn_availability()
+    conn.execute('DROP TABLE IF EXISTS Availability')
     
     conn.close()
     return out_data
@@ -567,6 +574,23 @@ def get_pwqmn_data_range(to_csv=False, **q_kwargs):
     return get_pwqmn_data('Data_Range', to_csv=to_csv, **q_kwargs)
 
 
+def get_pwqmn_availability(rebuild=False) -> AvailabilityIndex:
+    """
+    Retrieves the daily data availability of every PWQMN station as
+    an AvailabilityIndex. The index is built from the Data_Range table
+    the first time it is requested and stored in the 'Availability'
+    table of the PWQMN database.
+
+    :param rebuild: bool (default=False)
+        If True, rebuilds the index even if it is already stored.
+
+    :return: AvailabilityIndex
+
+    :modifies: database @ pwqmn_sql_path.
+    """
+    return _availability(pwqmn_sql_path, get_pwqmn_data_range, rebuild)
+
+
 # ========================================================================= ##
 # DataStream ============================================================= ##
 # ========================================================================= ##
@@ -777,6 +801,42 @@ def get_hydat_data_range(to_csv=False, **q_kwargs) -> pd.DataFrame:
     return get_hydat_data('Data_Range', to_csv=to_csv, **q_kwargs)
 
 
+def get_hydat_availability(rebuild=False) -> AvailabilityIndex:
+    """
+    Retrieves the daily streamflow availability of every HYDAT station
+    as an AvailabilityIndex. The index is built from the Data_Range
+    table the first time it is requested and stored in the
+    'Availability' table of the HYDAT database.
+
+    :param rebuild: bool (default=False)
+        If True, rebuilds the index even if it is already stored.
+
+    :return: AvailabilityIndex
+
+    :modifies: database @ hydat_path.
+    """
+    return _availability(hydat_path, get_hydat_data_range, rebuild)
+
+
+def _availability(db_path, get_data_range, rebuild) -> AvailabilityIndex:
+    """
+    Loads the AvailabilityIndex stored in a database, building and
+    storing it from the database's data ranges if it is missing.
+    """
+    conn = sqlite3.connect(db_path)
+    curs = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='Availability'")
+
+    if curs.fetchone() is None or rebuild:
+        index = AvailabilityIndex.from_data_range(get_data_range())
+        index.to_sql(conn)
+        conn.commit()
+    else:
+        index = AvailabilityIndex.from_sql(conn)
+
+    conn.close()
+    return index
+
+
 def get_hydat_stations(to_csv=False, **q_kwargs) -> pd.DataFrame:
     """
     Retrieves HYDAT station data that have streamflow (Q) values.
@@ -959,6 +1019,8 @@ def hydat_create_data_range(unittest=False):
         out_data = pd.DataFrame(data=out_data)
         conn = sqlite3.connect(hydat_path)
         out_data.to_sql('Data_Range', conn, index=False, if_exists='replace')
+        # the availability index is built from Data_Range; see get_hydat_availability()
+        conn.execute('DROP TABLE IF EXISTS Availability')
         conn.close()
     
     return out_data
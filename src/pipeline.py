@@ -0,0 +1,354 @@
+import os
+import time
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import networkx as nx
+
+import gdf_utils
+import load_data
+
+
+"""
+Overview:
+
+Runs the matching pipeline (network construction and search) over
+parts of a river network in parallel worker processes.
+
+Functions that use worker processes must be called from within an
+'if __name__ == "__main__":' block of the calling script on platforms
+that start processes by spawning them (i.e. Windows), as each worker
+imports the calling script.
+"""
+
+
+# ========================================================================= ##
+# License ================================================================= ##
+# ========================================================================= ##
+
+# Copyright (c) 2023 James Wang - jcw4698(at)gmail.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# ========================================================================= ##
+# Basin Partitioning ====================================================== ##
+# ========================================================================= ##
+
+
+def basin_jobs(lines: gpd.GeoDataFrame, tables: dict, prefix1, prefix2, n_jobs,
+               method='auto') -> list:
+    """
+    Splits river segments and their station assignments into groups of
+    whole drainage basins (see gdf_utils.river_basins()) that can be
+    searched independently. Basins without both origin and candidate
+    stations are dropped, and the remaining basins are spread over
+    n_jobs groups of roughly equal numbers of segments.
+
+    :param lines: Geopandas GeoDataFrame
+        The river segments stations were assigned to.
+
+    :param tables: dict of {str: GeoDataFrame}
+        Station assignment tables keyed by prefix, as produced by
+        gdf_utils.assign_stations(as_table=True).
+
+    :param prefix1: string
+        Prefix of the origin stations.
+
+    :param prefix2: string
+        Prefix of the candidate stations.
+
+    :param n_jobs: int
+        Maximum number of groups to produce.
+
+    :param method: string (default='auto')
+        How to find basins; see gdf_utils.river_basins().
+
+    :return: list of tuple
+        (segments, tables) of each group, with tables holding only the
+        prefix1 and prefix2 stations assigned to those segments. The
+        segments of each group keep their order in lines.
+    """
+    basins = pd.Series(gdf_utils.river_basins(lines, method=method), index=lines.index)
+
+    # only basins holding both origin and candidate stations
+    keep = set(basins.loc[tables[prefix1]['edge_index']]) & \
+        set(basins.loc[tables[prefix2]['edge_index']])
+    sizes = basins[basins.isin(keep)].value_counts()
+
+    # largest basins first, each to the group with the fewest segments
+    loads = np.zeros(max(1, n_jobs))
+    groups = {}
+    for basin, size in sizes.items():
+        group = int(np.argmin(loads))
+        groups[basin] = group
+        loads[group] += size
+
+    group_of = basins.map(groups).to_numpy()
+    jobs = []
+    for group in range(len(loads)):
+        segments = lines[group_of == group]
+        if len(segments) == 0:
+            continue
+        sub_tables = {prefix: table[table['edge_index'].isin(segments.index)]
+                      for prefix, table in tables.items() if prefix in (prefix1, prefix2)}
+        jobs.append((segments, sub_tables))
+    return jobs
+
+
+def match_by_basin(lines: gpd.GeoDataFrame, tables: dict, prefix1, prefix2, workers=None,
+                   method='auto', contract=False, search=gdf_utils.dfs_search,
+                   **kwargs) -> gpd.GeoDataFrame:
+    """
+    Matches stations by building and searching the network of each
+    group of drainage basins (see basin_jobs()) in a pool of worker
+    processes, and merges the matches.
+
+    Since stations in different basins can never be matched, the
+    result holds the same matches as searching the network of all
+    lines at once, but each worker only holds the network of its own
+    basins. Matches are ordered by group, then by the order of the
+    segments of the group in lines.
+
+    i.e.
+    >>> lines, tables, topology = gdf_utils.network_snapshot({'hydat': hydat, 'pwqmn': pwqmn})
+    >>> matches = match_by_basin(lines, tables, 'hydat', 'pwqmn', max_distance=5000)
+
+    :param lines: Geopandas GeoDataFrame
+        The river segments stations were assigned to.
+
+    :param tables: dict of {str: GeoDataFrame}
+        Station assignment tables keyed by prefix, as produced by
+        gdf_utils.assign_stations(as_table=True).
+
+    :param prefix1: string
+        Prefix of the origin stations.
+
+    :param prefix2: string
+        Prefix of the candidate stations.
+
+    :param workers: int or None (default)
+        Number of worker processes. If None, uses the number of CPUs.
+        If 1, groups are searched in this process.
+
+    :param method: string (default='auto')
+        How to find basins; see gdf_utils.river_basins().
+
+    :param contract: bool (default=False)
+        If True, contract the network of each group; see
+        gdf_utils.contract_network().
+
+    :param search: function (default=gdf_utils.dfs_search)
+        The search to run on each network. Must be a module level
+        function accepting (network, prefix1, prefix2,
+        assignments=tables, **kwargs), such as gdf_utils.dfs_search()
+        or gdf_utils.nearest_search().
+
+    :param kwargs:
+        Additional arguments passed to search (i.e. max_distance).
+
+    :return: Geopandas GeoDataFrame
+        The merged matches; see gdf_utils.dfs_search().
+    """
+    workers = workers or os.cpu_count() or 1
+    # several groups per worker so a large basin does not hold up the
+    # rest of the pool
+    jobs = basin_jobs(lines, tables, prefix1, prefix2, n_jobs=workers * 4, method=method)
+    args = [(segments, sub_tables, prefix1, prefix2, contract, search, kwargs)
+            for segments, sub_tables in jobs]
+
+    print(f"Searching {len(jobs)} groups of basins with {workers} workers")
+    if workers == 1 or len(jobs) <= 1:
+        results = [_match_basins(*arg) for arg in args]
+    else:
+        with multiprocessing.Pool(min(workers, len(jobs))) as pool:
+            results = pool.starmap(_match_basins, args)
+
+    if not results:
+        return search(nx.MultiDiGraph(), prefix1, prefix2, assignments={}, **kwargs)
+    return gpd.GeoDataFrame(pd.concat(results, ignore_index=True), geometry='path',
+                            crs=results[0].crs)
+
+
+def _match_basins(segments, tables, prefix1, prefix2, contract, search, kwargs):
+    """
+    Builds and searches the network of a group of basins in a worker
+    process of match_by_basin().
+    """
+    network = gdf_utils.hyriv_gdf_to_network(segments, contract=contract, assignments=tables)
+    return search(network, prefix1, prefix2, assignments=tables, **kwargs)
+
+
+# ========================================================================= ##
+# Network Comparison ====================================================== ##
+# ========================================================================= ##
+
+
+def compare_networks(datasets: dict, station_sets: dict, prefix1, prefix2, bbox=None,
+                     reference=None, workers=None, snap_distance=750,
+                     search=gdf_utils.dfs_search, **kwargs):
+    """
+    Matches the same stations along several river networks and
+    combines the matches into a single table to compare them.
+
+    Each network is loaded, assigned stations, built and searched in
+    its own worker process. Match tables are merged into the
+    comparison table as each network finishes.
+
+    i.e.
+    >>> table, timings = compare_networks(
+    >>>     {'hyRivers': load_data.hydroRIVERS_path,
+    >>>      'OHN': {'path': ohn_path, 'max_depth': 100}},
+    >>>     {'hydat': hydat, 'pwqmn': pwqmn}, 'hydat', 'pwqmn', reference='OHN',
+    >>>     max_distance=10000)
+
+    :param datasets: dict of {str: string or dict}
+        River datasets keyed by network name. Values are either the
+        path of the dataset or a dict holding the path under 'path',
+        optionally the network construction method under 'method' (see
+        gdf_utils.hyriv_gdf_to_network()), and arguments passed to
+        search for that network only.
+
+    :param station_sets: dict of {str: GeoDataFrame}
+        Station sets keyed by prefix. Must include prefix1 and prefix2.
+
+    :param prefix1: string
+        Prefix of the origin stations.
+
+    :param prefix2: string
+        Prefix of the candidate stations.
+
+    :param bbox: BBox or None (default)
+        Area to load rivers within. If None, loads all rivers.
+
+    :param reference: string or None (default)
+        Name of the network to compare distances to. If passed, adds
+        an 'error_<name>' column for every other network:
+        (dist_<name> - dist_<reference>) / dist_<reference>
+
+    :param workers: int or None (default)
+        Number of worker processes. If None, uses 1 per network.
+
+    :param snap_distance: int (default=750)
+        The maximum distance within which to assign stations to
+        rivers. See gdf_utils.assign_stations().
+
+    :param search: function (default=gdf_utils.dfs_search)
+        The search to run on each network; see match_by_basin().
+
+    :param kwargs:
+        Additional arguments passed to search for every network.
+
+    :return: tuple of DataFrame
+        (table, timings)
+
+        table holds 1 row per pair of stations matched along any
+        network, with '<prefix1>_id' and '<prefix2>_id' columns and
+        every other match column (except 'path') suffixed by
+        '_<name>' for each network, in the order of datasets.
+
+        timings holds the time in seconds spent on each stage ('load',
+        'assign', 'network', 'search', and 'total') of each network,
+        indexed by network name.
+    """
+    names = list(datasets)
+    workers = workers or len(names)
+    args = []
+    for name, dataset in datasets.items():
+        if not isinstance(dataset, dict):
+            dataset = {'path': dataset}
+        dataset = dict(dataset)
+        path = dataset.pop('path')
+        method = dataset.pop('method', 'auto')
+        args.append((name, path, method, station_sets, prefix1, prefix2, bbox, snap_distance,
+                     search, {**kwargs, **dataset}))
+
+    keys = [f'{prefix1}_id', f'{prefix2}_id']
+    table = pd.DataFrame(columns=keys)
+    timings = {}
+
+    def add(name, matches, times):
+        nonlocal table
+        matches = pd.DataFrame(matches).drop(columns='path')
+        matches = matches.rename(columns={col: f'{col}_{name}' for col in matches.columns
+                                          if col not in keys})
+        table = table.merge(matches, how='outer', on=keys)
+        timings[name] = times
+        print(f"{name}: {len(matches)} matches; " +
+              ", ".join(f"{stage} {sec:.1f} s" for stage, sec in times.items()))
+
+    if workers == 1:
+        for arg in args:
+            add(*_run_network(*arg))
+    else:
+        with multiprocessing.Pool(min(workers, len(args))) as pool:
+            for result in pool.imap_unordered(_star_run_network, args):
+                add(*result)
+
+    # order columns by network, regardless of the order they finished in
+    columns = keys + [col for name in names for col in table.columns
+                      if col not in keys and col.endswith(f'_{name}')]
+    table = table[columns].sort_values(by=keys, ignore_index=True)
+
+    if reference is not None:
+        ref = table[f'dist_{reference}']
+        for name in names:
+            if name != reference:
+                table[f'error_{name}'] = (table[f'dist_{name}'] - ref) / ref
+
+    timings = pd.DataFrame.from_dict(timings, orient='index').reindex(names)
+    return table, timings
+
+
+def _star_run_network(args):
+    return _run_network(*args)
+
+
+def _run_network(name, path, method, station_sets, prefix1, prefix2, bbox, snap_distance,
+                 search, kwargs):
+    """
+    Loads a river dataset, assigns stations to it, builds its network
+    and searches it in a worker process of compare_networks().
+
+    :return: tuple
+        (name, matches, dict of stage timings)
+    """
+    times = {}
+    start = last = time.perf_counter()
+
+    def stage(label):
+        nonlocal last
+        now = time.perf_counter()
+        times[label] = now - last
+        last = now
+
+    lines = gdf_utils.to_lcc(load_data.load_rivers(path=path, bbox=bbox))
+    stage('load')
+    tables = gdf_utils.assign_stations_many(
+        lines, {prefix: station_sets[prefix] for prefix in (prefix1, prefix2)},
+        max_distance=snap_distance, as_table=True)
+    stage('assign')
+    network = gdf_utils.hyriv_gdf_to_network(lines, method=method)
+    stage('network')
+    matches = search(network, prefix1, prefix2, assignments=tables, **kwargs)
+    stage('search')
+    times['total'] = last - start
+
+    return name, matches, times
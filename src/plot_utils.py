@@ -1,7 +1,7 @@
 import os
 
 from load_data import proj_path
-from gen_util import lambert, geodetic, Can_LCC_wkt, BBox
+from gen_util import lambert, geodetic, Can_LCC_crs, BBox, to_lcc
 import gdf_utils
 
 import pandas as pd
@@ -155,7 +155,7 @@ def add_grid_to_plot(ax=None, projection=lambert, **kwargs):
     return gridliner
 
 
-def plot_g_series(g_series: gpd.GeoSeries, crs=Can_LCC_wkt, ax=None,
+def plot_g_series(g_series: gpd.GeoSeries, crs=Can_LCC_crs, ax=None,
                   marker="o", **kwargs):
     """
     Plot a Geopandas GeoSeries. Does not change the original GeoSeries
@@ -226,7 +226,7 @@ def draw_network(p_graph, **kwargs):
     gdf_utils.__draw_network__(p_graph, **kwargs)
 
 
-def plot_gdf(gdf: gpd.GeoDataFrame, crs=Can_LCC_wkt, ax=None, **kwargs):
+def plot_gdf(gdf: gpd.GeoDataFrame, crs=Can_LCC_crs, ax=None, **kwargs):
     """
     Plot a Geopandas GeoDataFrame. Does not change the original
     GeoDataFrame geometry.
@@ -408,7 +408,7 @@ def annotate_stations(*station_sets, adjust=True, ax=None):
         stations = stations.drop_duplicates(subset=['Station_ID'])
         
         # convert geometry to the desired crs
-        for ind, row in stations.to_crs(crs=Can_LCC_wkt).iterrows():
+        for ind, row in to_lcc(stations).iterrows():
             if not row['geometry'].is_empty:
                 # add the text to the plot and add the output to a list
                 texts.append(ax.text(row['geometry'].x, row['geometry'].y, row['Station_ID'],
@@ -446,19 +446,20 @@ def plot_match_array(match_df, timed=False):
         cur_ax = ax[n // shape[1]][n % shape[1]]
         cur_ax.set_box_aspect(1)
         
-        g_series = gpd.GeoSeries(group['path'], crs=Can_LCC_wkt)
+        g_series = gpd.GeoSeries(group['path'], crs=Can_LCC_crs)
         add_map_to_plot(extent=g_series.total_bounds, ax=cur_ax, extent_crs=lambert)
         add_grid_to_plot(ax=cur_ax)
         plot_paths(group, ax=cur_ax)
 
-        text = []
-        for ind, group_row in group.iterrows():
-            start, end = group_row['path'].boundary.geoms
-            cur_ax.scatter([start.x], [start.y], color='blue', zorder=6, marker='o')
-            text.append(cur_ax.text(start.x, start.y, group_row['hydat_id']))
+        starts, ends = gdf_utils.line_endpoints(group['path'])
+        cur_ax.scatter(starts[:, 0], starts[:, 1], color='blue', zorder=6, marker='o')
 
-        cur_ax.plot([end.x], [end.y], color='red', zorder=6, marker='o')
-        text.append(cur_ax.text(end.x, end.y, group_row['pwqmn_id']))
+        text = [cur_ax.text(x, y, hydat_id)
+                for (x, y), hydat_id in zip(starts, group['hydat_id'])]
+
+        end_x, end_y = ends[-1]
+        cur_ax.plot([end_x], [end_y], color='red', zorder=6, marker='o')
+        text.append(cur_ax.text(end_x, end_y, group['pwqmn_id'].iloc[-1]))
 
         adjust_text(text)
 
@@ -0,0 +1,391 @@
+import argparse
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+import gdf_utils
+import load_data
+from gen_util import BBox
+
+
+"""
+Overview:
+
+Long-running local matching service. Loads the rivers and station sets
+and builds the river network once, then answers snap, nearest, match
+and data overlap requests over HTTP on a local TCP port or Unix socket
+until stopped. Every request carries a batch of locations, stations or
+pairs that is processed in a single call. Separate requests are not
+coalesced on the server, so send many locations per request rather
+than many requests of 1 location. Requests are handled concurrently in
+separate threads; the loaded data is only read once built.
+
+Use client.py to send requests from Python.
+
+Usage:
+>>> python server.py --port 8765
+>>> python server.py --socket /tmp/mapping-stations.sock --bbox -80 -79 43 44
+
+Endpoints (requests and responses are JSON):
+
+GET  /status
+    Sizes of the loaded network and station sets.
+
+POST /snap      {"lon": [...], "lat": [...]}
+    River segment closest to each location.
+
+POST /nearest   {"station_set": "hydat", "lon": [...], "lat": [...],
+                 "direction": "either", "k": 1, "max_distance": null}
+    Nearest stations of a set along the network from each location.
+
+POST /match     {"station_set": "hydat", "stations": [{"Station_ID": ..., "lon": ..., "lat": ...}],
+                 "max_distance": 5000, "max_depth": 100, "max_matches": 10}
+    Upstream and downstream stations of a set matched to each station
+    with gdf_utils.dfs_search(), as in 6_find_streamflow_gauge.py.
+
+POST /overlap   {"set1": "hydat", "ids1": [...], "set2": "pwqmn", "ids2": [...]}
+    Number of days with data for both stations of each pair.
+
+Successful responses hold a "result" field; failed requests get a
+4xx/5xx status and an "error" field.
+"""
+
+
+# ========================================================================= ##
+# License ================================================================= ##
+# ========================================================================= ##
+
+# Copyright (c) 2023 James Wang - jcw4698(at)gmail.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# ========================================================================= ##
+# Service ================================================================= ##
+# ========================================================================= ##
+
+
+class MatchingService:
+    """
+    Class that holds a river network and station sets in memory and
+    answers matching requests against them. Built once; requests only
+    read from it, so a single instance can serve concurrent requests.
+
+    :param rivers: Geopandas GeoDataFrame
+        River LineStrings; see gdf_utils.NetworkQuery().
+
+    :param station_sets: dict of {str: GeoDataFrame}
+        Station Points keyed by set name. Each must contain a
+        'Station_ID' field.
+
+    :param data_ranges: dict of {str: DataFrame} or None (default)
+        Data ranges of the station sets keyed by set name, with
+        "Station_ID", "P_Start", "P_End" and "Num_Days" fields. Used
+        by overlap().
+
+    :param k: int (default=5)
+        Maximum number of stations that can be requested per location
+        and direction.
+
+    :param max_distance: float or None (default)
+        Default maximum distance along the network in meters.
+
+    :param snap_distance: int (default=750)
+        The maximum distance within which to snap stations and
+        locations to the network.
+    """
+    def __init__(self, rivers, station_sets: dict, data_ranges=None, k=5, max_distance=None,
+                 snap_distance=750):
+        # 1 network shared by every station set. It is not contracted,
+        # as the stations posted to match() may lie on any segment
+        self.query = gdf_utils.NetworkQuery(rivers, station_sets, k=k, max_distance=max_distance,
+                                            snap_distance=snap_distance, contract=False)
+        self.data_ranges = data_ranges or {}
+
+    @staticmethod
+    def from_data(rivers_path=load_data.hydroRIVERS_path, bbox=None, **kwargs):
+        """
+        Builds a MatchingService from the HYDAT and PWQMN stations and
+        data ranges and a river dataset.
+
+        :param rivers_path: string (default=load_data.hydroRIVERS_path)
+            The river dataset to load.
+
+        :param bbox: BBox or None (default)
+            Area to load rivers within. If None, loads all rivers.
+
+        :param kwargs:
+            Additional arguments passed to MatchingService().
+
+        :return: MatchingService
+        """
+        rivers = load_data.load_rivers(path=rivers_path, bbox=bbox)
+        station_sets = {
+            'hydat': gdf_utils.point_gdf_from_df(load_data.get_hydat_stations()),
+            'pwqmn': gdf_utils.point_gdf_from_df(load_data.get_pwqmn_stations())
+        }
+        data_ranges = {
+            'hydat': load_data.get_hydat_data_range(),
+            'pwqmn': load_data.get_pwqmn_data_range()
+        }
+        return MatchingService(rivers, station_sets, data_ranges=data_ranges, **kwargs)
+
+    def status(self) -> dict:
+        """
+        :return: dict
+            Number of river segments and network edges, and number of
+            assigned stations of each set.
+        """
+        return {'segments': len(self.query.segment_index),
+                'edges': self.query.network.number_of_edges(),
+                'sets': {name: {'stations': len(index.candidates)}
+                         for name, index in self.query.candidate_indexes.items()}}
+
+    def snap(self, lon, lat) -> pd.DataFrame:
+        """
+        Finds the river segment closest to each location. See
+        gdf_utils.NetworkQuery.snap().
+        """
+        return self.query.snap(lon, lat)
+
+    def nearest(self, station_set, lon, lat, direction='either', k=1,
+                max_distance=None) -> pd.DataFrame:
+        """
+        Finds the nearest stations of a set along the network to each
+        location. See gdf_utils.NetworkQuery.query().
+        """
+        return self.query.query(lon, lat, direction=direction, k=k,
+                                max_distance=max_distance, station_set=station_set)
+
+    def match(self, station_set, stations, max_distance=5000, max_depth=100,
+              max_matches=10) -> pd.DataFrame:
+        """
+        Matches each station to the upstream and downstream stations of
+        a set with gdf_utils.dfs_search(), as 6_find_streamflow_gauge.py
+        does. The posted stations are snapped to the network and
+        searched from as the 'origin' prefix.
+
+        :param station_set: string
+            Name of the station set to match to.
+
+        :param stations: list of dict
+            Stations to match, each with 'Station_ID', 'lon' and 'lat'.
+
+        :param max_distance: float (default=5000)
+            Maximum distance along the network in meters.
+
+        :param max_depth: int (default=100)
+            Maximum number of river segments to traverse.
+
+        :param max_matches: int (default=10)
+            Approximate maximum number of stations to match per station.
+
+        :return: DataFrame
+            Matches of each station; see gdf_utils.dfs_search(). The
+            'path' of each match is encoded as WKT (in Can_LCC_wkt).
+        """
+        if station_set not in self.query.assignments:
+            raise KeyError(f"Unknown station set '{station_set}'.")
+        if station_set == 'origin':
+            raise ValueError("The station set 'origin' cannot be matched to; the posted "
+                             "stations use that prefix.")
+
+        stations = pd.DataFrame(stations, columns=['Station_ID', 'lon', 'lat'])
+        origin = gpd.GeoDataFrame(stations[['Station_ID']], crs=4326,
+                                  geometry=gpd.points_from_xy(stations['lon'], stations['lat']))
+        tables = {'origin': gdf_utils.assign_stations(self.query.segment_index, origin,
+                                                      prefix='origin',
+                                                      max_distance=self.query.snap_distance,
+                                                      as_table=True),
+                  station_set: self.query.assignments[station_set]}
+        matches = gdf_utils.dfs_search(self.query.network, 'origin', station_set,
+                                       max_distance=max_distance, max_depth=max_depth,
+                                       max_matches=max_matches, assignments=tables)
+        return pd.DataFrame(matches).assign(path=shapely.to_wkt(matches['path'].to_numpy()))
+
+    def overlap(self, set1, ids1, set2, ids2) -> pd.DataFrame:
+        """
+        Calculates the number of days with data for both stations of
+        each pair. See gdf_utils.assign_period_overlap().
+
+        :return: DataFrame
+            '<set1>_id', '<set2>_id', 'data_overlap',
+            'total_<set1>_records' and 'total_<set2>_records' of each
+            pair.
+        """
+        for name in (set1, set2):
+            if name not in self.data_ranges:
+                raise KeyError(f"No data ranges loaded for station set '{name}'.")
+        pairs = pd.DataFrame({f'{set1}_id': ids1, f'{set2}_id': ids2})
+        return gdf_utils.assign_period_overlap(pairs, set1, self.data_ranges[set1],
+                                               set2, self.data_ranges[set2])
+
+
+# ========================================================================= ##
+# HTTP Server ============================================================= ##
+# ========================================================================= ##
+
+
+def to_json(result) -> bytes:
+    """
+    Encodes a service result as JSON. DataFrames are encoded as lists
+    of records.
+    """
+    def default(obj):
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        return str(obj)
+
+    if isinstance(result, pd.DataFrame):
+        result = result.to_dict('records')
+    return json.dumps({'result': result}, default=default).encode('utf-8')
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Dispatches requests to the MatchingService of the server. Request
+    bodies are passed to the service method of the same name as the
+    path as keyword arguments.
+    """
+    endpoints = {'/snap': 'snap', '/nearest': 'nearest', '/match': 'match',
+                 '/overlap': 'overlap'}
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.respond(200, to_json(self.server.service.status()))
+        else:
+            self.error(404, f"Unknown endpoint '{self.path}'.")
+
+    def do_POST(self):
+        if self.path not in self.endpoints:
+            self.error(404, f"Unknown endpoint '{self.path}'.")
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            kwargs = json.loads(self.rfile.read(length) or b'{}')
+            result = getattr(self.server.service, self.endpoints[self.path])(**kwargs)
+        except (ValueError, KeyError, TypeError) as e:
+            self.error(400, f"{type(e).__name__}: {e}")
+            return
+        except Exception as e:
+            self.error(500, f"{type(e).__name__}: {e}")
+            return
+        self.respond(200, to_json(result))
+
+    def respond(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, code, message):
+        self.respond(code, json.dumps({'error': message}).encode('utf-8'))
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """
+    Threaded HTTP server listening on a Unix socket.
+    """
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def make_server(service: MatchingService, host='127.0.0.1', port=8765, socket_path=None):
+    """
+    Creates a server answering requests with service. Call
+    serve_forever() on the result to start serving.
+
+    :param service: MatchingService
+        The service to answer requests with.
+
+    :param host: string (default='127.0.0.1')
+        Address to listen on. Ignored if socket_path is passed.
+
+    :param port: int (default=8765)
+        Port to listen on. Ignored if socket_path is passed.
+
+    :param socket_path: string or None (default)
+        If passed, listen on a Unix socket at this path instead of a
+        TCP port.
+
+    :return: ThreadingHTTPServer or UnixHTTPServer
+    """
+    if socket_path is not None:
+        server = UnixHTTPServer(socket_path, RequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RequestHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+
+# ========================================================================= ##
+# Script ================================================================== ##
+# ========================================================================= ##
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve station matching requests.")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on.")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on.")
+    parser.add_argument('--socket', default=None, dest='socket_path',
+                        help="Listen on a Unix socket at this path instead of a port.")
+    parser.add_argument('--rivers', default=load_data.hydroRIVERS_path,
+                        help="River dataset to build the network from.")
+    parser.add_argument('--bbox', type=float, nargs=4, default=None,
+                        metavar=('MIN_X', 'MAX_X', 'MIN_Y', 'MAX_Y'),
+                        help="Longitude/latitude bounds to load rivers within.")
+    parser.add_argument('-k', type=int, default=5,
+                        help="Maximum number of stations per location and direction.")
+    args = parser.parse_args()
+
+    start = time.time()
+    bbox = None if args.bbox is None else BBox(*args.bbox)
+    service = MatchingService.from_data(rivers_path=args.rivers, bbox=bbox, k=args.k)
+    server = make_server(service, host=args.host, port=args.port, socket_path=args.socket_path)
+
+    where = args.socket_path or f"http://{args.host}:{args.port}"
+    print(f"Loaded in {time.time() - start:.1f} s; serving on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket_path is not None and os.path.exists(args.socket_path):
+            os.remove(args.socket_path)